@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+背景透過処理のマイクロベンチマーク
+従来の浮動小数点版（np.mean / np.std）と、stamp_pipeline の整数カーネルを
+シートサイズの入力で比較し、実行時間と確保メモリ（tracemalloc のピーク）を表示します。
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from stamp_pipeline import load_sheet, make_params, remove_background
+
+
+def legacy_remove_background(data, params):
+    """
+    従来の実装（process_stamps_improved.py / fix_problem_stamps.py / process_stamps_manual.py）
+    """
+    threshold = params['threshold']
+    if params['background'] == 'mean_std':
+        rgb_mean = np.mean(data[:, :, :3], axis=2)
+        rgb_std = np.std(data[:, :, :3], axis=2)
+        white_areas = (rgb_mean >= threshold) & (rgb_std < params['std_limit'])
+    elif params['background'] == 'mean':
+        white_areas = np.mean(data[:, :, :3], axis=2) >= threshold
+    else:
+        white_areas = (data[:, :, 0] >= threshold) & \
+                      (data[:, :, 1] >= threshold) & \
+                      (data[:, :, 2] >= threshold)
+    data[white_areas] = [255, 255, 255, 0]
+    return data
+
+
+def synthetic_sheet(width, height, seed=0):
+    """
+    白背景に色付きの矩形と白に近いノイズを散らしたシート
+    """
+    rng = np.random.default_rng(seed)
+    sheet = np.full((height, width, 4), 255, dtype=np.uint8)
+    sheet[:, :, :3] -= rng.integers(0, 40, size=(height, width, 3), dtype=np.uint8)
+    for _ in range(64):
+        x, y = rng.integers(0, width - 64), rng.integers(0, height - 64)
+        w, h = rng.integers(32, max(33, width // 6)), rng.integers(32, max(33, height // 6))
+        sheet[y:y + h, x:x + w, :3] = rng.integers(0, 256, size=3, dtype=np.uint8)
+    return sheet
+
+
+def measure(func, source, params, repeat):
+    """
+    (最速の実行時間[秒], tracemalloc のピーク[バイト], 結果) を返す
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        data = source.copy()
+        start = time.perf_counter()
+        func(data, params)
+        best = min(best, time.perf_counter() - start)
+
+    data = source.copy()
+    tracemalloc.start()
+    func(data, params)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, data
+
+
+def main():
+    parser = argparse.ArgumentParser(description='背景透過処理のベンチマーク')
+    parser.add_argument('--input', default='../temporary_upload/名称未設定.png', help='実シート画像（省略可）')
+    parser.add_argument('--size', type=int, default=4096, help='合成シートの一辺（px）')
+    parser.add_argument('--repeat', type=int, default=5, help='計測回数（最速値を採用）')
+    args = parser.parse_args()
+
+    inputs = [(f"synthetic {args.size}x{args.size}", synthetic_sheet(args.size, args.size))]
+    try:
+        sheet = load_sheet(args.input)
+        inputs.insert(0, (f"sheet {sheet.shape[1]}x{sheet.shape[0]}", sheet))
+    except OSError:
+        print(f"⚠️ 実シートが読み込めないため合成シートのみ計測します: {args.input}")
+
+    modes = [
+        make_params(background='mean_std', threshold=230),
+        make_params(background='mean', threshold=220),
+        make_params(background='min', threshold=230),
+    ]
+
+    print(f"{'input':<22} {'mode':<9} {'legacy ms':>10} {'kernel ms':>10} {'speedup':>8} "
+          f"{'legacy MB':>10} {'kernel MB':>10}  same")
+    for label, source in inputs:
+        for params in modes:
+            legacy_time, legacy_peak, expected = measure(legacy_remove_background, source, params, args.repeat)
+            kernel_time, kernel_peak, actual = measure(remove_background, source, params, args.repeat)
+            same = np.array_equal(expected, actual)
+            print(f"{label:<22} {params['background']:<9} {legacy_time * 1000:>10.1f} {kernel_time * 1000:>10.1f} "
+                  f"{legacy_time / kernel_time:>7.1f}x {legacy_peak / 2**20:>10.1f} {kernel_peak / 2**20:>10.1f}  "
+                  f"{'✅' if same else '❌'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+スタンプ抽出パイプラインのステージ別ベンチマーク
+合成シート（大きさ・セル数を指定可能）を作り、デコード・切り出し・背景透過・
+自動クロップ・リサイズ・エンコードの各ステージの時間を別々に計測します。
+
+結果は JSON で保存でき、--compare で以前の結果と比べて遅くなったステージを検出します。
+--reducing-gap を指定すると2段階の縮小を計測し、1段階の LANCZOS との差（PSNR）も確かめます。
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from PIL import Image, ImageDraw
+import numpy as np
+import PIL
+
+from stamp_pipeline import auto_crop_content, crop_cell, encode_image, fit_to_canvas, grid_rects, make_params, psnr, \
+    remove_background
+
+STAGES = ['decode', 'crop', 'remove_background', 'auto_crop', 'resize', 'encode']
+
+
+def synthetic_stamp_sheet(width, height, rows, cols, seed=0):
+    """
+    白背景のグリッドに、輪郭線付きの楕円・多角形のキャラクター風スタンプを並べたシート
+    """
+    rng = np.random.default_rng(seed)
+    sheet = Image.new('RGB', (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(sheet)
+    cell_w, cell_h = width // cols, height // rows
+
+    for row in range(rows):
+        for col in range(cols):
+            left, top = col * cell_w, row * cell_h
+            cx, cy = left + cell_w / 2, top + cell_h / 2
+            rx, ry = cell_w * rng.uniform(0.2, 0.35), cell_h * rng.uniform(0.2, 0.35)
+            body = tuple(int(v) for v in rng.integers(60, 230, size=3))
+            draw.ellipse((cx - rx, cy - ry, cx + rx, cy + ry), fill=body, outline=(40, 40, 40),
+                         width=max(2, cell_w // 80))
+            for _ in range(3):
+                points = [(cx + rng.uniform(-rx, rx), cy + rng.uniform(-ry, ry)) for _ in range(3)]
+                draw.polygon(points, fill=tuple(int(v) for v in rng.integers(0, 256, size=3)))
+            eye = max(2, int(rx / 8))
+            for dx in (-rx / 3, rx / 3):
+                draw.ellipse((cx + dx - eye, cy - ry / 4 - eye, cx + dx + eye, cy - ry / 4 + eye), fill=(20, 20, 20))
+
+    data = np.array(sheet)
+    data = np.clip(data.astype(np.int16) - rng.integers(0, 6, size=data.shape), 0, 255).astype(np.uint8)
+    return Image.fromarray(data, 'RGB')
+
+
+def encode_sheet(image):
+    """
+    シートを PNG のバイト列にする（デコード時間を計測するため）
+    """
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def run_once(sheet_png, cells, params):
+    """
+    パイプラインを1回通し、ステージごとの所要時間（秒）を返す
+    """
+    times = dict.fromkeys(STAGES, 0.0)
+
+    start = time.perf_counter()
+    with Image.open(io.BytesIO(sheet_png)) as image:
+        sheet = np.array(image.convert('RGBA'))
+    times['decode'] = time.perf_counter() - start
+
+    for cell in cells:
+        start = time.perf_counter()
+        data = crop_cell(sheet, cell)
+        mid = time.perf_counter()
+        times['crop'] += mid - start
+
+        remove_background(data, params)
+        start = time.perf_counter()
+        times['remove_background'] += start - mid
+
+        content = auto_crop_content(data, params)
+        mid = time.perf_counter()
+        times['auto_crop'] += mid - start
+
+        image = fit_to_canvas(Image.fromarray(content, 'RGBA'), params)
+        start = time.perf_counter()
+        times['resize'] += start - mid
+
+        encode_image(image, params)
+        times['encode'] += time.perf_counter() - start
+
+    return times
+
+
+def resize_quality(sheet_png, cells, params):
+    """
+    2段階の縮小と1段階の LANCZOS の結果を比べ、セルごとの PSNR（プリマルチプライドRGBA, dB）の最小値を返す
+    """
+    with Image.open(io.BytesIO(sheet_png)) as image:
+        sheet = np.array(image.convert('RGBA'))
+
+    single_params = dict(params, reducing_gap=None)
+    worst = float('inf')
+    for cell in cells:
+        data = crop_cell(sheet, cell)
+        remove_background(data, params)
+        content = auto_crop_content(data, params)
+        single = fit_to_canvas(Image.fromarray(content, 'RGBA'), single_params)
+        reduced = fit_to_canvas(Image.fromarray(content, 'RGBA'), params)
+        worst = min(worst, psnr(np.asarray(single.convert('RGBa'), dtype=np.float32),
+                                np.asarray(reduced.convert('RGBa'), dtype=np.float32)))
+    return worst
+
+
+def summarize(samples, cell_count):
+    """
+    ステージごとの計測値（秒のリスト）を集計する（ミリ秒）
+    """
+    summary = {}
+    for stage in STAGES + ['total']:
+        values = [sample[stage] * 1000 for sample in samples]
+        summary[stage] = {
+            'min_ms': round(min(values), 3),
+            'median_ms': round(statistics.median(values), 3),
+            'mean_ms': round(statistics.fmean(values), 3),
+            'per_cell_ms': round(min(values) / max(1, cell_count), 3),
+        }
+    return summary
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pillow': PIL.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(current, baseline, tolerance):
+    """
+    以前の結果と比べ、中央値が tolerance（%）以上遅くなったステージを返す
+    """
+    regressions = []
+    for stage, stats in current['stages'].items():
+        before = baseline.get('stages', {}).get(stage)
+        if not before or before['median_ms'] <= 0:
+            continue
+        change = (stats['median_ms'] / before['median_ms'] - 1) * 100
+        print(f"  {stage:<18} {before['median_ms']:>10.2f} → {stats['median_ms']:>10.2f} ms ({change:+.1f}%)")
+        if change > tolerance:
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='パイプラインのステージ別ベンチマーク')
+    parser.add_argument('--width', type=int, default=2048, help='合成シートの幅（px）')
+    parser.add_argument('--height', type=int, default=1536, help='合成シートの高さ（px）')
+    parser.add_argument('--rows', type=int, default=3, help='セルの行数')
+    parser.add_argument('--cols', type=int, default=4, help='セルの列数')
+    parser.add_argument('--seed', type=int, default=0, help='合成シートの乱数シード')
+    parser.add_argument('--repeat', type=int, default=5, help='計測回数')
+    parser.add_argument('--warmup', type=int, default=1, help='計測前の空回し回数')
+    parser.add_argument('--encoders', default='png', help='エンコーダの候補（カンマ区切り）')
+    parser.add_argument('--reducing-gap', type=float, default=None,
+                        help='2段階の縮小で整数倍の縮小を止める倍率（仕上がりサイズ比）')
+    parser.add_argument('--json', default=None, help='結果を保存する JSON ファイル')
+    parser.add_argument('--compare', default=None, help='比較する以前の結果（JSON）')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='遅くなったとみなす割合（%%）')
+    args = parser.parse_args()
+
+    params = make_params(encoders=args.encoders.split(','), reducing_gap=args.reducing_gap)
+    sheet = synthetic_stamp_sheet(args.width, args.height, args.rows, args.cols, args.seed)
+    sheet_png = encode_sheet(sheet)
+    rects = grid_rects(sheet.size, args.rows, args.cols, margin_ratio=0.05)
+    cells = [{'x': x, 'y': y, 'w': w, 'h': h} for x, y, w, h in rects]
+
+    print(f"🧪 合成シート {args.width}x{args.height}、{len(cells)} セル、{args.repeat} 回計測")
+    for _ in range(args.warmup):
+        run_once(sheet_png, cells, params)
+
+    samples = []
+    for _ in range(args.repeat):
+        times = run_once(sheet_png, cells, params)
+        times['total'] = sum(times.values())
+        samples.append(times)
+
+    result = {
+        'config': {
+            'width': args.width,
+            'height': args.height,
+            'rows': args.rows,
+            'cols': args.cols,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'encoders': params['encoders'],
+            'reducing_gap': params['reducing_gap'],
+        },
+        'environment': environment(),
+        'stages': summarize(samples, len(cells)),
+    }
+
+    print(f"{'stage':<18} {'min ms':>10} {'median ms':>10} {'per cell':>10}")
+    for stage, stats in result['stages'].items():
+        print(f"{stage:<18} {stats['min_ms']:>10.2f} {stats['median_ms']:>10.2f} {stats['per_cell_ms']:>10.2f}")
+
+    if args.reducing_gap is not None:
+        result['resize_psnr_min'] = round(resize_quality(sheet_png, cells, params), 2)
+        print(f"🔍 1段階の LANCZOS との差: 最小 PSNR {result['resize_psnr_min']:.1f} dB")
+        if result['resize_psnr_min'] < params['min_psnr']:
+            print(f"⚠️ 品質の下限（{params['min_psnr']} dB）を下回っています")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"💾 結果を保存しました: {args.json}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('config') != result['config']:
+            print("⚠️ 比較対象と計測条件が異なります")
+        print(f"📊 {args.compare} との比較（中央値）")
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ {args.tolerance:.0f}% 以上遅くなったステージ: {', '.join(regressions)}")
+            sys.exit(1)
+        print("✅ 遅くなったステージはありません")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+出力したスタンプの品質を調べるスクリプト
+public/images/stamps 以下の画像の指標（coverage, bbox_fill, halo, 基準画像との SSIM）を
+まとめて求め、合格の条件を満たさない画像を表示します。
+指標は画像の中身のハッシュごとにキャッシュし、変わっていない画像は読み直しません。
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import time
+
+from stamp_pipeline import (
+    DEFAULT_GOLDEN_DIR,
+    DEFAULT_QUALITY_CACHE_PATH,
+    golden_path_for,
+    list_images,
+    measure_images,
+    print_quality,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='出力したスタンプの品質を調べます')
+    parser.add_argument('--root', default='../public/images/stamps', help='調べるディレクトリ（atlas/ と retina/ は除く）')
+    parser.add_argument('--golden', default=DEFAULT_GOLDEN_DIR,
+                        help='基準画像のディレクトリ（root からの相対パスで置く。ない画像は SSIM を求めない）')
+    parser.add_argument('--update-golden', action='store_true', help='今の画像を基準画像としてコピーする')
+    parser.add_argument('--cache', default=DEFAULT_QUALITY_CACHE_PATH, help='指標のキャッシュファイル')
+    parser.add_argument('--no-cache', action='store_true', help='キャッシュを使わずに全画像の指標を求める')
+    parser.add_argument('--strict', action='store_true', help='不合格の画像があれば終了コード1で終了する')
+    return parser.parse_args()
+
+
+def update_golden(paths, root, golden_dir):
+    for path in paths:
+        golden_path = golden_path_for(path, root, golden_dir)
+        os.makedirs(os.path.dirname(golden_path), exist_ok=True)
+        shutil.copyfile(path, golden_path)
+    print(f"📌 {len(paths)} 枚の画像を基準画像にしました: {golden_dir}")
+
+
+def main():
+    args = parse_args()
+
+    if not os.path.isdir(args.root):
+        print(f"エラー: ディレクトリが見つかりません: {args.root}")
+        sys.exit(1)
+
+    paths = list_images(args.root)
+    if args.update_golden:
+        update_golden(paths, args.root, args.golden)
+
+    start = time.perf_counter()
+    measured = measure_images(paths, args.root, args.golden, None if args.no_cache else args.cache)
+    elapsed = time.perf_counter() - start
+    failed = print_quality(measured, args.root)
+    print(f"\n📊 {len(paths)} 枚の画像を調べました（{elapsed:.3f} 秒）")
+
+    if not failed:
+        print("✅ すべての画像が合格しました")
+        return
+
+    print(f"⚠️ {len(failed)} 枚の画像が不合格です")
+    if args.strict:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,8 @@ import sys
 from PIL import Image
 import numpy as np
 
+from stamp_pipeline import segment_stamps
+
 def debug_area(original_image, x, y, w, h, name):
     """
     指定エリアをデバッグ
@@ -119,19 +121,13 @@ def main():
     else:
         print("❌ 誕生日スタンプの修正に失敗しました")
     
-    # 全体的にもう一度他の位置も試してみる
-    print("\n🔍 他の可能性のある位置も確認...")
-    
-    # 最後の列のスタンプ位置を調整して確認
-    alternative_positions = [
-        {'name': '右上(調整1)', 'x': 1850, 'y': 10, 'w': 650, 'h': 340},
-        {'name': '右上(調整2)', 'x': 1900, 'y': 20, 'w': 600, 'h': 320},
-    ]
+    # 候補位置を1つずつ試す代わりに、シート全体を連結成分で切り分けて確認
+    print("\n🔍 シート全体からスタンプの位置を検出...")
     
-    for pos in alternative_positions:
-        content = debug_area(original_image, pos['x'], pos['y'], pos['w'], pos['h'], pos['name'])
-        if content:
-            print(f"  ✅ {pos['name']} で有効なコンテンツを発見")
+    sheet = np.array(original_image.convert('RGBA'))
+    for cell in segment_stamps(sheet):
+        print(f"  ✅ 行{cell['row']+1}列{cell['col']+1}: "
+              f"({cell['x']}, {cell['y']}) - {cell['w']} x {cell['h']}")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
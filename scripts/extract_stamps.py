@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+スタンプシートからスタンプを一括抽出するスクリプト
+シートを1回だけ読み込み、セルごとの処理を複数プロセスで並列実行します。
+--max-memory を指定すると、巨大なシートもバンド単位で逐次デコードします。
+--watch を指定すると、シートの変更を監視して変わったスタンプだけを出力し直します。
+--manifest を指定すると、マニフェスト（manifests/*.json）のセルと id の対応で出力します。
+--hashed を指定すると、ハッシュ付きファイル名のコピーと id → URL のマニフェストも書き出します。
+"""
+
+import argparse
+import os
+import sys
+import time
+from PIL import Image
+
+from stamp_pipeline import (
+    AO_COLS,
+    AO_ROWS,
+    AO_STAMPS,
+    AUTO_THRESHOLD,
+    DEFAULT_CACHE_PATH,
+    DEFAULT_GOLDEN_DIR,
+    DEFAULT_LAYOUT_INDEX_PATH,
+    DEFAULT_QUALITY_CACHE_PATH,
+    STAMPS_TS_PATH,
+    build_cells,
+    detect_grid,
+    detected_cells,
+    extract_sheets,
+    extract_stamps,
+    grid_cells,
+    grid_rects,
+    inset_rect,
+    iter_changes,
+    list_sheets,
+    load_sheet,
+    load_sheet_cached,
+    make_params,
+    manifest_layout,
+    measure_images,
+    new_sheet_cache,
+    output_extension,
+    output_paths,
+    print_quality,
+    publish_hashed,
+    read_stamp_defs,
+    segment_stamps,
+    start_pool,
+    write_atlases,
+    write_trace,
+)
+
+
+def threshold_arg(value):
+    return value if value == AUTO_THRESHOLD else int(value)
+
+
+def reducing_gap_arg(value):
+    gap = float(value)
+    if gap < 1.0:
+        raise argparse.ArgumentTypeError('1.0 以上を指定してください')
+    return gap
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='スタンプシートからスタンプを抽出します')
+    parser.add_argument('--input', default='../temporary_upload/名称未設定.png', help='入力シート画像')
+    parser.add_argument('--output', default=None,
+                        help='出力ディレクトリ（既定: ../public/images/stamps/ao、--input-dir のときは ../public/images/stamps）')
+    parser.add_argument('--input-dir', default=None, help='ディレクトリ内の全シートをまとめて処理する（シートごとにサブディレクトリへ出力）')
+    parser.add_argument('--batch-size', type=int, default=64, help='--input-dir で1回にまとめて処理するセル数')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='ワーカープロセス数（既定: CPU数、1でシリアル処理）')
+    layout = parser.add_mutually_exclusive_group()
+    layout.add_argument('--detect', action='store_true', help='セル位置を余白から自動検出する（固定グリッドを使わない）')
+    layout.add_argument('--segment', action='store_true', help='連結成分からスタンプを切り分ける（グリッドに並んでいないシート用）')
+    parser.add_argument('--margin', type=int, default=30, help='セルの四辺から削る余白（px）')
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help='インクリメンタルビルド用キャッシュファイル')
+    parser.add_argument('--no-cache', action='store_true', help='キャッシュを使わずに全セルを処理する')
+    parser.add_argument('--io-threads', type=int, default=0,
+                        help='エンコード・保存を行うスレッド数（次のセルの計算と重ねる。0 でメインスレッドで順に保存）')
+    parser.add_argument('--max-memory', type=float, default=None,
+                        help='シートをバンド単位で逐次デコードし、作業メモリをこの値（MB）以内に抑える')
+    parser.add_argument('--retina', action='store_true',
+                        help='@2x（256px）も retina/ 以下に出力する（1x は @2x を縮小して作る）')
+    parser.add_argument('--atlas', action='store_true',
+                        help='出力したスタンプを密度ごとにアトラス（stamps/atlas/<キャラクター>.png と座標JSON）にまとめる')
+    parser.add_argument('--encoders', default='png',
+                        help='エンコーダの候補（カンマ区切り: png, png8 / webp_lossless, webp）。'
+                             '品質の下限を満たす最小の結果を選ぶ')
+    parser.add_argument('--min-psnr', type=float, default=35.0, help='非可逆エンコードの品質の下限（dB）')
+    parser.add_argument('--trace', default=None,
+                        help='スタンプごと・ステージごとの計測結果を Chrome のトレース形式（JSON）で保存する'
+                             '（--watch では処理し直すたびに上書きする）')
+    parser.add_argument('--threshold', type=threshold_arg, default=230,
+                        help="白色の閾値（'auto' ならセルごとのヒストグラムから決める）")
+    parser.add_argument('--fill', choices=['global', 'border'], default='global',
+                        help='border ならセルの四辺からつながる白だけを透過する（内側の白を残す）')
+    parser.add_argument('--matte', choices=['hard', 'soft'], default='hard',
+                        help='soft なら輪郭を半透明にして白いフチを除く')
+    parser.add_argument('--threshold-method', choices=['valley', 'otsu'], default='valley',
+                        help='--threshold auto のときの決め方')
+    parser.add_argument('--manifest', default=None,
+                        help='マニフェスト（セル → id → ファイル名 → 上書き設定の JSON）に従って出力する')
+    parser.add_argument('--layout-index', default=DEFAULT_LAYOUT_INDEX_PATH,
+                        help='マニフェストをコンパイルしたレイアウトのインデックス（--no-cache なら使わない）')
+    parser.add_argument('--watch', action='store_true',
+                        help='シート（--input または --input-dir）の変更を監視し、変わったスタンプだけを出力し直す')
+    parser.add_argument('--quality', action='store_true',
+                        help='出力後に品質指標（背景の抜け残り・白いフチ・基準画像との SSIM）を調べ、不合格があれば終了コード1で終了する')
+    parser.add_argument('--golden', default=DEFAULT_GOLDEN_DIR,
+                        help='--quality で SSIM を比べる基準画像のディレクトリ（スタンプのルートからの相対パスで置く）')
+    parser.add_argument('--reducing-gap', type=reducing_gap_arg, default=None,
+                        help='整数倍の縮小で仕上がりサイズのこの倍率まで縮めてから LANCZOS をかける（大きなセル向け、例: 3）')
+    parser.add_argument('--whole-sheet', action='store_true',
+                        help='シート全体を1回で背景透過し、セルはビューから切り詰める（固定の閾値・global・hard のとき）')
+    parser.add_argument('--hashed', action='store_true',
+                        help='出力後にハッシュ付きファイル名のコピーと id → URL のマニフェスト（assets.json）を書き出す')
+    parser.add_argument('--watch-interval', type=float, default=0.3, help='--watch で変更を調べる間隔（秒）')
+    args = parser.parse_args()
+
+    # 組み合わせられないオプションは黙って無視せずにエラーにする
+    if args.manifest:
+        if args.watch:
+            parser.error('--manifest と --watch は同時に指定できません')
+        if args.input_dir:
+            parser.error('--manifest ではシートをマニフェストで指定するため、--input-dir は使えません')
+        if args.detect or args.segment:
+            parser.error('--manifest ではレイアウトをマニフェストで指定するため、--detect / --segment は使えません')
+    if args.watch and args.max_memory is not None:
+        parser.error('--watch ではデコードしたシートを使い回すため、--max-memory は使えません')
+    return args
+
+
+def build_params(args):
+    params = make_params(threshold=args.threshold, threshold_method=args.threshold_method, fill=args.fill,
+                         matte=args.matte, retina=args.retina, encoders=args.encoders.split(','),
+                         min_psnr=args.min_psnr, reducing_gap=args.reducing_gap)
+    try:
+        output_extension(params)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    return params
+
+
+def save_trace(path, events):
+    write_trace(path, events)
+    print(f"🔬 トレースを保存しました: {path}（chrome://tracing または https://ui.perfetto.dev で開けます）")
+
+
+def build_atlases(output_dirs, params):
+    """
+    出力ディレクトリごとにアトラスを作る（stamps.ts があればその id だけを入れる）
+
+    Returns:
+        すべて作れたら True
+    """
+    stamp_defs = read_stamp_defs() if os.path.exists(STAMPS_TS_PATH) else None
+    ok = True
+    for output_dir in output_dirs:
+        try:
+            write_atlases(output_dir, params, stamp_defs)
+        except ValueError as e:
+            print(f"❌ アトラスの作成に失敗しました: {e}")
+            ok = False
+    return ok
+
+
+def check_outputs(args, results, root):
+    """
+    --quality のとき、保存した画像（@2x を含む）の品質指標を調べ、不合格があれば終了コード1で終了する
+
+    基準画像は --golden の下に root（スタンプのルート）からの相対パスで探します。
+    """
+    if not args.quality:
+        return
+    paths = [path for result in results if result['error'] is None for path in output_paths(result).values()]
+    print("\n🔍 品質を確認しています...")
+    cache = None if args.no_cache else DEFAULT_QUALITY_CACHE_PATH
+    failed = print_quality(measure_images(paths, root, args.golden, cache), root)
+    if failed:
+        print(f"❌ {len(failed)} 枚の画像が品質の基準を満たしません")
+        sys.exit(1)
+
+
+def publish_outputs(args, root):
+    """
+    --hashed のとき、スタンプのルート以下をハッシュ付きファイル名で公開する
+    """
+    if not args.hashed:
+        return
+    stamp_defs = read_stamp_defs() if os.path.exists(STAMPS_TS_PATH) else None
+    info = publish_hashed(root, stamp_defs)
+    print(f"🔖 ハッシュ付きファイル名で公開しました: {info['manifest']}"
+          f"（{info['files']} 個、新規 {info['written']} 個、削除 {info['removed']} 個）")
+    if info['missing']:
+        print(f"⚠️ stamps.ts の id のうち画像がないもの: {', '.join(info['missing'])}")
+
+
+def batch_layout(args):
+    """
+    --input-dir のシートのセル定義を返す関数（ファイル名は仮のもの）
+    """
+    def layout(sheet):
+        if args.detect:
+            return detected_cells(detect_grid(sheet))
+        if args.segment:
+            return detected_cells(segment_stamps(sheet))
+        size = (sheet.shape[1], sheet.shape[0])
+        return detected_cells(grid_cells(size, AO_ROWS, AO_COLS, args.margin))
+    return layout
+
+
+def named_cells(args, sheet, size):
+    """
+    --input のシートのセル定義（スタンプ定義のファイル名を使う）
+    """
+    if args.detect or args.segment:
+        detected = detect_grid(sheet) if args.detect else segment_stamps(sheet)
+        print(f"🔍 {len(detected)} 個のセルを検出しました")
+        if len(detected) != len(AO_STAMPS):
+            print(f"⚠️ 検出数がスタンプ定義 ({len(AO_STAMPS)} 個) と一致しないため、仮のファイル名で保存します")
+        return detected_cells(detected, AO_STAMPS)
+    rects = [inset_rect(rect, args.margin) for rect in grid_rects(size, AO_ROWS, AO_COLS)]
+    return build_cells(AO_STAMPS, rects)
+
+
+def main_watch(args):
+    """
+    シートの変更を監視し、変わったシートのうち絵が変わったセルだけを処理し直す
+    """
+    if args.input_dir:
+        targets = [args.input_dir]
+        output_root = args.output or '../public/images/stamps'
+        layout = batch_layout(args)
+    else:
+        targets = [args.input]
+        output_dir = args.output or '../public/images/stamps/ao'
+
+    params = build_params(args)
+    # 変わっていないセルを飛ばすにはキャッシュが必要
+    cache = None if args.no_cache else args.cache
+    sheets = new_sheet_cache()
+    executor = start_pool(args.workers)
+
+    print(f"👀 {', '.join(targets)} を監視しています（Ctrl+C で終了）")
+    try:
+        for paths in iter_changes(targets, args.watch_interval):
+            for path in paths:
+                start = time.perf_counter()
+                name = os.path.basename(path)
+                try:
+                    sheet, decoded = load_sheet_cached(sheets, path)
+                except Exception as e:
+                    print(f"❌ {name} の読み込みに失敗しました: {e}")
+                    continue
+                if sheet is None:
+                    print(f"⏭️ {name}: 中身が変わっていません")
+                    continue
+
+                if args.input_dir:
+                    cells = layout(sheet)
+                    sheet_output = os.path.join(output_root, os.path.splitext(name)[0])
+                else:
+                    cells = named_cells(args, sheet, (sheet.shape[1], sheet.shape[0]))
+                    sheet_output = output_dir
+                trace = [] if args.trace else None
+                results = extract_stamps(sheet, cells, sheet_output, params,
+                                         workers=args.workers, cache=cache, trace=trace, executor=executor,
+                                         io_threads=args.io_threads, whole_sheet=args.whole_sheet)
+                if trace is not None:
+                    # 最後に処理し直したシートの計測結果で上書きする
+                    save_trace(args.trace, trace)
+
+                updated = sum(1 for result in results if not result['cached'] and not result.get('unchanged'))
+                if args.atlas and updated:
+                    build_atlases([sheet_output], params)
+                if updated:
+                    publish_outputs(args, os.path.dirname(os.path.normpath(sheet_output)))
+                print(f"🔁 {name}: {updated}/{len(results)} 個を更新しました "
+                      f"({time.perf_counter() - start:.2f} 秒{'' if decoded else '、デコード省略'})")
+    except KeyboardInterrupt:
+        print("\n👋 監視を終了します")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def main_manifest(args):
+    """
+    マニフェストを検証・コンパイルし、そのセル定義で出力する
+    """
+    index = None if args.no_cache else args.layout_index
+    try:
+        manifest, sheet, cells, warnings, indexed = manifest_layout(args.manifest, index)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    for warning in warnings:
+        print(f"⚠️ {warning}")
+    print(f"📋 {args.manifest}: {len(cells)} 個のスタンプ"
+          f"（{'インデックスのレイアウトを使用' if indexed else 'レイアウトを求めてインデックスに保存'}）")
+
+    params = dict(build_params(args), **manifest['params'])
+    output_dir = args.output or manifest['output']
+    cache = None if args.no_cache else args.cache
+    # インデックスを使った場合はシートをまだデコードしていないので、逐次デコードできる
+    streaming = args.max_memory is not None and isinstance(sheet, str)
+    max_memory = int(args.max_memory * 1024 * 1024) if streaming else None
+    trace = [] if args.trace else None
+    results = extract_stamps(sheet, cells, output_dir, params, workers=args.workers, cache=cache,
+                             max_memory=max_memory, trace=trace, io_threads=args.io_threads,
+                             whole_sheet=args.whole_sheet)
+    if trace is not None:
+        save_trace(args.trace, trace)
+
+    if args.atlas and not build_atlases([output_dir], params):
+        sys.exit(1)
+
+    processed_count = sum(1 for result in results if result['error'] is None)
+    print(f"\n🎉 処理完了! {processed_count}/{len(cells)} 個のスタンプを処理しました。")
+    root = os.path.dirname(os.path.normpath(output_dir))
+    check_outputs(args, results, root)
+    publish_outputs(args, root)
+
+
+def main_batch(args):
+    sheets = list_sheets(args.input_dir)
+    if not sheets:
+        print(f"エラー: シート画像が見つかりません: {args.input_dir}")
+        sys.exit(1)
+
+    print(f"🎨 {len(sheets)} 枚のシートをまとめて処理します...")
+    if args.whole_sheet or args.max_memory is not None:
+        print("⚠️ --input-dir ではシートごとに読み込んだセルをまとめて背景透過するため、"
+              "--whole-sheet / --max-memory は使われません")
+
+    params = build_params(args)
+    cache = None if args.no_cache else args.cache
+    trace = [] if args.trace else None
+    all_results = extract_sheets(sheets, args.output or '../public/images/stamps', batch_layout(args), params,
+                                 workers=args.workers, cache=cache, batch_size=args.batch_size, trace=trace,
+                                 io_threads=args.io_threads)
+    if trace is not None:
+        save_trace(args.trace, trace)
+
+    if args.atlas:
+        output_dirs = [os.path.dirname(results[0]['path']) for results in all_results.values() if results]
+        if not build_atlases(output_dirs, params):
+            sys.exit(1)
+
+    total = sum(len(results) for results in all_results.values())
+    processed_count = sum(1 for results in all_results.values() for result in results if result['error'] is None)
+    print(f"\n🎉 処理完了! {processed_count}/{total} 個のスタンプを処理しました。")
+    root = args.output or '../public/images/stamps'
+    check_outputs(args, [result for results in all_results.values() for result in results], root)
+    publish_outputs(args, root)
+
+
+def main():
+    args = parse_args()
+
+    if args.manifest:
+        main_manifest(args)
+        return
+
+    if args.watch:
+        main_watch(args)
+        return
+
+    if args.input_dir:
+        main_batch(args)
+        return
+
+    if not os.path.exists(args.input):
+        print(f"エラー: 入力ファイルが見つかりません: {args.input}")
+        sys.exit(1)
+
+    print("🎨 スタンプの抽出を開始します...")
+
+    # 自動検出にはシート全体が必要。固定グリッドで上限が指定されていればサイズだけ読む
+    streaming = args.max_memory is not None and not (args.detect or args.segment)
+    try:
+        if streaming:
+            with Image.open(args.input) as image:
+                size = image.size
+            sheet = args.input
+        else:
+            sheet = load_sheet(args.input)
+            size = (sheet.shape[1], sheet.shape[0])
+        print(f"✅ 画像を読み込みました: {size[0]}x{size[1]}")
+    except Exception as e:
+        print(f"❌ 画像の読み込みに失敗しました: {e}")
+        sys.exit(1)
+
+    if args.max_memory is not None and not streaming:
+        print("⚠️ --detect / --segment ではシート全体を読み込むため、--max-memory は使われません")
+
+    cells = named_cells(args, sheet, size)
+    params = build_params(args)
+
+    cache = None if args.no_cache else args.cache
+    max_memory = int(args.max_memory * 1024 * 1024) if streaming else None
+    output_dir = args.output or '../public/images/stamps/ao'
+    trace = [] if args.trace else None
+    try:
+        results = extract_stamps(sheet, cells, output_dir, params, workers=args.workers, cache=cache,
+                                 max_memory=max_memory, trace=trace, io_threads=args.io_threads,
+                                 whole_sheet=args.whole_sheet)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if trace is not None:
+        save_trace(args.trace, trace)
+
+    if args.atlas and not build_atlases([output_dir], params):
+        sys.exit(1)
+
+    processed_count = sum(1 for result in results if result['error'] is None)
+    print(f"\n🎉 処理完了! {processed_count}/{len(cells)} 個のスタンプを処理しました。")
+    root = os.path.dirname(os.path.normpath(output_dir))
+    check_outputs(args, results, root)
+    publish_outputs(args, root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+重複・プレースホルダーのスタンプを探すスクリプト
+public/images/stamps 以下の画像の知覚ハッシュを求め、同じ絵（コピーしたプレースホルダーや、
+ファイル名の衝突で上書きされたもの）や空の画像をまとめて表示します。
+ハッシュはインデックスに保存し、変わっていない画像は読み直しません。
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from stamp_pipeline import DEFAULT_PHASH_INDEX_PATH, DUPLICATE_RADIUS, HASH_KINDS, find_duplicates, list_images, \
+    update_index
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='重複・プレースホルダーのスタンプを探します')
+    parser.add_argument('--root', default='../public/images/stamps', help='調べるディレクトリ（atlas/ と retina/ は除く）')
+    parser.add_argument('--hash', choices=HASH_KINDS, default='phash', help='比べる知覚ハッシュ')
+    parser.add_argument('--radius', type=int, default=DUPLICATE_RADIUS,
+                        help='同じ絵とみなすハミング距離の上限（64ビット中）')
+    parser.add_argument('--index', default=DEFAULT_PHASH_INDEX_PATH, help='ハッシュのインデックスファイル')
+    parser.add_argument('--no-index', action='store_true', help='インデックスを使わずに全画像のハッシュを求める')
+    parser.add_argument('--strict', action='store_true', help='重複が見つかったら終了コード1で終了する')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if not os.path.isdir(args.root):
+        print(f"エラー: ディレクトリが見つかりません: {args.root}")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    paths = list_images(args.root)
+    hashes, hashed = update_index(paths, None if args.no_index else args.index)
+    groups = find_duplicates(hashes, args.hash, args.radius)
+    print(f"📊 {len(paths)} 枚の画像を調べました（ハッシュを求めたのは {hashed} 枚、"
+          f"{time.perf_counter() - start:.2f} 秒）")
+
+    for group in groups:
+        if group['blank']:
+            print("\n⬜ 空の画像:")
+        elif group['identical']:
+            print("\n🔁 中身が同じファイル（プレースホルダーのコピーなど）:")
+        else:
+            print(f"\n🪞 よく似た画像（{args.hash} の距離 {group['distance']} 以内）:")
+        for path in group['paths']:
+            print(f"  - {os.path.relpath(path, args.root)}")
+
+    if not groups:
+        print("✅ 重複は見つかりませんでした")
+        return
+
+    print(f"\n⚠️ {len(groups)} 組の重複が見つかりました")
+    if args.strict:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
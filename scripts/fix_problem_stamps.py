@@ -1,116 +1,52 @@
 #!/usr/bin/env python3
 """
 問題のあるスタンプ（ao_birthday, ao_love）を手動で修正
+閾値はセルごとの明るさのヒストグラムから自動で決めます（閾値を下げての再試行は行いません）。
 """
 
-import os
 import sys
-from PIL import Image
-import numpy as np
 
-def process_specific_stamp(original_image, x, y, w, h, name, output_path):
+from stamp_pipeline import DEFAULT_CACHE_PATH, DEFAULT_GOLDEN_DIR, DEFAULT_QUALITY_CACHE_PATH, check_quality, \
+    choose_threshold, crop_cell, extract_stamps, feature_histogram, inset_rect, load_sheet, make_params, \
+    measure_images, surviving_pixels
+
+# 以前は 220 → 200 の順に再試行していた閾値（参考として残るピクセル数を表示する）
+LEGACY_THRESHOLDS = (220, 200)
+
+
+def report_thresholds(sheet, cell, params):
     """
-    特定のスタンプを慎重に処理
+    ヒストグラムを1回だけ作り、そこから決めた閾値と各閾値で残るピクセル数を表示する
+
+    Returns:
+        自動で決めた閾値（抽出ではヒストグラムを作り直さずにこの値を使う）
     """
-    print(f"🔄 {name} スタンプを処理中...")
-    
-    # より大きな範囲で切り出し（余白を多めに）
-    margin = 20
-    cropped = original_image.crop((
-        max(0, x - margin), 
-        max(0, y - margin), 
-        min(original_image.width, x + w + margin), 
-        min(original_image.height, y + h + margin)
-    ))
-    
-    print(f"  切り出しサイズ: {cropped.size}")
-    
-    # RGBAに変換
-    if cropped.mode != 'RGBA':
-        cropped = cropped.convert('RGBA')
-    
-    data = np.array(cropped)
-    
-    # より緩い条件で背景除去（白の閾値を下げる）
-    threshold = 220  # より緩い閾値
-    
-    # RGB値の平均を計算
-    rgb_mean = np.mean(data[:, :, :3], axis=2)
-    
-    # 非常に明るい色（白っぽい）のみを透過に
-    white_mask = rgb_mean >= threshold
-    
-    # マスクを適用
-    data[white_mask] = [255, 255, 255, 0]
-    
-    # 画像に戻す
-    result = Image.fromarray(data, 'RGBA')
-    
-    # 非透明部分を検出
-    alpha = np.array(result)[:, :, 3]
-    non_transparent = np.where(alpha > 50)  # より高い閾値で検出
-    
-    if len(non_transparent[0]) == 0:
-        print(f"  ⚠️ 警告: {name} で非透明部分が見つかりません。閾値を調整します。")
-        
-        # より緩い条件で再試行
-        data = np.array(cropped)
-        threshold = 200  # さらに緩い閾値
-        rgb_mean = np.mean(data[:, :, :3], axis=2)
-        white_mask = rgb_mean >= threshold
-        data[white_mask] = [255, 255, 255, 0]
-        result = Image.fromarray(data, 'RGBA')
-        
-        alpha = np.array(result)[:, :, 3]
-        non_transparent = np.where(alpha > 30)
-    
-    # コンテンツ部分をクロップ
-    if len(non_transparent[0]) > 0:
-        top = non_transparent[0].min()
-        bottom = non_transparent[0].max()
-        left = non_transparent[1].min()
-        right = non_transparent[1].max()
-        
-        # 余白を追加
-        padding = 15
-        top = max(0, top - padding)
-        bottom = min(result.height - 1, bottom + padding)
-        left = max(0, left - padding)
-        right = min(result.width - 1, right + padding)
-        
-        content_cropped = result.crop((left, top, right + 1, bottom + 1))
-        print(f"  コンテンツサイズ: {content_cropped.size}")
-    else:
-        content_cropped = result
-        print(f"  ⚠️ 自動クロップできませんでした。元のサイズを使用: {result.size}")
-    
-    # 128x128にリサイズ
-    content_cropped.thumbnail((110, 110), Image.Resampling.LANCZOS)
-    
-    # 最終画像を作成
-    final_image = Image.new('RGBA', (128, 128), (255, 255, 255, 0))
-    x_pos = (128 - content_cropped.width) // 2
-    y_pos = (128 - content_cropped.height) // 2
-    final_image.paste(content_cropped, (x_pos, y_pos), content_cropped)
-    
-    # 保存
-    final_image.save(output_path, 'PNG', optimize=True)
-    file_size = os.path.getsize(output_path)
-    print(f"✅ {name} 保存完了: {file_size} bytes")
-    
-    return file_size > 1000  # 1KB以上なら成功
+    data = crop_cell(sheet, cell)
+    histogram, fixed = feature_histogram(data, params)
+    threshold = choose_threshold(histogram, params)
+
+    print(f"🔄 {cell['name']} スタンプ: 切り出しサイズ {data.shape[1]}x{data.shape[0]}")
+    for candidate in LEGACY_THRESHOLDS:
+        print(f"  従来の閾値 {candidate}: 残るピクセル {surviving_pixels(histogram, fixed, candidate)}")
+    print(f"  自動の閾値 {threshold}: 残るピクセル {surviving_pixels(histogram, fixed, threshold)}")
+
+    if surviving_pixels(histogram, fixed, threshold) == 0:
+        print(f"  ⚠️ 警告: {cell['name']} で非透明部分が見つかりません")
+    return threshold
+
 
 def main():
     input_file = '../temporary_upload/名称未設定.png'
+    stamps_root = '../public/images/stamps'
     output_dir = '../public/images/stamps/ao'
-    
+
     try:
-        original_image = Image.open(input_file)
-        print(f"✅ 画像を読み込みました: {original_image.size}")
+        sheet = load_sheet(input_file)
+        print(f"✅ 画像を読み込みました: ({sheet.shape[1]}, {sheet.shape[0]})")
     except Exception as e:
         print(f"❌ 画像の読み込みに失敗しました: {e}")
         sys.exit(1)
-    
+
     # 問題のあるスタンプの座標
     problem_stamps = [
         {
@@ -130,23 +66,41 @@ def main():
             'filename': 'ao_love.png'
         }
     ]
-    
+
+    # より大きな範囲で切り出し（余白を多めに）
+    margin = 20
+    cells = []
     for stamp in problem_stamps:
-        output_path = os.path.join(output_dir, stamp['filename'])
-        success = process_specific_stamp(
-            original_image,
-            stamp['x'],
-            stamp['y'],
-            stamp['w'],
-            stamp['h'],
-            stamp['name'],
-            output_path
-        )
-        
-        if not success:
-            print(f"❌ {stamp['name']} の処理に失敗しました。手動確認が必要です。")
-    
+        x, y, w, h = inset_rect((stamp['x'], stamp['y'], stamp['w'], stamp['h']), -margin)
+        cells.append({'name': stamp['name'], 'filename': stamp['filename'], 'x': x, 'y': y, 'w': w, 'h': h})
+
+    params = make_params(
+        background='mean',
+        threshold='auto',
+        alpha_cutoff=50,
+        padding=15,
+        fit_size=110,
+        canvas_size=128,
+    )
+
+    for cell in cells:
+        cell['params'] = {'threshold': report_thresholds(sheet, cell, params)}
+
+    results = extract_stamps(sheet, cells, output_dir, params, cache=DEFAULT_CACHE_PATH)
+
+    # ファイルサイズではなく、背景の抜け残り・白いフチ・基準画像との SSIM などの品質指標で確かめる
+    saved = [result['path'] for result in results if result['error'] is None]
+    measured = measure_images(saved, stamps_root, DEFAULT_GOLDEN_DIR, DEFAULT_QUALITY_CACHE_PATH)
+    for result in results:
+        if result['error'] is not None:
+            print(f"❌ {result['name']} の処理に失敗しました。手動確認が必要です。")
+            continue
+        problems = check_quality(measured[result['path']])
+        if problems:
+            print(f"❌ {result['name']} の品質が基準を満たしません（{', '.join(problems)}）。手動確認が必要です。")
+
     print("\n🎉 問題スタンプの修正完了!")
 
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,44 @@
+"""
+スタンプ切り出しパイプライン
+
+シート画像からスタンプを切り出し、背景透過・リサイズして保存する共通処理です。
+各スクリプト（process_stamps_*.py など）はこのパッケージを利用します。
+"""
+
+from .atlas import build_atlas, pack_rects, write_atlases
+from .batch import batch_content_bounds, extract_sheets, list_sheets, mask_batch
+from .cache import DEFAULT_CACHE_PATH, cell_key, load_cache, save_cache, write_if_changed
+from .core import (
+    DEFAULT_PARAMS,
+    auto_crop_content,
+    background_mask,
+    content_bounds,
+    encode_png,
+    finish_cell,
+    fit_to_canvas,
+    make_params,
+    process_cell,
+    reduce_thumbnail,
+    remove_background,
+)
+from .encode import ENCODERS, encode_image, output_extension, psnr, strip_metadata
+from .engine import can_mask_sheet, cell_view, crop_cell, extract_stamps, iter_crops, iter_rendered, \
+    iter_written, iter_written_threaded, load_sheet, mask_whole_sheet, output_paths, render_cell, retina_dir_for, \
+    retina_filename, skip_cached, summarize_outputs
+from .grid import DEFAULT_GRID_PARAMS, detect_grid, find_runs, foreground_mask
+from .layouts import AO_COLS, AO_ROWS, AO_STAMPS, STAMPS_TS_PATH, build_cells, detected_cells, grid_cells, \
+    grid_rects, inset_rect, read_stamp_defs
+from .manifest import DEFAULT_LAYOUT_INDEX_PATH, compile_manifest, load_manifest, locate_cells, manifest_layout, \
+    validate_manifest
+from .phash import DEFAULT_PHASH_INDEX_PATH, DUPLICATE_RADIUS, HASH_KINDS, find_duplicates, hash_images, list_images, \
+    near_pairs, update_index
+from .quality import DEFAULT_GOLDEN_DIR, DEFAULT_QUALITY_CACHE_PATH, QUALITY_LIMITS, check_quality, golden_path_for, \
+    measure_images, measure_stack, print_quality
+from .segment import DEFAULT_SEGMENT_PARAMS, segment_components, segment_stamps
+from .shared import attach_sheet, release_sheet, share_sheet, start_tracker
+from .stages import CELL_STAGES, CONTENT_STAGES, IO_STAGES, run_stages, split_io_stages
+from .store import ASSET_MANIFEST_NAME, HASHED_DIR, content_hash, hashed_filename, publish_hashed
+from .threshold import AUTO_THRESHOLD, choose_threshold, feature_histogram, resolve_threshold, surviving_pixels
+from .tiled import can_stream, iter_bands, iter_cells
+from .trace import traced, write_trace
+from .watch import iter_changes, load_sheet_cached, new_sheet_cache, scan_sheets, start_pool
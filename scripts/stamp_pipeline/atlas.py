@@ -0,0 +1,303 @@
+"""
+スタンプのスプライトアトラス
+
+キャラクター・密度ごとに出力済みのスタンプを1枚の画像に詰め込み、
+id → x/y/w/h の座標JSONを書き出します。詰め込みはスカイライン法
+（高い順に、いちばん低く左の位置へ置く）で、いくつかの幅を試して正方形に近いものを選びます。
+"""
+
+import json
+import math
+import os
+
+from PIL import Image
+
+from .cache import write_if_changed
+from .core import DEFAULT_PARAMS
+from .encode import encode_image, output_extension
+from .engine import retina_dir_for
+
+# スプライトどうしの間隔（隣の絵がにじまないように空ける）
+ATLAS_PADDING = 2
+
+# モバイルのGPUで扱えるテクスチャの一辺の上限
+ATLAS_MAX_SIZE = 4096
+
+# 公開ディレクトリ（scripts/ から実行したときのパス）
+PUBLIC_ROOT = '../public'
+
+SPRITE_EXTENSIONS = ('.png', '.webp')
+
+
+def _skyline_fit(skyline, index, width, atlas_width):
+    # skyline[index] の左端から幅 width を置いたときの y（はみ出すなら None）
+    x = skyline[index][0]
+    if x + width > atlas_width:
+        return None
+    y = 0
+    remaining = width
+    for seg_x, seg_y, seg_w in skyline[index:]:
+        y = max(y, seg_y)
+        remaining -= seg_w
+        if remaining <= 0:
+            break
+    return y
+
+
+def _skyline_place(skyline, x, y, width):
+    # 幅 width・上端 y の段を置いてスカイラインを更新する
+    right = x + width
+    updated = []
+    for seg_x, seg_y, seg_w in skyline:
+        seg_right = seg_x + seg_w
+        if seg_right <= x or seg_x >= right:
+            updated.append((seg_x, seg_y, seg_w))
+            continue
+        if seg_x < x:
+            updated.append((seg_x, seg_y, x - seg_x))
+        if seg_right > right:
+            updated.append((right, seg_y, seg_right - right))
+    updated.append((x, y, width))
+    updated.sort()
+
+    merged = [updated[0]]
+    for seg in updated[1:]:
+        last = merged[-1]
+        if seg[1] == last[1]:
+            merged[-1] = (last[0], last[1], last[2] + seg[2])
+        else:
+            merged.append(seg)
+    return merged
+
+
+def skyline_pack(sizes, atlas_width, padding=0):
+    """
+    幅を固定して矩形を詰め込む
+
+    Args:
+        sizes: (幅, 高さ) のリスト
+        atlas_width: アトラスの幅
+        padding: 矩形どうしの間隔
+
+    Returns:
+        (各矩形の (x, y) のリスト, アトラスの高さ)。入りきらない矩形があれば None
+    """
+    skyline = [(0, 0, atlas_width + padding)]
+    positions = [None] * len(sizes)
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0], i))
+
+    height = 0
+    for i in order:
+        width = sizes[i][0] + padding
+        best = None
+        for index in range(len(skyline)):
+            y = _skyline_fit(skyline, index, width, atlas_width + padding)
+            if y is not None and (best is None or (y, skyline[index][0]) < best):
+                best = (y, skyline[index][0])
+        if best is None:
+            return None
+
+        y, x = best
+        positions[i] = (x, y)
+        skyline = _skyline_place(skyline, x, y + sizes[i][1] + padding, width)
+        height = max(height, y + sizes[i][1])
+    return positions, height
+
+
+def pack_rects(sizes, padding=ATLAS_PADDING, max_size=ATLAS_MAX_SIZE):
+    """
+    アトラスの幅をいくつか試し、長辺が最短（同じなら面積が最小）の詰め込みを選ぶ
+
+    Returns:
+        (各矩形の (x, y) のリスト, (幅, 高さ))
+
+    Raises:
+        ValueError: max_size の正方形に収まらない場合
+    """
+    if not sizes:
+        return [], (0, 0)
+
+    widest = max(w for w, _ in sizes)
+    area = sum((w + padding) * (h + padding) for w, h in sizes)
+    side = math.isqrt(area)
+    widths = {widest, max_size}
+    for scale in (1.0, 1.1, 1.25, 1.5, 2.0):
+        widths.add(min(max_size, max(widest, int(side * scale))))
+
+    best = None
+    for width in sorted(widths):
+        packed = skyline_pack(sizes, width, padding)
+        if packed is None:
+            continue
+        positions, height = packed
+        used_width = max(x + w for (x, _), (w, _) in zip(positions, sizes))
+        if height > max_size:
+            continue
+        score = (max(used_width, height), used_width * height)
+        if best is None or score < best[0]:
+            best = (score, positions, (used_width, height))
+
+    if best is None:
+        raise ValueError(f"スタンプが {max_size}x{max_size} のアトラスに収まりません")
+    return best[1], best[2]
+
+
+def sprite_id(filename):
+    """
+    画像ファイル名からスタンプの id を得る（ao_hello@2x.png → ao_hello）
+    """
+    stem = os.path.splitext(filename)[0]
+    return stem[:-3] if stem.endswith('@2x') else stem
+
+
+def list_sprites(directory):
+    """
+    ディレクトリ内のスタンプ画像を {id: パス} で返す（ファイル名順）
+    """
+    sprites = {}
+    for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        if entry.is_file() and entry.name.lower().endswith(SPRITE_EXTENSIONS):
+            sprites.setdefault(sprite_id(entry.name), entry.path)
+    return sprites
+
+
+def public_url(path, public_root=PUBLIC_ROOT):
+    """
+    公開ディレクトリ以下のファイルならアプリから参照するURL、そうでなければファイル名
+    """
+    relative = os.path.relpath(os.path.abspath(path), os.path.abspath(public_root))
+    if relative.startswith('..'):
+        return os.path.basename(path)
+    return '/' + relative.replace(os.sep, '/')
+
+
+def build_atlas(sprites, atlas_path, params=None, density=1, padding=ATLAS_PADDING, max_size=ATLAS_MAX_SIZE):
+    """
+    スタンプ画像を1枚のアトラスにまとめ、画像と座標JSON（拡張子 .json）を保存する
+
+    Args:
+        sprites: {id: 画像のパス}
+        atlas_path: アトラス画像の保存先
+        params: エンコードに使う処理パラメータ（省略時は DEFAULT_PARAMS）
+        density: 密度（1 または 2）。JSON の 'scale' に入れる
+
+    Returns:
+        保存したJSONと同じ内容の辞書（'image', 'scale', 'width', 'height', 'frames'）
+    """
+    if params is None:
+        params = DEFAULT_PARAMS
+
+    images = {}
+    for stamp_id, path in sprites.items():
+        with Image.open(path) as image:
+            images[stamp_id] = image.convert('RGBA')
+
+    ids = list(images)
+    positions, (width, height) = pack_rects([images[i].size for i in ids], padding, max_size)
+
+    atlas = Image.new('RGBA', (max(1, width), max(1, height)), (255, 255, 255, 0))
+    frames = {}
+    for stamp_id, (x, y) in zip(ids, positions):
+        image = images[stamp_id]
+        atlas.paste(image, (x, y))
+        frames[stamp_id] = {'x': x, 'y': y, 'w': image.width, 'h': image.height}
+
+    os.makedirs(os.path.dirname(atlas_path) or '.', exist_ok=True)
+    encoded = encode_image(atlas, params)
+    write_if_changed(atlas_path, encoded['data'])
+
+    info = {
+        'image': public_url(atlas_path),
+        'scale': density,
+        'width': atlas.width,
+        'height': atlas.height,
+        'frames': frames,
+    }
+    text = json.dumps(info, indent=2, ensure_ascii=False) + '\n'
+    write_if_changed(os.path.splitext(atlas_path)[0] + '.json', text.encode('utf-8'))
+    info['size'] = len(encoded['data'])
+    return info
+
+
+def atlas_path_for(output_dir, params, density=1):
+    """
+    アトラスの保存先（stamps/ao → stamps/atlas/ao.png、@2x は ao@2x.png）
+    """
+    output_dir = os.path.normpath(output_dir)
+    character = os.path.basename(output_dir)
+    suffix = '@2x' if density == 2 else ''
+    return os.path.join(os.path.dirname(output_dir), 'atlas', f"{character}{suffix}{output_extension(params)}")
+
+
+def _character(stamp):
+    # stamps.ts の src（/images/stamps/ao/ao_hello.png）からキャラクターのディレクトリ名を得る
+    return os.path.basename(os.path.dirname(stamp.get('src', '')))
+
+
+def defined_sprites(sprites, stamp_defs, character):
+    """
+    stamps.ts にあるキャラクターのスタンプだけを {id: パス} で返す（stamps.ts の順）
+
+    画像は stamps.ts の src のファイル名（拡張子と @2x を除く）で探します。
+    stamps.ts にない画像（以前の出力の残りなど）はアトラスに入れません。
+
+    Raises:
+        ValueError: stamps.ts の id のうち画像がないものがある場合
+    """
+    selected = {}
+    missing = []
+    for stamp in stamp_defs:
+        if _character(stamp) != character:
+            continue
+        path = sprites.get(sprite_id(os.path.basename(stamp['src'])))
+        if path is None:
+            missing.append(stamp['id'])
+        else:
+            selected[stamp['id']] = path
+    if missing:
+        raise ValueError(f"stamps.ts の id のうち画像がないもの: {', '.join(missing)}")
+    return selected
+
+
+def write_atlases(output_dir, params=None, stamp_defs=None):
+    """
+    出力ディレクトリ（と @2x の retina ディレクトリ）のスタンプからアトラスを作る
+
+    stamp_defs（read_stamp_defs() の結果）を渡すと、同じキャラクターの stamps.ts の id だけを
+    アトラスに入れます。画像がない id があれば、どのアトラスも書かずに ValueError を送出します。
+
+    Returns:
+        密度ごとの build_atlas() の結果のリスト
+    """
+    if params is None:
+        params = DEFAULT_PARAMS
+
+    output_dir = os.path.normpath(output_dir)
+    character = os.path.basename(output_dir)
+    densities = [(1, output_dir)]
+    retina_dir = retina_dir_for(output_dir)
+    if params['retina'] or os.path.isdir(retina_dir):
+        densities.append((2, retina_dir))
+
+    # 書き始める前にすべての密度の画像がそろっているかを確かめる
+    planned = []
+    for density, directory in densities:
+        sprites = list_sprites(directory) if os.path.isdir(directory) else {}
+        if stamp_defs is not None:
+            try:
+                sprites = defined_sprites(sprites, stamp_defs, character)
+            except ValueError as e:
+                raise ValueError(f"{directory}: {e}") from None
+        if sprites:
+            planned.append((density, sprites))
+    if not planned and stamp_defs is not None:
+        print(f"⏭️ stamps.ts に {character} のスタンプがないため、アトラスを作りません")
+
+    atlases = []
+    for density, sprites in planned:
+        atlas_path = atlas_path_for(output_dir, params, density)
+        info = build_atlas(sprites, atlas_path, params, density)
+        atlases.append(info)
+        print(f"🧩 アトラス: {atlas_path} ({info['width']}x{info['height']}, "
+              f"{len(info['frames'])} 個, {info['size']} bytes)")
+    return atlases
@@ -0,0 +1,238 @@
+"""
+ディレクトリ内の複数シートをまとめて処理するバッチモード
+
+シートを1枚ずつ読みながら、セルを大きさ（と処理パラメータ）ごとのバケットに分け、
+同じバケットのセルを (N, H, W, 4) の配列に積み重ねます。背景透過とコンテンツ範囲の検出は
+バッチごとに1回のベクトル演算で行い、セルごとの Python ループや変換を省きます。
+"""
+
+import os
+
+import numpy as np
+
+from .cache import load_cache, save_cache
+from .core import DEFAULT_PARAMS, TRANSPARENT_WHITE, remove_background
+from .engine import cell_params, check_cache, crop_cell, iter_written, iter_written_threaded, load_sheet, new_result, \
+    print_results, render_content, resolve_workers, run_bounded
+from .stages import CONTENT_STAGES, run_stages, split_io_stages
+from .threshold import AUTO_THRESHOLD
+from .trace import trace_render_content, trace_run_stages, traced
+
+SHEET_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+# セルの大きさをこの単位に切り上げて同じバッチにまとめる
+BUCKET_STEP = 32
+
+
+def list_sheets(directory):
+    """
+    ディレクトリ内のシート画像をファイル名順に返す
+    """
+    paths = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.lower().endswith(SHEET_EXTENSIONS):
+            paths.append(entry.path)
+    return sorted(paths)
+
+
+def batch_content_bounds(alpha, sizes, cutoff=10, padding=0):
+    """
+    積み重ねたセルそれぞれの非透明部分のバウンディングボックス
+
+    Args:
+        alpha: (N, H, W) のアルファ
+        sizes: (N, 2) の元のセルの大きさ（高さ, 幅）。余白はこの範囲に収める
+        cutoff: この値より大きいアルファをコンテンツとみなす
+        padding: バウンディングボックスに付ける余白
+
+    Returns:
+        ((N, 4) の (left, top, right, bottom)、(N,) のコンテンツの有無)
+        right/bottom は含まない。content_bounds() と同じ結果になります。
+    """
+    visible = alpha > cutoff
+    rows_any = visible.any(axis=2)
+    cols_any = visible.any(axis=1)
+    found = rows_any.any(axis=1)
+
+    height, width = alpha.shape[1:]
+    top = rows_any.argmax(axis=1)
+    bottom = height - 1 - rows_any[:, ::-1].argmax(axis=1)
+    left = cols_any.argmax(axis=1)
+    right = width - 1 - cols_any[:, ::-1].argmax(axis=1)
+
+    sizes = np.asarray(sizes)
+    top = np.maximum(0, top - padding)
+    bottom = np.minimum(sizes[:, 0] - 1, bottom + padding)
+    left = np.maximum(0, left - padding)
+    right = np.minimum(sizes[:, 1] - 1, right + padding)
+
+    return np.stack([left, top, right + 1, bottom + 1], axis=1), found
+
+
+def _bucket(shape):
+    height, width = shape[:2]
+    return -(-height // BUCKET_STEP) * BUCKET_STEP, -(-width // BUCKET_STEP) * BUCKET_STEP
+
+
+def iter_batches(items, batch_size, params=None):
+    """
+    (セルの番号, key, data) をバケットごとに batch_size 個ずつまとめて返す
+
+    バケットが batch_size に達した時点で返すので、items を読み進めながら処理でき、
+    手元にたまるのは各バケットの batch_size 未満のセルだけです。残りは最後に返します。
+    params（セルの番号順の処理パラメータのリスト）を渡すと、処理パラメータが異なるセルは
+    別のバケットにします。
+    """
+    buckets = {}
+    for item in items:
+        shape = _bucket(item[2].shape)
+        group = (shape, None if params is None else id(params[item[0]]))
+        bucket = buckets.setdefault(group, [])
+        bucket.append(item)
+        if len(bucket) == batch_size:
+            yield shape, buckets.pop(group)
+    for (shape, _), bucket in buckets.items():
+        yield shape, bucket
+
+
+def mask_batch(shape, items, params):
+    """
+    同じバケットのセルを積み重ね、背景透過とコンテンツ範囲の検出を一括で行う
+
+    Returns:
+        各セルの背景透過・クロップ済み配列のリスト（積み重ねた配列のビュー）
+    """
+    height, width = shape
+    stack = np.empty((len(items), height, width, 4), dtype=np.uint8)
+    stack.view(np.uint32)[...] = TRANSPARENT_WHITE  # はみ出し部分は透明（コンテンツ扱いされない）
+
+    sizes = []
+    for i, (_, _, data) in enumerate(items):
+        h, w = data.shape[:2]
+        stack[i, :h, :w] = data
+        sizes.append((h, w))
+
+    if (params['threshold'] == AUTO_THRESHOLD or params['matte'] == 'soft' or params['fill'] == 'border'
+            or params['retina']):
+        # 閾値がセルごとに決まる場合と、セルの形に依存する処理（ソフトマット・retina の輪郭の色の復元・
+        # 四辺からの塗りつぶし）はセル単位で行う
+        for i, (h, w) in enumerate(sizes):
+            remove_background(stack[i, :h, :w], params)
+    else:
+        remove_background(stack.reshape(len(items) * height, width, 4), params)
+    bounds, found = batch_content_bounds(stack[:, :, :, 3], sizes, params['alpha_cutoff'], params['padding'])
+
+    contents = []
+    for i, (h, w) in enumerate(sizes):
+        if found[i]:
+            left, top, right, bottom = bounds[i]
+            contents.append(stack[i, top:bottom, left:right])
+        else:
+            contents.append(stack[i, :h, :w])
+    return contents
+
+
+def extract_sheets(paths, output_root, layout, params=None, workers=None, cache=None, batch_size=64,
+                   trace=None, executor=None, io_threads=None):
+    """
+    複数のシートからスタンプを抽出して保存
+
+    シートは1枚ずつデコードして切り出し、バケットが batch_size に達したものから処理に回すので、
+    メモリに載るのは「デコード中のシート + 各バケットの batch_size 未満のセル + 処理中のセル」だけです。
+
+    Args:
+        paths: シート画像のパスのリスト
+        output_root: 出力先。シートごとに「ファイル名（拡張子なし）」のサブディレクトリを作る
+        layout: シートのRGBA配列を受け取り、セル定義のリストを返す関数
+            セル定義に 'params' があれば、そのセルだけ上書きした処理パラメータで処理します。
+        params: 処理パラメータ（省略時は DEFAULT_PARAMS）
+        workers: リサイズ・エンコードのワーカープロセス数（1ならシリアル処理、None ならCPU数）
+        cache: キャッシュファイルのパス（None ならキャッシュを使わない）
+        batch_size: 1回のベクトル演算で処理するセル数の上限
+        trace: 指定するとステージごとの計測イベント（Chrome のトレース形式）を追加する
+        executor: 使い回すプロセスプール（省略時は呼び出しごとに作って終了させる）
+        io_threads: 保存（シリアル処理ならエンコードも）を行うスレッド数（None ならメインスレッドで順に保存）
+
+    Returns:
+        {シートのパス: セルごとの結果辞書のリスト}
+    """
+    if params is None:
+        params = DEFAULT_PARAMS
+
+    entries = load_cache(cache) if cache else {}
+    all_results = {}
+    # 全シートを通したセルの番号順の結果と処理パラメータ（番号 + 1 がトレースの行番号）
+    results = []
+    cell_params_list = []
+    # 同じ上書きのセルは同じ辞書を使う（iter_batches() で同じバケットにまとめる）
+    param_sets = {}
+    workers = resolve_workers(workers)
+    # プロセスプールではエンコードもワーカーで並列に走るので、スレッドには保存だけを回す
+    compute, io_stages = split_io_stages(CONTENT_STAGES) if io_threads and workers == 1 else (CONTENT_STAGES, ())
+
+    def iter_pending():
+        for path in paths:
+            with traced(trace, 'decode') as stats:
+                sheet = load_sheet(path)
+                stats['sheet'] = os.path.basename(path)
+            with traced(trace, 'layout') as stats:
+                cells = layout(sheet)
+                stats['cells'] = len(cells)
+            output_dir = os.path.join(output_root, os.path.splitext(os.path.basename(path))[0])
+            os.makedirs(output_dir, exist_ok=True)
+
+            sheet_results = all_results[path] = []
+            for cell in cells:
+                overrides = repr(sorted((cell.get('params') or {}).items()))
+                own = param_sets.setdefault(overrides, cell_params(cell, params))
+                i = len(results)
+                result = new_result(cell, output_dir, own)
+                results.append(result)
+                cell_params_list.append(own)
+                sheet_results.append(result)
+                with traced(trace, 'crop', result['name'], i + 1):
+                    data = crop_cell(sheet, cell)
+                key = check_cache(result, data, own, cache, entries)
+                if not result['cached']:
+                    yield i, key, data
+            del sheet
+
+    def tasks():
+        for shape, items in iter_batches(iter_pending(), batch_size, cell_params_list):
+            own = cell_params_list[items[0][0]]
+            with traced(trace, 'mask_batch') as stats:
+                contents = mask_batch(shape, items, own)
+                stats.update({'cells': len(items), 'shape': list(shape)})
+            for (i, key, _), content in zip(items, contents):
+                if compute != CONTENT_STAGES:
+                    func, args = run_stages, (content, own, compute)
+                    if trace is not None:
+                        func, args = trace_run_stages, (*args, results[i]['name'], i + 1)
+                elif trace is None:
+                    func, args = render_content, (content, own)
+                else:
+                    func, args = trace_render_content, (content, own, results[i]['name'], i + 1)
+                yield func, args, (i, key)
+
+    def rendered():
+        for (i, key), outputs, error in run_bounded(tasks(), workers, executor):
+            if trace is not None and outputs is not None:
+                outputs, events = outputs
+                trace.extend(events)
+            yield i, key, outputs, error
+
+    if io_threads:
+        written = iter_written_threaded(rendered(), results, cell_params_list, io_stages, io_threads,
+                                        cache, entries, trace)
+    else:
+        written = iter_written(rendered(), results, cache, entries, trace)
+    count = sum(1 for _ in written)
+
+    for path, sheet_results in all_results.items():
+        print(f"\n📄 {os.path.basename(path)}")
+        print_results(sheet_results)
+
+    if cache and count:
+        save_cache(cache, entries)
+
+    return all_results
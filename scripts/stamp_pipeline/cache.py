@@ -0,0 +1,113 @@
+"""
+スタンプ出力のインクリメンタルビルド用キャッシュ
+
+セルの元ピクセルと処理パラメータのハッシュを出力ファイルごとに記録し、
+変わっていないセルは切り抜き以降の処理と保存をまるごと省略します。
+処理し直した場合も、エンコード結果が既存のファイルと同じバイト列なら書き込みません。
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# 処理内容が変わったときに上げると、既存のキャッシュがすべて無効になる
+CACHE_VERSION = 2
+
+# スクリプトを scripts/ から実行したときのキャッシュファイル
+DEFAULT_CACHE_PATH = '.stamp_cache.json'
+
+
+def cell_key(data, params):
+    """
+    セルの元ピクセルと処理パラメータから決まるキャッシュキー
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"v{CACHE_VERSION}:{data.shape}:{data.dtype}".encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    if data.flags.c_contiguous:
+        digest.update(data)
+    else:
+        # シートのビューは行ごとには連続しているので、コピーせずに行ごとに渡す（連続した配列と同じキーになる）
+        for row in data:
+            digest.update(np.ascontiguousarray(row))
+    return digest.hexdigest()
+
+
+def load_cache(path):
+    """
+    キャッシュファイルを読み込む（存在しない・壊れている場合は空）
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return entries if isinstance(entries, dict) else {}
+
+
+def save_cache(path, entries):
+    """
+    キャッシュファイルを書き出す（一時ファイル経由で置き換える）
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, indent=2, sort_keys=True, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def entry_name(cache_path, output_path):
+    """
+    キャッシュ内で出力ファイルを表す名前（キャッシュファイルからの相対パス）
+    """
+    base = os.path.dirname(os.path.abspath(cache_path))
+    return os.path.relpath(os.path.abspath(output_path), base)
+
+
+def is_fresh(entry, key, output_path):
+    """
+    出力ファイルが同じキーで生成され、その後変更されていなければ True
+    """
+    if not entry or entry.get('key') != key:
+        return False
+    try:
+        stat = os.stat(output_path)
+    except OSError:
+        return False
+    return stat.st_size == entry.get('size') and stat.st_mtime_ns == entry.get('mtime_ns')
+
+
+def make_entry(key, output_path):
+    """
+    書き出した直後の出力ファイルのキャッシュエントリ
+    """
+    stat = os.stat(output_path)
+    return {'key': key, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def write_if_changed(path, data):
+    """
+    中身が変わったときだけファイルを書き込む（一時ファイル経由で置き換える）
+
+    同じバイト列ならファイルに触れないので、更新時刻も変わらず、CDN やブラウザのキャッシュも
+    無効になりません。
+
+    Returns:
+        書き込んだら True、同じ中身だったので省いたら False
+    """
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except OSError:
+        pass
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return True
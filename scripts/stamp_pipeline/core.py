@@ -0,0 +1,351 @@
+"""
+スタンプ1セル分の共通処理
+背景透過 → 自動クロップ → リサイズ → PNGエンコード を行います。
+"""
+
+import io
+
+from PIL import Image
+import numpy as np
+
+from .segment import border_connected
+from .threshold import resolve_threshold
+
+# 処理パラメータのデフォルト値（process_stamps_manual.py と同じ設定）
+DEFAULT_PARAMS = {
+    # 背景判定方式
+    #   'min'      : RGBすべてが閾値以上
+    #   'mean_std' : RGB平均が閾値以上、かつ標準偏差が std_limit 未満
+    #   'mean'     : RGB平均が閾値以上
+    'background': 'min',
+    'threshold': 230,     # 'auto' ならセルごとのヒストグラムから決める（threshold.py）
+    'threshold_method': 'valley',    # 自動決定の方式（'valley' / 'otsu'）
+    'threshold_range': (200, 250),   # 自動決定した閾値をこの範囲に収める
+    'std_limit': 20,
+    # 'global': 白と判定したピクセルをすべて透過 / 'border': セルの四辺からつながる白だけを透過
+    #   （キャラクターの内側の白目・歯・ハイライトは残る）
+    'fill': 'global',
+    'alpha_cutoff': 10,   # この値より大きいアルファをコンテンツとみなす
+    # 'hard': 背景を2値で抜く / 'soft': 白に近いほど透明にして白を除いた色に戻す（白いフチが残らない）
+    'matte': 'hard',
+    'soft_range': 64,     # soft で半透明にする幅（閾値の何段階下から不透明にするか）
+    'soft_radius': 2,     # soft で半透明にするのは背景からこの距離（px）以内のピクセルだけ
+    'padding': 10,        # 自動クロップ時の余白
+    'fit_size': 120,      # サムネイル化する最大サイズ
+    # None: LANCZOS で1回に縮小 / 数値: まず整数倍の縮小（Image.reduce）で fit_size のこの倍率程度まで縮め、
+    #   残りを LANCZOS で縮める（大きなセルほど速い。3 ならほぼ見分けがつかない）
+    'reducing_gap': None,
+    'canvas_size': 128,   # 出力画像のサイズ
+    'retina': False,      # True なら @2x（canvas_size の2倍）も出力し、1x は @2x を縮小して作る
+    # エンコーダの候補（encode.ENCODERS）。品質の下限を満たす最小の結果を選ぶ
+    'encoders': ('png',),
+    'min_psnr': 35.0,     # 非可逆エンコードの品質の下限（プリマルチプライドRGBAのPSNR, dB）
+    'webp_quality': 90,   # 非可逆 WebP の品質
+}
+
+
+def make_params(**overrides):
+    """
+    デフォルト値に上書きを適用したパラメータ辞書を作成
+    """
+    unknown = set(overrides) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError(f"不明なパラメータ: {', '.join(sorted(unknown))}")
+
+    params = dict(DEFAULT_PARAMS)
+    params.update(overrides)
+    return params
+
+
+# 透明にしたピクセルの値（RGBA = 255, 255, 255, 0）を uint32 として見たもの
+TRANSPARENT_WHITE = np.frombuffer(bytes([255, 255, 255, 0]), dtype=np.uint32)[0]
+
+# 背景判定を行うブロックのピクセル数（一時配列をキャッシュに収まる大きさに抑える）
+BLOCK_PIXELS = 1 << 16
+
+
+def _block_mask(block, params, out):
+    # 1ブロック分の背景マスクを整数演算だけで求める
+    r = block[:, :, 0]
+    g = block[:, :, 1]
+    b = block[:, :, 2]
+    threshold = params['threshold']
+    mode = params['background']
+
+    if mode == 'min':
+        np.minimum(r, g, out=out['min'])
+        np.minimum(out['min'], b, out=out['min'])
+        return np.greater_equal(out['min'], threshold, out=out['mask'])
+
+    # 平均 >= T は 合計 >= 3T と同値
+    total = out['total']
+    np.add(r, g, out=total, dtype=np.int32)
+    np.add(total, b, out=total)
+    mask = np.greater_equal(total, 3 * threshold, out=out['mask'])
+    if mode == 'mean':
+        return mask
+
+    if mode == 'mean_std':
+        # 母標準偏差 < L は (r-g)² + (g-b)² + (b-r)² < 9L² と同値（9 * 分散 = 差の二乗和）
+        spread = out['spread']
+        diff = out['diff']
+        np.subtract(r, g, out=diff, dtype=np.int32)
+        np.multiply(diff, diff, out=spread)
+        for x, y in ((g, b), (b, r)):
+            np.subtract(x, y, out=diff, dtype=np.int32)
+            np.multiply(diff, diff, out=diff)
+            spread += diff
+        mask &= np.less(spread, 9 * params['std_limit'] ** 2, out=out['low_spread'])
+        return mask
+
+    raise ValueError(f"不明な背景判定方式: {mode}")
+
+
+def _block_buffers(rows, width):
+    shape = (rows, width)
+    return {
+        'min': np.empty(shape, dtype=np.uint8),
+        'mask': np.empty(shape, dtype=bool),
+        'total': np.empty(shape, dtype=np.int32),
+        'diff': np.empty(shape, dtype=np.int32),
+        'spread': np.empty(shape, dtype=np.int32),
+        'low_spread': np.empty(shape, dtype=bool),
+    }
+
+
+def _iter_block_masks(data, params):
+    # 行ブロックごとに (開始行, 背景マスク) を返す（マスクの配列は使い回す）
+    height, width = data.shape[:2]
+    rows = max(1, min(height, BLOCK_PIXELS // max(1, width)))
+    buffers = _block_buffers(rows, width)
+    for y in range(0, height, rows):
+        block = data[y:y + rows]
+        if block.shape[0] != rows:
+            buffers = _block_buffers(block.shape[0], width)
+        yield y, _block_mask(block, params, buffers)
+
+
+def matte_tables(params):
+    """
+    ソフトマット用の256要素のルックアップテーブルを作る
+
+    Returns:
+        (アルファ, 逆数) のテーブル。
+        アルファはRGBの最小値（白からの距離）から引き、閾値以上で0、
+        閾値 - soft_range 以下で255、その間は直線で変化します。
+        逆数はアルファ a に対する 255 / a を 2^16 倍した固定小数点です。
+    """
+    threshold = params['threshold']
+    soft_range = max(1, params['soft_range'])
+    levels = np.arange(256)
+    alpha = np.clip(np.round((threshold - levels) * 255 / soft_range), 0, 255).astype(np.uint8)
+
+    reciprocal = np.zeros(256, dtype=np.int64)
+    reciprocal[1:] = np.round(255 * (1 << 16) / levels[1:])
+    return alpha, reciprocal
+
+
+def _dilate(mask, radius):
+    # 2値マスクを上下左右 radius ピクセルずつ広げる（正方形の近傍）
+    wide = mask.copy()
+    for d in range(1, radius + 1):
+        wide[:, d:] |= mask[:, :-d]
+        wide[:, :-d] |= mask[:, d:]
+    out = wide.copy()
+    for d in range(1, radius + 1):
+        out[d:] |= wide[:-d]
+        out[:-d] |= wide[d:]
+    return out
+
+
+def _soft_block(block, near, params, alpha_lut, reciprocal, keep_alpha=False):
+    # 背景の近くで半透明になるピクセルだけ、白と混ざる前の色とアルファに戻す（keep_alpha なら色だけ）
+    #   C = a * F + (1 - a) * 255  より  F = 255 - (255 - C) / a
+    threshold = params['threshold']
+    minimum = np.minimum(block[:, :, 0], block[:, :, 1])
+    np.minimum(minimum, block[:, :, 2], out=minimum)
+    candidates = near & (minimum < threshold) & (minimum > threshold - params['soft_range'])
+    rows, cols = np.nonzero(candidates)
+    if len(rows) == 0:
+        return
+
+    a = alpha_lut[minimum[rows, cols]].astype(np.int32)
+    pixels = block[rows, cols].astype(np.int32)
+    color = 255 - (((255 - pixels[:, :3]) * reciprocal[a][:, None] + (1 << 15)) >> 16)
+    pixels[:, :3] = np.clip(color, 0, 255)
+    if not keep_alpha:
+        pixels[:, 3] = (pixels[:, 3] * a + 127) // 255
+    block[rows, cols] = pixels
+
+
+def _soften_edges(data, params, keep_alpha=False):
+    # 背景（アルファ0）から soft_radius 以内のピクセルにソフトマットをかける
+    alpha_lut, reciprocal = matte_tables(params)
+    radius = params['soft_radius']
+    height, width = data.shape[:2]
+    rows = max(1, min(height, BLOCK_PIXELS // max(1, width)))
+    for y in range(0, height, rows):
+        top = max(0, y - radius)
+        bottom = min(height, y + rows + radius)
+        near = _dilate(data[top:bottom, :, 3] == 0, radius)
+        end = min(height, y + rows)
+        _soft_block(data[y:end], near[y - top:end - top], params, alpha_lut, reciprocal, keep_alpha)
+
+
+def background_mask(data, params):
+    """
+    白い背景とみなすピクセルのマスクを返す
+    """
+    mask = np.empty(data.shape[:2], dtype=bool)
+    for y, block_mask in _iter_block_masks(data, params):
+        mask[y:y + block_mask.shape[0]] = block_mask
+    return mask
+
+
+def remove_background(data, params):
+    """
+    RGBA配列の白い背景を透過にする（配列をその場で書き換える）
+
+    判定は整数演算で行ブロックごとに行い、該当ピクセルを
+    (255, 255, 255, 0) で直接上書きします。浮動小数点の一時配列は作りません。
+    params['threshold'] が 'auto' なら、配列のヒストグラムから閾値を決めます。
+    params['fill'] が 'border' なら、白と判定したピクセルのうち配列の四辺につながる部分だけを
+    透過します（ランレングスのラベリングなので、ピクセル数に対してほぼ線形時間）。
+    params['matte'] が 'soft' なら、背景の近く（soft_radius 以内）で閾値のすぐ下の明るいピクセル
+    （輪郭のアンチエイリアス）をルックアップテーブルで半透明にし、混ざっていた白を取り除きます。
+    内側の淡い色の塗りは不透明のまま残ります。
+    'hard' でも params['retina'] なら、同じピクセルの色だけを白と混ざる前の色に戻します（アルファは2値のまま）。
+    @2x は縮小が小さく、輪郭の明るいアンチエイリアスがそのまま白いフチとして残るためです。
+    """
+    if data.shape[0] == 0 or data.shape[1] == 0:
+        return data
+    params = resolve_threshold(data, params)
+    pixels = data.view(np.uint32)[:, :, 0]
+    if params['fill'] == 'border':
+        np.putmask(pixels, border_connected(background_mask(data, params)), TRANSPARENT_WHITE)
+    else:
+        for y, block_mask in _iter_block_masks(data, params):
+            np.putmask(pixels[y:y + block_mask.shape[0]], block_mask, TRANSPARENT_WHITE)
+    if params['matte'] == 'soft':
+        _soften_edges(data, params)
+    elif params['retina']:
+        _soften_edges(data, params, keep_alpha=True)
+    return data
+
+
+def content_bounds(alpha, cutoff=10, padding=0):
+    """
+    非透明部分のバウンディングボックスを返す
+
+    Returns:
+        (left, top, right, bottom)（right/bottom は含まない）。
+        非透明部分がなければ None
+    """
+    visible = alpha > cutoff
+    rows = np.flatnonzero(visible.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(visible.any(axis=0))
+
+    height, width = alpha.shape
+    top = max(0, rows[0] - padding)
+    bottom = min(height - 1, rows[-1] + padding)
+    left = max(0, cols[0] - padding)
+    right = min(width - 1, cols[-1] + padding)
+
+    return int(left), int(top), int(right) + 1, int(bottom) + 1
+
+
+def auto_crop_content(data, params):
+    """
+    透明でない部分を自動検出してクロップした配列を返す
+    """
+    bounds = content_bounds(data[:, :, 3], params['alpha_cutoff'], params['padding'])
+    if bounds is None:
+        return data  # 完全透明の場合は元の配列を返す
+
+    left, top, right, bottom = bounds
+    return data[top:bottom, left:right]
+
+
+def reduce_thumbnail(image, size, reducing_gap):
+    """
+    プリマルチプライドアルファ（RGBa）のまま2段階で size 以内に縮小した画像を返す
+
+    Pillow は RGBA の resize でも内部で RGBa にして透明なピクセルの色がにじまないようにしますが、
+    そのときは reducing_gap を使わないので、自分で RGBa にしてから縮小します。
+    縮小が要らなければ（RGBa との往復で半透明の色が丸まらないよう）そのまま返します。
+    """
+    if image.width <= size and image.height <= size:
+        return image
+    premultiplied = image.convert('RGBa')
+    premultiplied.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
+    return premultiplied.convert('RGBA')
+
+
+def fit_to_canvas(image, params):
+    """
+    アスペクト比を保持してリサイズし、透明なキャンバスの中央に配置
+    """
+    fit_size = params['fit_size']
+    canvas_size = params['canvas_size']
+
+    if params['reducing_gap'] is None:
+        image.thumbnail((fit_size, fit_size), Image.Resampling.LANCZOS)
+    else:
+        image = reduce_thumbnail(image, fit_size, params['reducing_gap'])
+
+    final_image = Image.new('RGBA', (canvas_size, canvas_size), (255, 255, 255, 0))
+    x = (canvas_size - image.width) // 2
+    y = (canvas_size - image.height) // 2
+    if params['matte'] == 'soft':
+        # paste() はアルファをマスクにして白いキャンバスと混ぜるので、半透明の色をそのまま置く
+        final_image.alpha_composite(image, (x, y))
+    else:
+        final_image.paste(image, (x, y), image)
+
+    return final_image
+
+
+def encode_png(image):
+    """
+    PNGとしてエンコードしたバイト列を返す
+    """
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def finish_cell(content, params):
+    """
+    背景透過・クロップ済みの配列をリサイズしてキャンバスに配置する
+
+    Returns:
+        {密度: PIL Image}。通常は {1: 1x}、params['retina'] なら {1: 1x, 2: @2x}。
+        @2x はデコード・背景透過済みの同じ配列から作り、1x はそれを半分に縮小します。
+    """
+    image = Image.fromarray(content, 'RGBA')
+    if not params['retina']:
+        return {1: fit_to_canvas(image, params)}
+
+    double = dict(params, fit_size=params['fit_size'] * 2, canvas_size=params['canvas_size'] * 2)
+    retina = fit_to_canvas(image, double)
+    canvas_size = params['canvas_size']
+    standard = retina.resize((canvas_size, canvas_size), Image.Resampling.LANCZOS)
+    return {1: standard, 2: retina}
+
+
+def process_cell(data, params):
+    """
+    切り出し済みのセル（RGBA配列）を最終的なスタンプ画像にする
+
+    Args:
+        data: セルのRGBA配列（背景透過のため書き換えられる）
+        params: 処理パラメータ
+
+    Returns:
+        {密度: PIL Image}（finish_cell() を参照）
+    """
+    transparent = remove_background(data, params)
+    content = auto_crop_content(transparent, params)
+    return finish_cell(content, params)
@@ -0,0 +1,138 @@
+"""
+スタンプ画像のエンコード
+
+PNG（RGBA / パレット）と WebP（ロスレス / 非可逆）の候補でエンコードし、
+品質の下限（プリマルチプライドRGBAのPSNR）を満たすもののうち最も小さい結果を選びます。
+出力ファイルの拡張子は変えられないので、候補はすべて同じ形式（PNG か WebP）にそろえます。
+メタデータ（ICC プロファイル・EXIF・テキストなど）は持ち込まず、エンコーダの設定も固定しているので、
+同じピクセルからは常に同じバイト列ができます。
+"""
+
+import io
+import time
+
+from PIL import Image
+import numpy as np
+
+from .core import encode_png
+
+# エンコーダ名: (拡張子, ロスレスか)
+ENCODERS = {
+    'png': ('.png', True),
+    'png8': ('.png', False),
+    'webp_lossless': ('.webp', True),
+    'webp': ('.webp', False),
+}
+
+
+def _encode_png8(image, params):
+    # 256色パレット（アルファ付き）に減色して保存する
+    quantized = image.quantize(256, method=Image.Quantize.FASTOCTREE)
+    buffer = io.BytesIO()
+    quantized.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def _encode_webp(image, params, lossless):
+    buffer = io.BytesIO()
+    image.save(buffer, 'WEBP', lossless=lossless, quality=params['webp_quality'], method=4)
+    return buffer.getvalue()
+
+
+def strip_metadata(image):
+    """
+    メタデータを取り除いた画像（なければそのまま返す）
+    """
+    if not image.info:
+        return image
+    image = image.copy()
+    image.info = {}
+    return image
+
+
+def encode_candidate(image, name, params):
+    """
+    指定したエンコーダでエンコードしたバイト列を返す
+    """
+    image = strip_metadata(image)
+    if name == 'png':
+        return encode_png(image)
+    if name == 'png8':
+        return _encode_png8(image, params)
+    if name == 'webp_lossless':
+        return _encode_webp(image, params, True)
+    if name == 'webp':
+        return _encode_webp(image, params, False)
+    raise ValueError(f"不明なエンコーダ: {name}")
+
+
+def output_extension(params):
+    """
+    エンコーダ候補から出力ファイルの拡張子を決める
+
+    Raises:
+        ValueError: 不明なエンコーダ、または形式の異なる候補が混在している場合
+    """
+    names = params['encoders']
+    unknown = [name for name in names if name not in ENCODERS]
+    if not names or unknown:
+        raise ValueError(f"不明なエンコーダ: {', '.join(unknown) or '(なし)'}")
+    extensions = {ENCODERS[name][0] for name in names}
+    if len(extensions) != 1:
+        raise ValueError(f"形式の異なるエンコーダは混在できません: {', '.join(names)}")
+    return extensions.pop()
+
+
+def _premultiplied(image):
+    # 透明部分の色を無視して比べるため、RGB にアルファを掛けた float 配列にする
+    data = np.asarray(image.convert('RGBA'), dtype=np.float32)
+    data[:, :, :3] *= data[:, :, 3:] / 255
+    return data
+
+
+def psnr(reference, data):
+    """
+    2つの配列の PSNR（dB）。完全に一致すれば inf
+    """
+    mse = float(np.mean((reference - data) ** 2))
+    if mse == 0:
+        return float('inf')
+    return 10 * np.log10(255 ** 2 / mse)
+
+
+def encode_image(image, params):
+    """
+    params['encoders'] の候補でエンコードし、品質の下限を満たす最小の結果を選ぶ
+
+    非可逆の候補はデコードし直して params['min_psnr'] と比べます。
+    ロスレスの候補は常に下限を満たします。
+
+    Returns:
+        'data'（バイト列）, 'encoder'（選ばれた候補）, 'seconds'（全候補のエンコード時間）,
+        'reference_size'（ロスレス候補のサイズ。候補になければ None）の辞書
+    """
+    start = time.perf_counter()
+    candidates = sorted(
+        ((encode_candidate(image, name, params), name) for name in params['encoders']),
+        key=lambda candidate: len(candidate[0]),
+    )
+    seconds = time.perf_counter() - start
+
+    reference_size = None
+    for data, name in candidates:
+        if ENCODERS[name][1]:
+            reference_size = len(data)
+
+    reference = None
+    for data, name in candidates:
+        if ENCODERS[name][1]:
+            break
+        if reference is None:
+            reference = _premultiplied(image)
+        with Image.open(io.BytesIO(data)) as decoded:
+            if psnr(reference, _premultiplied(decoded)) >= params['min_psnr']:
+                break
+    else:
+        raise ValueError(f"品質の下限（{params['min_psnr']} dB）を満たすエンコード結果がありません")
+
+    return {'data': data, 'encoder': name, 'seconds': seconds, 'reference_size': reference_size}
@@ -0,0 +1,548 @@
+"""
+スタンプ抽出エンジン
+シートを1回だけデコードし、セルごとの処理をプロセスプールに分散します。
+作業メモリの上限を指定すると、シートをバンド単位で逐次デコードします。
+
+抽出は crop（iter_crops）→ キャッシュ確認（skip_cached）→ セルごとのステージ（iter_rendered）→
+write（iter_written）のジェネレータをつないだもので、処理中のセルの数は一定に抑えられます。
+I/O スレッドを指定すると、エンコードと保存（iter_written_threaded）をスレッドプールで行い、
+次のセルの背景透過・リサイズと重ねます。
+whole_sheet を指定すると、シート全体を1回で背景透過し、セルはコンテンツの範囲のビューとして渡します。
+"""
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from PIL import Image
+import numpy as np
+
+from .cache import cell_key, entry_name, is_fresh, load_cache, make_entry, save_cache, write_if_changed
+from .core import DEFAULT_PARAMS, content_bounds, remove_background
+from .encode import output_extension
+from .shared import attach_sheet, release_sheet, share_sheet
+from .stages import CELL_STAGES, CONTENT_STAGES, mask, run_stages, split_io_stages, trim
+from .threshold import AUTO_THRESHOLD
+from .tiled import can_stream, iter_cells
+from .trace import trace_render_cell, trace_run_stages, traced
+
+
+def load_sheet(path):
+    """
+    シート画像を読み込み、RGBA配列として返す
+    """
+    with Image.open(path) as image:
+        return np.array(image.convert('RGBA'))
+
+
+def cell_view(sheet, cell):
+    """
+    シート配列のセル矩形のビューを返す（コピーしない。シート外ははみ出さない）
+    """
+    height, width = sheet.shape[:2]
+    left = max(0, cell['x'])
+    top = max(0, cell['y'])
+    right = min(width, cell['x'] + cell['w'])
+    bottom = min(height, cell['y'] + cell['h'])
+    return sheet[top:bottom, left:right]
+
+
+def crop_cell(sheet, cell):
+    """
+    シート配列からセル矩形を切り出したコピーを返す（シート外ははみ出さない）
+    """
+    return cell_view(sheet, cell).copy()
+
+
+def run_on_shared_cell(func, handle, cell, *args):
+    """
+    共有メモリのシートからセルを切り出し、func(セル, *args) を返す（ワーカープロセスで実行される）
+
+    セルのコピーはここで1回だけ作ります（背景透過が配列をその場で書き換えるため）。
+    """
+    return func(crop_cell(attach_sheet(handle), cell), *args)
+
+
+def render_cell(data, params):
+    """
+    1セルを処理して {密度: エンコード結果} を返す（ワーカープロセスで実行される）
+    """
+    return run_stages(data, params, CELL_STAGES)
+
+
+def render_content(content, params):
+    """
+    背景透過・クロップ済みの配列から {密度: エンコード結果} を作る（ワーカープロセスで実行される）
+    """
+    return run_stages(content, params, CONTENT_STAGES)
+
+
+def retina_dir_for(output_dir):
+    """
+    @2x の出力先（stamps/ao → stamps/retina/ao）
+    """
+    output_dir = os.path.normpath(output_dir)
+    return os.path.join(os.path.dirname(output_dir), 'retina', os.path.basename(output_dir))
+
+
+def retina_filename(filename):
+    """
+    @2x のファイル名（ao_hello.png → ao_hello@2x.png）
+    """
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}@2x{ext}"
+
+
+def resolve_workers(workers):
+    """
+    ワーカー数を決定する（None ならCPU数）
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def iter_crops(sheet, cells, max_memory=None, stats=None, trace=None, copy=True):
+    """
+    セルの切り出しを (セルの番号, RGBA配列) として順に返す
+
+    max_memory を指定し、シートが逐次デコードできるPNGのパスなら、
+    シート全体を読み込まずにバンド単位でデコードしながら切り出します。
+    trace（イベントのリスト）を渡すとデコードと切り出しを計測します。
+    copy が False ならシート配列のビューを返します（書き換えないこと）。
+    """
+    if isinstance(sheet, (str, os.PathLike)):
+        if max_memory is not None:
+            if can_stream(sheet):
+                yield from iter_cells(sheet, cells, max_memory, stats)
+                return
+            print(f"⚠️ 逐次デコードに対応していない画像のため、全体を読み込みます: {sheet}")
+        with traced(trace, 'decode') as decode_stats:
+            sheet = load_sheet(sheet)
+            decode_stats['size'] = [sheet.shape[1], sheet.shape[0]]
+
+    for i, cell in enumerate(cells):
+        with traced(trace, 'crop', cell.get('name'), i + 1):
+            data = crop_cell(sheet, cell) if copy else cell_view(sheet, cell)
+        yield i, data
+
+
+def cell_params(cell, params):
+    """
+    セル定義の 'params'（そのセルだけの上書き）を適用した処理パラメータ
+    """
+    overrides = cell.get('params')
+    return dict(params, **overrides) if overrides else params
+
+
+def _params_at(params, i):
+    # params はすべてのセルに共通の辞書か、セルの番号順のリスト
+    return params[i] if isinstance(params, list) else params
+
+
+def skip_cached(crops, results, params, cache, entries, trace=None):
+    """
+    キャッシュが新しいセルを除き、(セルの番号, キャッシュキー, RGBA配列) を返す
+
+    params はセルごとに違う場合、セルの番号順のリストで渡します（iter_rendered() も同じ）。
+    """
+    for i, data in crops:
+        with traced(trace, 'cache_check', results[i]['name'], i + 1):
+            key = check_cache(results[i], data, _params_at(params, i), cache, entries)
+        if not results[i]['cached']:
+            yield i, key, data
+
+
+def can_mask_sheet(params, stages=CELL_STAGES):
+    """
+    シート全体を1回で背景透過しても、セルごとに背景透過したのと同じ結果になるなら True
+
+    ピクセルごとに決まる処理（固定の閾値・'global' の塗りつぶし・'hard' のマットで retina なし）で、
+    ステージが mask → trim から始まり、セルごとの上書きがない場合に限ります。
+    retina では輪郭の色を背景との距離で戻すので、セルの外の背景が結果に影響します。
+    """
+    if isinstance(params, list) or tuple(stages[:2]) != (mask, trim):
+        return False
+    return (params['threshold'] != AUTO_THRESHOLD and params['fill'] == 'global' and params['matte'] == 'hard'
+            and not params['retina'])
+
+
+def mask_whole_sheet(sheet, items, cells, params, trace=None):
+    """
+    シート全体を1回で背景透過し、処理するセルをコンテンツの範囲のビューにする
+
+    items（skip_cached() の結果、キャッシュキーは背景透過の前のピクセルから求めたもの）を
+    読み切ってから、シート配列をその場で書き換えます。
+
+    Returns:
+        ((セルの番号, キャッシュキー, コンテンツのビュー) のリスト,
+         処理するセルの矩形をシート上のコンテンツの範囲に縮めたセル定義のリスト)
+    """
+    items = list(items)
+    content_cells = list(cells)
+    if not items:
+        return items, content_cells
+
+    with traced(trace, 'mask_sheet') as mask_stats:
+        remove_background(sheet, params)
+        mask_stats['size'] = [sheet.shape[1], sheet.shape[0]]
+
+    trimmed = []
+    for i, key, view in items:
+        cell = cells[i]
+        with traced(trace, 'trim', cell.get('name'), i + 1):
+            bounds = content_bounds(view[:, :, 3], params['alpha_cutoff'], params['padding'])
+            left, top, right, bottom = bounds or (0, 0, view.shape[1], view.shape[0])
+        trimmed.append((i, key, view[top:bottom, left:right]))
+        content_cells[i] = dict(cell, x=max(0, cell['x']) + left, y=max(0, cell['y']) + top,
+                                w=right - left, h=bottom - top)
+    return trimmed, content_cells
+
+
+def iter_rendered(items, results, params, stages=CELL_STAGES, workers=1, executor=None, trace=None, shared=None):
+    """
+    セルにステージを順に適用し、(セルの番号, キャッシュキー, 最後のステージの結果, 例外) を完了順に返す
+
+    処理中のセルはワーカー数の2倍まで（run_bounded()）なので、セルがいくつあっても
+    メモリに載る切り出しと途中の結果は一定です。
+    shared に (share_sheet() のハンドル, セル定義のリスト) を渡すと、ワーカーには切り出しではなく
+    ハンドルとセルの矩形だけを送り、ワーカーが共有メモリから切り出します。
+    """
+    def tasks():
+        for i, key, data in items:
+            own = _params_at(params, i)
+            if trace is None:
+                func, args = run_stages, (data, own, stages)
+            elif stages == CELL_STAGES:
+                func, args = trace_render_cell, (data, own, results[i]['name'], i + 1)
+            else:
+                func, args = trace_run_stages, (data, own, stages, results[i]['name'], i + 1)
+            if shared is not None:
+                handle, cells = shared
+                func, args = run_on_shared_cell, (func, handle, cells[i], *args[1:])
+            yield func, args, (i, key)
+
+    for (i, key), outputs, error in run_bounded(tasks(), workers, executor):
+        if trace is not None and outputs is not None:
+            outputs, events = outputs
+            trace.extend(events)
+        yield i, key, outputs, error
+
+
+def iter_written(rendered, results, cache, entries, trace=None):
+    """
+    エンコード結果を保存し、保存したセルの番号を返す
+    """
+    for i, key, outputs, error in rendered:
+        with traced(trace, 'write', results[i]['name'], i + 1):
+            write_result(results[i], key, outputs, error, cache, entries)
+        yield i
+
+
+def iter_written_threaded(rendered, results, params, io_stages=(), threads=1, cache=None, entries=None, trace=None):
+    """
+    残りのステージ（エンコード）と保存をスレッドプールで行い、保存したセルの番号を完了順に返す
+
+    スレッドが zlib の圧縮やファイルの書き込みをしている間に、呼び出し側は次のセルの
+    計算（rendered の次の要素）に進めます。スレッドに渡したセルはスレッド数の2倍までに抑えます。
+    """
+    def finish(i, key, data, error):
+        if error is None and io_stages:
+            try:
+                with traced(trace, 'encode', results[i]['name'], i + 1):
+                    data = run_stages(data, _params_at(params, i), io_stages)
+            except Exception as e:
+                data, error = None, e
+        with traced(trace, 'write', results[i]['name'], i + 1):
+            write_result(results[i], key, data, error, cache, entries)
+        return i
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        in_flight = set()
+        for i, key, outputs, error in rendered:
+            in_flight.add(pool.submit(finish, i, key, outputs, error))
+            if len(in_flight) >= threads * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in in_flight:
+            yield future.result()
+
+
+def extract_stamps(sheet, cells, output_dir, params=None, workers=None, cache=None, max_memory=None,
+                   stats=None, trace=None, executor=None, stages=CELL_STAGES, io_threads=None, whole_sheet=False):
+    """
+    シートから全セルのスタンプを抽出して保存
+
+    Args:
+        sheet: シートのパス、またはRGBA配列
+        cells: セル定義のリスト（'name', 'filename', 'x', 'y', 'w', 'h'、上書きがあれば 'params'）
+            シートのRGBA配列を受け取ってセル定義のリストを返す関数（locate）でもよい
+        output_dir: 出力ディレクトリ
+        params: 処理パラメータ（省略時は DEFAULT_PARAMS）
+        workers: ワーカープロセス数（1ならシリアル処理、None ならCPU数）
+        cache: キャッシュファイルのパス（None ならキャッシュを使わない）
+            元ピクセルと処理パラメータが前回と同じセルは処理せず、
+            出力ファイルにも触れません。
+        max_memory: シートをデコードする作業メモリの上限（バイト）
+            指定するとシートをバンド単位で逐次デコードします（sheet がパスの場合）。
+        stats: 指定すると逐次デコードの統計（'band_height', 'peak_bytes'）を書き込む
+        trace: 指定するとステージごとの計測イベント（Chrome のトレース形式）を追加する
+            保存は trace.write_trace() で行います。
+        executor: 使い回すプロセスプール（省略時は呼び出しごとに作って終了させる）
+        stages: セルごとに順に適用するステージ（stages.CELL_STAGES を参照）
+            最後のステージは {密度: encode_image() の結果} を返すこと。
+        io_threads: 保存（シリアル処理ならエンコードも）を行うスレッド数（None ならメインスレッドで順に保存）
+        whole_sheet: True ならシート全体を1回で背景透過し、セルはコンテンツの範囲のビューから
+            リサイズ以降のステージだけを適用する（can_mask_sheet() が False のときはセルごとに行う）
+
+    ワーカーが2つ以上で、シート全体をデコードする場合は、シートを共有メモリに1回だけ置き、
+    ワーカーはそこから自分のセルを切り出します（切り出しを pickle して送らない）。
+
+    Returns:
+        セルごとの結果辞書のリスト（'name', 'filename', 'path', 'size', 'cached', 'error'、
+        処理したセルは 'encoder', 'encode_time', 'saved', 'unchanged' も）
+    """
+    if params is None:
+        params = DEFAULT_PARAMS
+    if stats is None:
+        stats = {}
+
+    if callable(cells):
+        if isinstance(sheet, (str, os.PathLike)):
+            with traced(trace, 'decode') as decode_stats:
+                sheet = load_sheet(sheet)
+                decode_stats['size'] = [sheet.shape[1], sheet.shape[0]]
+        with traced(trace, 'locate') as locate_stats:
+            cells = cells(sheet)
+            locate_stats['cells'] = len(cells)
+
+    os.makedirs(output_dir, exist_ok=True)
+    entries = load_cache(cache) if cache else {}
+    workers = min(resolve_workers(workers), max(1, len(cells)))
+    if any(cell.get('params') for cell in cells):
+        params = [cell_params(cell, params) for cell in cells]
+    results = [new_result(cell, output_dir, _params_at(params, i)) for i, cell in enumerate(cells)]
+
+    memory = None
+    shared = None
+    # 逐次デコードを指定したときはシート全体を持たないので、切り出しを送る
+    is_path = isinstance(sheet, (str, os.PathLike))
+    full = not (is_path and max_memory is not None)
+    if whole_sheet and not (full and can_mask_sheet(params, stages)):
+        print("⚠️ この設定ではシート全体をまとめて背景透過できないため、セルごとに処理します")
+        whole_sheet = False
+    if (workers > 1 or whole_sheet) and is_path and full:
+        with traced(trace, 'decode') as decode_stats:
+            sheet = load_sheet(sheet)
+            decode_stats['size'] = [sheet.shape[1], sheet.shape[0]]
+    if workers > 1 and full:
+        with traced(trace, 'share') as share_stats:
+            memory, sheet, handle = share_sheet(sheet)
+            share_stats['bytes'] = sheet.nbytes
+        shared = (handle, cells)
+    elif whole_sheet and not is_path:
+        # 呼び出し元の配列は書き換えない
+        sheet = sheet.copy()
+
+    try:
+        crops = iter_crops(sheet, cells, max_memory, stats, trace, copy=shared is None and not whole_sheet)
+        items = skip_cached(crops, results, params, cache, entries, trace)
+        if whole_sheet:
+            items, content_cells = mask_whole_sheet(sheet, items, cells, params, trace)
+            stages = tuple(stages[2:])
+            if shared is not None:
+                shared = (handle, content_cells)
+        if io_threads:
+            # プロセスプールではエンコードもワーカーで並列に走るので、スレッドには保存だけを回す
+            compute, io_stages = split_io_stages(stages) if workers == 1 else (stages, ())
+            rendered = iter_rendered(items, results, params, compute, workers, executor, trace, shared)
+            written = sum(1 for _ in iter_written_threaded(rendered, results, params, io_stages, io_threads,
+                                                           cache, entries, trace))
+        else:
+            rendered = iter_rendered(items, results, params, stages, workers, executor, trace, shared)
+            written = sum(1 for _ in iter_written(rendered, results, cache, entries, trace))
+    finally:
+        if memory is not None:
+            # 共有メモリ上のシートとビューを手放してから閉じる
+            sheet = crops = items = rendered = None
+            release_sheet(memory)
+
+    print_results(results)
+
+    if 'peak_bytes' in stats:
+        print(f"📈 デコード作業メモリのピーク（見積もり）: {stats['peak_bytes'] / (1024 * 1024):.1f} MB "
+              f"（上限 {stats['max_memory'] / (1024 * 1024):.1f} MB、バンド {stats['band_height']} 行）")
+
+    if cache and written:
+        save_cache(cache, entries)
+
+    return results
+
+
+def new_result(cell, output_dir, params=None):
+    """
+    セルの結果辞書を作成（params['retina'] なら @2x のパスも持つ）
+
+    ファイル名の拡張子はエンコーダの形式に合わせます（例: WebP なら .webp）。
+    """
+    if params is None:
+        params = DEFAULT_PARAMS
+    filename = os.path.splitext(cell['filename'])[0] + output_extension(params)
+    result = {
+        'name': cell['name'],
+        'filename': filename,
+        'path': os.path.join(output_dir, filename),
+        'size': 0,
+        'cached': False,
+        'error': None,
+    }
+    if params['retina']:
+        retina_dir = retina_dir_for(output_dir)
+        os.makedirs(retina_dir, exist_ok=True)
+        result['retina_path'] = os.path.join(retina_dir, retina_filename(filename))
+        result['retina_size'] = 0
+    return result
+
+
+def output_paths(result):
+    """
+    結果の出力ファイル {密度: パス}
+    """
+    paths = {1: result['path']}
+    if 'retina_path' in result:
+        paths[2] = result['retina_path']
+    return paths
+
+
+def check_cache(result, data, params, cache, entries):
+    """
+    キャッシュを確認し、すべての出力が最新なら result['cached'] を立てる
+
+    Returns:
+        セルのキャッシュキー（キャッシュを使わない場合は None）
+    """
+    if not cache:
+        return None
+    key = cell_key(data, params)
+    paths = output_paths(result)
+    fresh = {density: entries.get(entry_name(cache, path)) for density, path in paths.items()}
+    if all(is_fresh(fresh[density], key, path) for density, path in paths.items()):
+        result['size'] = fresh[1]['size']
+        if 2 in fresh:
+            result['retina_size'] = fresh[2]['size']
+        result['cached'] = True
+    return key
+
+
+def write_result(result, key, outputs, error, cache, entries):
+    """
+    レンダリング結果 {密度: エンコード結果} を保存し、キャッシュエントリを更新する
+
+    'encoder' には 1x で選ばれたエンコーダ、'encode_time' と 'saved'（ロスレス候補からの
+    削減バイト数）には全密度の合計を記録します。既存のファイルと同じバイト列なら書き込まず、
+    すべての密度で書き込みを省いた場合は 'unchanged' を立てます。
+    """
+    result['error'] = error
+    if error is not None:
+        return
+    result['encode_time'] = 0.0
+    result['saved'] = 0
+    result['unchanged'] = True
+    for density, path in output_paths(result).items():
+        encoded = outputs[density]
+        if write_if_changed(path, encoded['data']):
+            result['unchanged'] = False
+        result['size' if density == 1 else 'retina_size'] = len(encoded['data'])
+        result['encode_time'] += encoded['seconds']
+        if encoded['reference_size'] is not None:
+            result['saved'] += encoded['reference_size'] - len(encoded['data'])
+        if cache:
+            entries[entry_name(cache, path)] = make_entry(key, path)
+    result['encoder'] = outputs[1]['encoder']
+
+
+def print_results(results):
+    """
+    セルごとの結果を一覧表示
+    """
+    total = len(results)
+    for i, result in enumerate(results):
+        sizes = f"{result['size']} bytes"
+        if 'retina_path' in result:
+            sizes += f", @2x {result['retina_size']} bytes"
+        if result['cached']:
+            print(f"⏭️ [{i+1}/{total}] 変更なし: {result['filename']} ({sizes})")
+        elif result['error'] is None:
+            encoding = f"{result['encoder']} {result['encode_time'] * 1000:.0f} ms"
+            if result['saved']:
+                encoding += f", {result['saved']} bytes 削減"
+            if result['unchanged']:
+                encoding += ", 内容が同じため書き込み省略"
+            print(f"✅ [{i+1}/{total}] 保存完了: {result['filename']} ({sizes}, {encoding})")
+        else:
+            print(f"❌ [{i+1}/{total}] スタンプ {result['name']} の処理に失敗: {result['error']}")
+
+    encoded = [result for result in results if 'encoder' in result and result['error'] is None]
+    saved = sum(result['saved'] for result in encoded)
+    if saved:
+        print(f"💾 エンコード: {sum(result['encode_time'] for result in encoded) * 1000:.0f} ms、"
+              f"合計 {saved} bytes 削減")
+
+
+def summarize_outputs(directory, prefix='', extension='.png'):
+    """
+    出力ディレクトリのファイル名とサイズを1回の os.scandir で集め、ファイル名順に表示する
+
+    Returns:
+        (ファイル名, バイト数) のリスト
+    """
+    with os.scandir(directory) as entries:
+        files = sorted((entry.name, entry.stat().st_size) for entry in entries
+                       if entry.is_file() and entry.name.startswith(prefix) and entry.name.endswith(extension))
+    for filename, size in files:
+        print(f"  {filename} ({size} bytes)")
+    return files
+
+
+def run_bounded(tasks, workers, executor=None):
+    """
+    (関数, 引数タプル, 文脈) のタスクを実行し、(文脈, 戻り値, 例外) を返す
+
+    workers が1ならその場で順に実行します。2以上ならプロセスプールで実行し、
+    処理待ちのタスクを溜め込みすぎないようワーカー数の2倍までに抑えます
+    （結果は完了した順）。プールは最初のタスクが来たときに作ります。
+    executor を渡すとそのプールを使い、終了はさせません（監視モードで使い回すため）。
+    """
+    if workers == 1:
+        for func, args, context in tasks:
+            try:
+                yield context, func(*args), None
+            except Exception as e:
+                yield context, None, e
+        return
+
+    owned = executor is None
+    in_flight = {}
+    try:
+        for func, args, context in tasks:
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=workers)
+            in_flight[executor.submit(func, *args)] = context
+            del args
+            if len(in_flight) >= workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield (in_flight.pop(future), *_future_output(future))
+
+        for future in list(in_flight):
+            yield (in_flight.pop(future), *_future_output(future))
+    finally:
+        if owned and executor is not None:
+            executor.shutdown()
+
+
+def _future_output(future):
+    try:
+        return future.result(), None
+    except Exception as e:
+        return None, e
@@ -0,0 +1,149 @@
+"""
+射影プロファイルによるグリッド（セル矩形）の自動検出
+
+非白色マスク（1ピクセル1バイト）を1回だけ計算し、領域の行/列プロファイルはマスクの
+切り出しを行/列ごとに数えて求めます。余白（ガター）で領域を再帰的に分割する XY-cut では
+同じ深さの領域が重ならないので、深さごとにマスクを1回なめるだけで済み、プロファイル以外の
+作業メモリ（シートと同じ大きさの累積和など）は作りません。
+"""
+
+import numpy as np
+
+# 検出パラメータのデフォルト値
+DEFAULT_GRID_PARAMS = {
+    'threshold': 200,   # RGBの最小値がこれ未満のピクセルをコンテンツとみなす（淡い背景色も無視する）
+    'noise': 0,         # プロファイルの値がこれ以下の行/列は空白とみなす
+    'min_gap': 12,      # これより狭い空白は分割に使わない（文字間のすき間など）
+    'min_size': 24,     # これより小さい帯は無視する（罫線やゴミ）
+    'pad': 6,           # 検出したコンテンツの周囲に付ける余白
+}
+
+
+def foreground_mask(sheet, threshold=200):
+    """
+    白・淡色の背景以外（コンテンツ）のマスクを返す
+    """
+    mask = sheet[:, :, :3].min(axis=2) < threshold
+    if sheet.shape[2] == 4:
+        mask &= sheet[:, :, 3] > 0
+    return mask
+
+
+def row_profile(mask, x0, y0, x1, y1):
+    """
+    領域 [y0:y1, x0:x1] の各行のコンテンツピクセル数
+    """
+    return np.count_nonzero(mask[y0:y1, x0:x1], axis=1)
+
+
+def column_profile(mask, x0, y0, x1, y1):
+    """
+    領域 [y0:y1, x0:x1] の各列のコンテンツピクセル数
+    """
+    return np.count_nonzero(mask[y0:y1, x0:x1], axis=0)
+
+
+def find_runs(profile, min_gap=12, min_size=24, noise=0):
+    """
+    プロファイルからコンテンツのある区間 [start, end) を検出
+
+    min_gap 未満の空白で区切られた区間は1つにまとめ、
+    min_size 未満の区間は捨てます。
+    """
+    filled = np.concatenate(([False], profile > noise, [False]))
+    edges = np.flatnonzero(filled[1:] != filled[:-1])
+
+    runs = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        if runs and start - runs[-1][1] < min_gap:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+
+    return [(int(start), int(end)) for start, end in runs if end - start >= min_size]
+
+
+def _xy_cut(mask, x0, y0, x1, y1, params, boxes, depth=0):
+    runs_kwargs = {
+        'min_gap': params['min_gap'],
+        'min_size': params['min_size'],
+        'noise': params['noise'],
+    }
+    rows = find_runs(row_profile(mask, x0, y0, x1, y1), **runs_kwargs)
+    if not rows:
+        return
+    cols = find_runs(column_profile(mask, x0, y0, x1, y1), **runs_kwargs)
+    if not cols:
+        return
+
+    if (len(rows) == 1 and len(cols) == 1) or depth > 32:
+        # これ以上分割できない: コンテンツにぴったり合わせた矩形
+        boxes.append((x0 + cols[0][0], y0 + rows[0][0], x0 + cols[-1][1], y0 + rows[-1][1]))
+        return
+
+    # 横方向の余白（行の区切り）を優先して分割する
+    if len(rows) > 1:
+        for start, end in rows:
+            _xy_cut(mask, x0, y0 + start, x1, y0 + end, params, boxes, depth + 1)
+    else:
+        for start, end in cols:
+            _xy_cut(mask, x0 + start, y0, x0 + end, y1, params, boxes, depth + 1)
+
+
+def reading_order(boxes):
+    """
+    矩形を行優先（上から下、左から右）に並べ替え、行・列番号を付ける
+
+    縦方向の中心が前の行の範囲に入っている矩形は同じ行とみなします。
+
+    Returns:
+        [(row, col, box), ...]
+    """
+    rows = []
+    for box in sorted(boxes, key=lambda b: (b[1] + b[3]) / 2):
+        center_y = (box[1] + box[3]) / 2
+        if rows and rows[-1]['top'] <= center_y <= rows[-1]['bottom']:
+            rows[-1]['boxes'].append(box)
+            rows[-1]['bottom'] = max(rows[-1]['bottom'], box[3])
+        else:
+            rows.append({'top': box[1], 'bottom': box[3], 'boxes': [box]})
+
+    ordered = []
+    for row, group in enumerate(rows):
+        for col, box in enumerate(sorted(group['boxes'], key=lambda b: b[0])):
+            ordered.append((row, col, box))
+    return ordered
+
+
+def detect_grid(sheet, **overrides):
+    """
+    シート配列からスタンプのセル矩形を自動検出
+
+    Args:
+        sheet: シートのRGB/RGBA配列
+        **overrides: DEFAULT_GRID_PARAMS の上書き
+
+    Returns:
+        行優先に並んだセル辞書のリスト（'row', 'col', 'x', 'y', 'w', 'h'）
+    """
+    unknown = set(overrides) - set(DEFAULT_GRID_PARAMS)
+    if unknown:
+        raise ValueError(f"不明なパラメータ: {', '.join(sorted(unknown))}")
+    params = dict(DEFAULT_GRID_PARAMS)
+    params.update(overrides)
+
+    height, width = sheet.shape[:2]
+    mask = foreground_mask(sheet, params['threshold'])
+
+    boxes = []
+    _xy_cut(mask, 0, 0, width, height, params, boxes)
+
+    pad = params['pad']
+    cells = []
+    for row, col, (left, top, right, bottom) in reading_order(boxes):
+        left = max(0, left - pad)
+        top = max(0, top - pad)
+        right = min(width, right + pad)
+        bottom = min(height, bottom + pad)
+        cells.append({'row': row, 'col': col, 'x': left, 'y': top, 'w': right - left, 'h': bottom - top})
+    return cells
@@ -0,0 +1,137 @@
+"""
+スタンプシートのレイアウト定義
+セルは (x, y, w, h) の矩形を持つ辞書で表します。
+"""
+
+import re
+
+# あおちゃんシート（3行4列、行優先）
+AO_STAMPS = [
+    # 1行目: こんにちは、おやすみ〜、やった〜！、おたんじょうび
+    {'name': 'hello', 'id': 'ao_hello', 'filename': 'ao_hello.png'},
+    {'name': 'sleeping', 'id': 'ao_sleeping', 'filename': 'ao_sleeping.png'},
+    {'name': 'celebration', 'id': 'ao_celebration', 'filename': 'ao_celebration.png'},
+    {'name': 'birthday', 'id': 'ao_birthday', 'filename': 'ao_birthday.png'},
+
+    # 2行目: ぷんぷん、なでて〜、ありがとう、すき
+    {'name': 'angry', 'id': 'ao_angry', 'filename': 'ao_angry.png'},
+    {'name': 'playing', 'id': 'ao_playing', 'filename': 'ao_playing.png'},
+    {'name': 'thanks', 'id': 'ao_thanks', 'filename': 'ao_thanks.png'},
+    {'name': 'love', 'id': 'ao_love', 'filename': 'ao_love.png'},
+
+    # 3行目: だいすき、おめかし、Present!、OK!
+    {'name': 'happy', 'id': 'ao_happy', 'filename': 'ao_happy.png'},
+    {'name': 'shy', 'id': 'ao_shy', 'filename': 'ao_shy.png'},
+    {'name': 'present', 'id': 'ao_present', 'filename': 'ao_present.png'},
+    {'name': 'ok', 'id': 'ao_ok', 'filename': 'ao_ok.png'},
+]
+
+AO_ROWS = 3
+AO_COLS = 4
+
+# アプリ側のスタンプ定義（scripts/ から実行したときのパス）
+STAMPS_TS_PATH = '../lib/constants/stamps.ts'
+
+_TS_OBJECT = re.compile(r'\{[^{}]*\}')
+_TS_FIELD = re.compile(r"(\w+):\s*'([^']*)'")
+
+
+def read_stamp_defs(path=STAMPS_TS_PATH):
+    """
+    lib/constants/stamps.ts のスタンプ定義を読む
+
+    Returns:
+        文字列フィールド（'id', 'src', 'srcRetina' など）の辞書のリスト（定義順）。
+        'id' を持たないオブジェクトは含みません。
+    """
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+
+    stamps = []
+    for block in _TS_OBJECT.findall(source):
+        fields = dict(_TS_FIELD.findall(block))
+        if 'id' in fields:
+            stamps.append(fields)
+    return stamps
+
+
+def grid_rects(size, rows, cols, margin_ratio=0.0):
+    """
+    グリッド状に配置されたセルの矩形を行優先で返す
+
+    余白の丸め方は PIL の Image.crop と同じ（round）にしているので、
+    crop_stamp_precise() と同じ範囲になります。
+    """
+    width, height = size
+    stamp_width = width // cols
+    stamp_height = height // rows
+
+    margin_x = stamp_width * margin_ratio
+    margin_y = stamp_height * margin_ratio
+    left = round(margin_x)
+    top = round(margin_y)
+    right = round(stamp_width - margin_x)
+    bottom = round(stamp_height - margin_y)
+
+    rects = []
+    for row in range(rows):
+        for col in range(cols):
+            rects.append((
+                col * stamp_width + left,
+                row * stamp_height + top,
+                right - left,
+                bottom - top,
+            ))
+    return rects
+
+
+def grid_cells(size, rows, cols, margin=0):
+    """
+    グリッドのセルを detect_grid() と同じ形式（'row', 'col', 'x', 'y', 'w', 'h'）で返す
+    """
+    cells = []
+    for i, rect in enumerate(grid_rects(size, rows, cols)):
+        x, y, w, h = inset_rect(rect, margin)
+        cells.append({'row': i // cols, 'col': i % cols, 'x': x, 'y': y, 'w': w, 'h': h})
+    return cells
+
+
+def inset_rect(rect, margin):
+    """
+    矩形の四辺を margin ピクセルずつ内側に縮める
+    """
+    x, y, w, h = rect
+    return x + margin, y + margin, w - 2 * margin, h - 2 * margin
+
+
+def build_cells(stamps, rects):
+    """
+    スタンプ情報と矩形を組み合わせたセル定義を作成
+    """
+    if len(stamps) != len(rects):
+        raise ValueError(f"スタンプ数 ({len(stamps)}) と矩形数 ({len(rects)}) が一致しません")
+
+    cells = []
+    for stamp, (x, y, w, h) in zip(stamps, rects):
+        cell = dict(stamp)
+        cell.update({'x': x, 'y': y, 'w': w, 'h': h})
+        cells.append(cell)
+    return cells
+
+
+def detected_cells(detected, stamps=None):
+    """
+    自動検出したセルにスタンプ情報を割り当てる
+
+    検出数とスタンプ数が一致すれば行優先の順に割り当て、
+    一致しなければ行・列番号から仮の名前（stamp_r1_c1.png など）を付けます。
+    """
+    rects = [(cell['x'], cell['y'], cell['w'], cell['h']) for cell in detected]
+    if stamps is not None and len(stamps) == len(detected):
+        return build_cells(stamps, rects)
+
+    stamps = []
+    for cell in detected:
+        label = f"r{cell['row']+1}_c{cell['col']+1}"
+        stamps.append({'name': label, 'id': f"stamp_{label}", 'filename': f"stamp_{label}.png"})
+    return build_cells(stamps, rects)
@@ -0,0 +1,281 @@
+"""
+シートのマニフェスト（宣言的なレイアウト定義）
+
+シートごとに JSON で「どのセル → どのスタンプ id → どのファイル名 → 上書き設定」を書きます。
+id は lib/constants/stamps.ts と照合し、セルの位置（グリッド・検出した矩形）と組み合わせて
+セル定義のリストにコンパイルします。コンパイル結果はレイアウトのインデックスに保存し、
+シート・マニフェスト・stamps.ts が変わっていなければ再実行時はグリッド検出を省きます。
+
+    {
+      "sheet": "../temporary_upload/名称未設定.png",
+      "output": "../public/images/stamps/ao",
+      "layout": {"method": "detect"},
+      "params": {"retina": true},
+      "stamps": [
+        {"cell": [0, 0], "id": "ao_hello"},
+        {"cell": [0, 3], "id": "ao_birthday", "overrides": {"margin": -20, "params": {"threshold": "auto"}}},
+        {"rect": [1720, 714, 313, 333], "id": "ao_present", "filename": "ao_present.png"}
+      ]
+    }
+
+layout の method は 'grid'（rows, cols）・'detect'・'segment' で、margin（既定 0）で
+四辺を削ります（負なら広げる）。ファイル名を省くと stamps.ts の src のファイル名を使います。
+"""
+
+import hashlib
+import json
+import os
+
+from PIL import Image
+
+from .cache import load_cache, save_cache
+from .core import make_params
+from .engine import load_sheet
+from .grid import detect_grid
+from .layouts import STAMPS_TS_PATH, grid_cells, inset_rect, read_stamp_defs
+from .segment import segment_stamps
+
+# コンパイル結果の形式を変えたときに上げると、既存のインデックスがすべて無効になる
+LAYOUT_VERSION = 1
+
+# スクリプトを scripts/ から実行したときのインデックスファイル
+DEFAULT_LAYOUT_INDEX_PATH = '.stamp_layout.json'
+
+LAYOUT_METHODS = ('grid', 'detect', 'segment')
+
+# stamps の各項目の上書きに書けるもの
+OVERRIDE_KEYS = ('margin', 'rect', 'params')
+
+
+def load_manifest(path):
+    """
+    マニフェストを読み込む
+
+    Raises:
+        ValueError: JSON として読めない、または必須の項目がない場合
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except ValueError as e:
+        raise ValueError(f"マニフェストを読めません: {path}: {e}")
+
+    for field in ('sheet', 'output', 'layout', 'stamps'):
+        if field not in manifest:
+            raise ValueError(f"マニフェストに '{field}' がありません: {path}")
+    manifest.setdefault('params', {})
+    return manifest
+
+
+def _sources(stamp_defs):
+    # {id: stamps.ts の src}
+    return {stamp['id']: stamp.get('src') for stamp in stamp_defs or []}
+
+
+def _filename(entry, sources):
+    # 指定がなければ stamps.ts の src のファイル名（stamps.ts にない id なら id.png）
+    if 'filename' in entry:
+        return entry['filename']
+    source = sources.get(entry['id'])
+    return os.path.basename(source) if source else f"{entry['id']}.png"
+
+
+def _cell_label(entry):
+    if 'cell' in entry:
+        row, col = entry['cell']
+        return f"r{row + 1}_c{col + 1}"
+    return 'rect'
+
+
+def validate_manifest(manifest, stamp_defs=None):
+    """
+    マニフェストの内容を確かめる
+
+    Args:
+        manifest: load_manifest() の結果
+        stamp_defs: read_stamp_defs() の結果（None なら id の照合をしない）
+
+    Returns:
+        (エラーのリスト, 警告のリスト)。エラーがあればコンパイルしません。
+    """
+    errors = []
+    warnings = []
+
+    method = manifest['layout'].get('method')
+    if method not in LAYOUT_METHODS:
+        errors.append(f"不明なレイアウト: {method}")
+    try:
+        make_params(**manifest['params'])
+    except ValueError as e:
+        errors.append(str(e))
+
+    known = {stamp['id'] for stamp in stamp_defs} if stamp_defs is not None else None
+    sources = _sources(stamp_defs)
+    seen = {'id': {}, 'filename': {}, 'cell': {}}
+    for number, entry in enumerate(manifest['stamps'], 1):
+        stamp_id = entry.get('id')
+        if not stamp_id:
+            errors.append(f"{number} 番目に id がありません")
+            continue
+        if ('cell' in entry) == ('rect' in entry):
+            errors.append(f"{stamp_id}: 'cell' と 'rect' のどちらか一方を指定してください")
+        if 'rect' in entry and len(entry['rect']) != 4:
+            errors.append(f"{stamp_id}: 'rect' は [x, y, w, h] で指定してください")
+
+        overrides = entry.get('overrides', {})
+        unknown = set(overrides) - set(OVERRIDE_KEYS)
+        if unknown:
+            errors.append(f"{stamp_id}: 不明な上書き: {', '.join(sorted(unknown))}")
+        try:
+            make_params(**dict(manifest['params'], **overrides.get('params', {})))
+        except ValueError as e:
+            errors.append(f"{stamp_id}: {e}")
+
+        if known is not None and stamp_id not in known:
+            errors.append(f"{stamp_id}: stamps.ts にない id です")
+
+        # 同じファイル名・同じセルに2つのスタンプを割り当てると、後のもので上書きされてしまう
+        keys = {'id': stamp_id, 'filename': _filename(entry, sources),
+                'cell': tuple(entry['cell']) if 'cell' in entry else None}
+        for kind, value in keys.items():
+            if value is None:
+                continue
+            if value in seen[kind]:
+                errors.append(f"{stamp_id}: {kind} が {seen[kind][value]} と重複しています")
+            seen[kind][value] = stamp_id
+
+    if known is not None:
+        character = os.path.basename(os.path.normpath(manifest['output']))
+        listed = set(seen['id'])
+        missing = [stamp['id'] for stamp in stamp_defs
+                   if os.path.basename(os.path.dirname(stamp.get('src', ''))) == character
+                   and stamp['id'] not in listed]
+        if missing:
+            warnings.append(f"stamps.ts の id のうちマニフェストにないもの: {', '.join(missing)}")
+
+    return errors, warnings
+
+
+def locate_cells(sheet, layout):
+    """
+    レイアウトの指定からセル（'row', 'col', 'x', 'y', 'w', 'h'）を求める
+
+    Args:
+        sheet: シートのRGBA配列（'grid' ならパスでもよい。サイズだけ読みます）
+        layout: マニフェストの 'layout'
+    """
+    method = layout['method']
+    if method == 'grid':
+        if isinstance(sheet, (str, os.PathLike)):
+            with Image.open(sheet) as image:
+                size = image.size
+        else:
+            size = (sheet.shape[1], sheet.shape[0])
+        return grid_cells(size, layout['rows'], layout['cols'])
+    if method == 'detect':
+        return detect_grid(sheet)
+    if method == 'segment':
+        return segment_stamps(sheet)
+    raise ValueError(f"不明なレイアウト: {method}")
+
+
+def compile_manifest(manifest, located, stamp_defs=None):
+    """
+    マニフェストと求めたセルからセル定義のリストを作る
+
+    Returns:
+        extract_stamps() に渡すセル定義のリスト（マニフェストの順。上書きした処理パラメータは 'params'）
+
+    Raises:
+        ValueError: マニフェストのセルが見つからない場合
+    """
+    by_position = {(cell['row'], cell['col']): cell for cell in located}
+    sources = _sources(stamp_defs)
+    default_margin = manifest['layout'].get('margin', 0)
+
+    cells = []
+    for entry in manifest['stamps']:
+        overrides = entry.get('overrides', {})
+        if 'rect' in overrides or 'rect' in entry:
+            rect = tuple(overrides.get('rect', entry.get('rect')))
+        else:
+            position = tuple(entry['cell'])
+            if position not in by_position:
+                raise ValueError(f"{entry['id']}: セル {_cell_label(entry)} が見つかりません")
+            found = by_position[position]
+            rect = (found['x'], found['y'], found['w'], found['h'])
+        x, y, w, h = inset_rect(rect, overrides.get('margin', default_margin))
+
+        cell = {
+            'name': entry.get('name', entry['id']),
+            'id': entry['id'],
+            'filename': _filename(entry, sources),
+            'x': x, 'y': y, 'w': w, 'h': h,
+        }
+        if overrides.get('params'):
+            cell['params'] = overrides['params']
+        cells.append(cell)
+    return cells
+
+
+def _file_digest(path):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def layout_key(manifest, stamp_defs=None):
+    """
+    コンパイル結果が使い回せるかを決めるキー（マニフェスト・シートの中身・stamps.ts）
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"v{LAYOUT_VERSION}".encode())
+    digest.update(json.dumps(manifest, sort_keys=True).encode())
+    digest.update(_file_digest(manifest['sheet']).encode())
+    digest.update(json.dumps(stamp_defs, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def manifest_layout(manifest_path, index=DEFAULT_LAYOUT_INDEX_PATH, stamps_ts=STAMPS_TS_PATH):
+    """
+    マニフェストを検証・コンパイルし、インデックスを使ってセル定義を返す
+
+    インデックスのキーが一致すればシートをデコードせず、保存しておいたセル定義を返します。
+
+    Args:
+        manifest_path: マニフェストのパス
+        index: レイアウトのインデックスファイル（None なら使わない）
+        stamps_ts: 照合する stamps.ts（存在しなければ照合しない）
+
+    Returns:
+        (マニフェスト, シート（デコードした場合はRGBA配列、しなかった場合はパス）,
+         セル定義のリスト, 警告のリスト, インデックスを使ったかどうか)
+
+    Raises:
+        ValueError: マニフェストにエラーがある場合（すべてのエラーをまとめて報告する）
+    """
+    manifest = load_manifest(manifest_path)
+    stamp_defs = read_stamp_defs(stamps_ts) if stamps_ts and os.path.exists(stamps_ts) else None
+    errors, warnings = validate_manifest(manifest, stamp_defs)
+    if errors:
+        raise ValueError("マニフェストにエラーがあります:\n" + '\n'.join(f"  - {error}" for error in errors))
+
+    sheet = manifest['sheet']
+    key = layout_key(manifest, stamp_defs) if index else None
+    entries = load_cache(index) if index else {}
+    name = os.path.abspath(manifest_path)
+    entry = entries.get(name)
+    if entry is not None and entry.get('key') == key:
+        return manifest, sheet, entry['cells'], warnings, True
+
+    if manifest['layout']['method'] != 'grid':
+        sheet = load_sheet(sheet)
+    located = locate_cells(sheet, manifest['layout'])
+    cells = compile_manifest(manifest, located, stamp_defs)
+
+    if index:
+        entries[name] = {'key': key, 'located': located, 'cells': cells}
+        save_cache(index, entries)
+    return manifest, sheet, cells, warnings, False
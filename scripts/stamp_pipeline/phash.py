@@ -0,0 +1,279 @@
+"""
+知覚ハッシュによる重複・プレースホルダーのスタンプ検出
+
+画像の非透明部分を切り出して白背景に合成したグレースケールから dHash（隣り合う明るさの大小）と
+pHash（DCT の低周波成分と中央値の大小）を64ビットで求めます。ハッシュは画像をまとめて
+配列に積み、ベクトル演算で計算します。ハミング距離が近いものはマルチインデックスハッシング
+（ハッシュを区間に分け、どれかの区間が十分近いものだけを比べる）で探すので、全ペアを比べる必要はありません。ファイルごとのハッシュはインデックスに保存し、
+更新時刻とサイズが変わっていない画像は読み直しません。
+"""
+
+import hashlib
+import itertools
+import os
+
+from PIL import Image
+import numpy as np
+
+from .cache import load_cache, save_cache
+
+# スクリプトを scripts/ から実行したときのインデックスファイル
+DEFAULT_PHASH_INDEX_PATH = '.stamp_phash.json'
+
+HASH_KINDS = ('dhash', 'phash')
+
+IMAGE_EXTENSIONS = ('.png', '.webp', '.jpg', '.jpeg')
+
+# 比べる対象にしないディレクトリ（アトラスと、1x と同じ絵になる @2x と、ハッシュ付きファイル名のコピー）
+SKIP_DIRS = ('atlas', 'retina', 'hashed')
+
+# pHash で DCT をかける大きさと、使う低周波成分の大きさ
+PHASH_SIZE = 32
+PHASH_LOW = 8
+
+# このアルファ以下しかない画像は空とみなす
+BLANK_ALPHA = 10
+
+# 近いハッシュを探すときにハッシュを分ける区間の数（12〜13ビットずつ）
+MULTI_INDEX_CHUNKS = 5
+
+# 同じ絵とみなす pHash の距離（同じ絵の 1x と @2x は 6 以下、別のスタンプは 12 以上だった）
+DUPLICATE_RADIUS = 8
+
+
+def _dct_matrix(n):
+    # DCT-II の変換行列（直交化の係数は大小の比較に影響しないので省く）
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * x + 1) * k / (2 * n))
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+
+
+def _pack_bits(bits):
+    # (N, 64) の真偽値 → 64ビットの整数のリスト
+    packed = np.packbits(bits.astype(np.uint8), axis=1)
+    return [int.from_bytes(row.tobytes(), 'big') for row in packed]
+
+
+def dhash_stack(stack):
+    """
+    (N, 8, 9) のグレースケールの束から dHash を求める
+    """
+    bits = stack[:, :, 1:] > stack[:, :, :-1]
+    return _pack_bits(bits.reshape(len(stack), -1))
+
+
+def phash_stack(stack):
+    """
+    (N, 32, 32) のグレースケールの束から pHash を求める
+    """
+    coeffs = _DCT @ stack @ _DCT.T
+    low = coeffs[:, :PHASH_LOW, :PHASH_LOW].reshape(len(stack), -1)
+    # 直流成分（平均の明るさ）は中央値の計算に入れない
+    median = np.median(low[:, 1:], axis=1)
+    return _pack_bits(low > median[:, None])
+
+
+def _gray_on_white(image):
+    # 非透明部分を切り出し、透過部分を白にしたグレースケールと、空の画像かどうか
+    # （キャンバスの余白や配置の違いではなく、絵柄だけで比べる）
+    rgba = image.convert('RGBA')
+    bbox = rgba.getchannel('A').point(lambda a: 255 if a > BLANK_ALPHA else 0).getbbox()
+    if bbox is None:
+        return Image.new('L', rgba.size, 255), True
+    rgba = rgba.crop(bbox)
+    white = Image.new('RGBA', rgba.size, (255, 255, 255, 255))
+    return Image.alpha_composite(white, rgba).convert('L'), False
+
+
+def hash_images(paths):
+    """
+    画像ファイルの知覚ハッシュをまとめて求める
+
+    Returns:
+        {パス: {'dhash', 'phash'（16進数）, 'digest'（ファイルの中身のハッシュ）, 'blank'}}
+    """
+    small = []
+    large = []
+    info = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        with Image.open(path) as image:
+            gray, blank = _gray_on_white(image)
+        small.append(np.asarray(gray.resize((9, 8), Image.Resampling.BOX), dtype=np.int16))
+        large.append(np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.Resampling.BOX), dtype=np.float64))
+        info[path] = {'digest': hashlib.blake2b(raw, digest_size=16).hexdigest(), 'blank': blank}
+
+    if not info:
+        return {}
+    for path, dhash, phash in zip(info, dhash_stack(np.stack(small)), phash_stack(np.stack(large))):
+        info[path].update({'dhash': f"{dhash:016x}", 'phash': f"{phash:016x}"})
+    return info
+
+
+def list_images(root, skip_dirs=SKIP_DIRS):
+    """
+    root 以下の画像ファイルをパス順に返す（skip_dirs の名前のディレクトリは除く）
+    """
+    paths = []
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if entry.name not in skip_dirs:
+                        stack.append(entry.path)
+                elif entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(entry.path)
+    return sorted(paths)
+
+
+def update_index(paths, index=DEFAULT_PHASH_INDEX_PATH):
+    """
+    インデックスを読み、更新時刻かサイズが変わった画像だけハッシュを求め直す
+
+    Args:
+        paths: 画像ファイルのパスのリスト
+        index: インデックスファイル（None なら保存しない）
+
+    Returns:
+        ({パス: hash_images() の値}, ハッシュを求め直した画像の数)
+    """
+    entries = load_cache(index) if index else {}
+    stats = {path: os.stat(path) for path in paths}
+    stale = [path for path, stat in stats.items()
+             if entries.get(path, {}).get('stat') != [stat.st_mtime_ns, stat.st_size]]
+
+    for path, info in hash_images(stale).items():
+        entries[path] = dict(info, stat=[stats[path].st_mtime_ns, stats[path].st_size])
+
+    hashes = {path: entries[path] for path in paths}
+    if index and (stale or len(entries) != len(hashes)):
+        save_cache(index, hashes)
+    return hashes, len(stale)
+
+
+def hamming(a, b):
+    """
+    2つのハッシュ（整数）のハミング距離
+    """
+    return (a ^ b).bit_count()
+
+
+# 0〜255 の立っているビットの数（np.bitwise_count は NumPy 2.0 以降にしかないので表を引く）
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(values):
+    """
+    uint64 配列の要素ごとの立っているビットの数（int64 の配列）
+    """
+    octets = np.ascontiguousarray(values, dtype=np.uint64).view(np.uint8).reshape(-1, 8)
+    return _POPCOUNT[octets].sum(axis=1, dtype=np.int64)
+
+
+def _flip_masks(bits, radius):
+    # bits ビットの値で、立っているビットが radius 個以下のものすべて
+    masks = [0]
+    for count in range(1, radius + 1):
+        for positions in itertools.combinations(range(bits), count):
+            masks.append(sum(1 << position for position in positions))
+    return np.array(masks, dtype=np.uint64)
+
+
+def near_pairs(values, radius):
+    """
+    ハミング距離が radius 以下の組を (i, j, 距離) の配列で返す（i < j）
+
+    マルチインデックスハッシング: 64ビットを MULTI_INDEX_CHUNKS 個の区間に分けると、
+    距離が radius 以下の2つは鳩の巣原理でどれかの区間の距離が radius // 区間数 以下になります。
+    区間ごとに値を並べ替えておき、その距離以内の値（ビットを反転させたもの）を二分探索で
+    まとめて引いた組だけを候補にし、候補の距離はベクトル演算で数えて確かめます。
+
+    Args:
+        values: ハッシュ（64ビット整数）のリスト
+    """
+    values = np.array(values, dtype=np.uint64)
+    count = len(values)
+    bounds = np.linspace(0, 64, MULTI_INDEX_CHUNKS + 1).astype(int)
+
+    found = [np.empty((0, 3), dtype=np.int64)]
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        bits = int(high - low)
+        flips = _flip_masks(bits, radius // MULTI_INDEX_CHUNKS)
+        chunk = (values >> np.uint64(low)) & np.uint64((1 << bits) - 1)
+        order = np.argsort(chunk, kind='stable')
+        ordered = chunk[order]
+        for flip in flips:
+            keys = chunk ^ flip
+            left = np.searchsorted(ordered, keys, 'left')
+            matches = np.searchsorted(ordered, keys, 'right') - left
+            total = int(matches.sum())
+            if total == 0:
+                continue
+            # 値 i ごとに一致した範囲 [left, left + matches) を展開する
+            first = np.repeat(np.arange(count), matches)
+            offsets = np.arange(total) - np.repeat(np.cumsum(matches) - matches, matches)
+            second = order[np.repeat(left, matches) + offsets]
+            keep = first < second
+            first, second = first[keep], second[keep]
+            distances = popcount(values[first] ^ values[second])
+            close = distances <= radius
+            found.append(np.column_stack([first[close], second[close], distances[close]]))
+
+    return np.unique(np.concatenate(found), axis=0)
+
+
+def find_duplicates(hashes, kind='phash', radius=DUPLICATE_RADIUS):
+    """
+    ハッシュの距離が radius 以下でつながる画像をグループにまとめる
+
+    Args:
+        hashes: update_index() の結果
+        kind: 比べるハッシュ（'dhash' または 'phash'）
+        radius: 同じ絵とみなすハミング距離の上限（64ビット中）
+
+    Returns:
+        グループのリスト。グループは {'paths', 'distance'（グループ内で見つけた最大の距離）,
+        'identical'（ファイルの中身がすべて同じ）, 'blank'（すべて空の画像）}
+    """
+    if kind not in HASH_KINDS:
+        raise ValueError(f"不明なハッシュ: {kind}")
+
+    paths = list(hashes)
+    parent = list(range(len(paths)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    largest = {}
+    for i, j, distance in near_pairs([int(hashes[path][kind], 16) for path in paths], radius).tolist():
+        root, other_root = find(i), find(j)
+        if root != other_root:
+            parent[root] = other_root
+        largest[i] = max(largest.get(i, 0), distance)
+        largest[j] = max(largest.get(j, 0), distance)
+
+    groups = {}
+    for i in range(len(paths)):
+        groups.setdefault(find(i), []).append(i)
+
+    duplicates = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        group = sorted(paths[i] for i in members)
+        duplicates.append({
+            'paths': group,
+            'distance': max(largest.get(i, 0) for i in members),
+            'identical': len({hashes[path]['digest'] for path in group}) == 1,
+            'blank': all(hashes[path]['blank'] for path in group),
+        })
+    duplicates.sort(key=lambda group: group['paths'])
+    return duplicates
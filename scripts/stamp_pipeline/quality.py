@@ -0,0 +1,234 @@
+"""
+出力スタンプの品質指標
+
+出力した画像をまとめて配列に積み、次の指標をベクトル演算で求めます。
+
+- coverage: 不透明なピクセルの割合（0 なら空のスタンプ、1 近くなら背景が抜けていない）
+- bbox_fill: 不透明部分のバウンディングボックスのうち、不透明なピクセルの割合
+- halo: 輪郭（透明なピクセルに隣接する不透明なピクセル）のうち、白っぽいものの割合（白いフチ）
+- ssim: 基準画像（golden）との構造的類似度（白背景に合成した明るさで比べる、基準がなければ None）
+
+結果はファイルの中身（と基準画像）のハッシュごとにキャッシュし、変わっていない画像は読み直しません。
+"""
+
+import hashlib
+import io
+import os
+
+from PIL import Image
+import numpy as np
+
+from .cache import load_cache, save_cache
+
+# スクリプトを scripts/ から実行したときのキャッシュファイルと基準画像のディレクトリ
+DEFAULT_QUALITY_CACHE_PATH = '.stamp_quality.json'
+DEFAULT_GOLDEN_DIR = 'golden'
+
+# 指標を変えたときに上げると、既存のキャッシュがすべて無効になる
+QUALITY_VERSION = 1
+
+# このアルファより大きいピクセルを不透明とみなす
+OPAQUE_ALPHA = 10
+
+# 輪郭のピクセルのRGBの最小値がこれ以上なら白いフチとみなす（背景透過の既定の閾値）
+HALO_WHITE = 230
+
+# SSIM の窓の大きさと定数
+SSIM_WINDOW = 7
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# 合格の条件（指標: (下限, 上限)、None は制限なし）
+# 背景が抜けずに矩形のまま残ると bbox_fill が 1 近くになる。
+# halo は ao シートで次のとおりだった。
+#   既定の閾値（230）: manifests/ao.json（retina、輪郭の色を戻す）で 1x・@2x とも 0.04 以下、
+#     retina なしの hard は輪郭の明るいアンチエイリアスが残って --detect で最大 0.42
+#   閾値 245（輪郭に白い背景を残したもの）: --detect / --segment で 0.62〜0.78
+#   背景の抜け残った ao_good / ao_sleepy: 0.74 / 0.75
+QUALITY_LIMITS = {
+    'coverage': (0.05, 0.8),
+    'bbox_fill': (0.2, 0.95),
+    'halo': (None, 0.5),
+    'ssim': (0.9, None),
+}
+
+
+def _box_mean(stack, size):
+    # (N, H, W) の各位置から size x size の窓の平均（窓がはみ出さない位置だけ）を積分画像で求める
+    integral = np.pad(stack.cumsum(axis=1).cumsum(axis=2), ((0, 0), (1, 0), (1, 0)))
+    total = (integral[:, size:, size:] - integral[:, :-size, size:]
+             - integral[:, size:, :-size] + integral[:, :-size, :-size])
+    return total / (size * size)
+
+
+def ssim_stack(first, second, window=SSIM_WINDOW):
+    """
+    (N, H, W) の明るさの組ごとの平均 SSIM
+    """
+    mean_a = _box_mean(first, window)
+    mean_b = _box_mean(second, window)
+    var_a = _box_mean(first * first, window) - mean_a ** 2
+    var_b = _box_mean(second * second, window) - mean_b ** 2
+    covar = _box_mean(first * second, window) - mean_a * mean_b
+    ssim = ((2 * mean_a * mean_b + SSIM_C1) * (2 * covar + SSIM_C2)
+            / ((mean_a ** 2 + mean_b ** 2 + SSIM_C1) * (var_a + var_b + SSIM_C2)))
+    return ssim.mean(axis=(1, 2))
+
+
+def luminance_on_white(stack):
+    """
+    (N, H, W, 4) のRGBAを白背景に合成した明るさ（float64）
+    """
+    rgb = stack[..., :3].astype(np.float64)
+    alpha = stack[..., 3:4].astype(np.float64) / 255
+    composited = rgb * alpha + 255 * (1 - alpha)
+    return composited @ np.array([0.299, 0.587, 0.114])
+
+
+def measure_stack(stack, golden=None):
+    """
+    同じ大きさの画像の束の品質指標
+
+    Args:
+        stack: (N, H, W, 4) のRGBA配列
+        golden: 基準画像の (N, H, W, 4) 配列（None なら SSIM を求めない）
+
+    Returns:
+        {指標: 長さ N の配列}
+    """
+    count, height, width = stack.shape[:3]
+    opaque = stack[..., 3] > OPAQUE_ALPHA
+    filled = opaque.sum(axis=(1, 2))
+
+    rows = opaque.any(axis=2)
+    cols = opaque.any(axis=1)
+    bbox_h = np.where(filled > 0, height - rows[:, ::-1].argmax(axis=1) - rows.argmax(axis=1), 0)
+    bbox_w = np.where(filled > 0, width - cols[:, ::-1].argmax(axis=1) - cols.argmax(axis=1), 0)
+
+    # 透明なピクセル（画像の外も透明とみなす）に上下左右で接する不透明なピクセルが輪郭
+    transparent = np.pad(~opaque, ((0, 0), (1, 1), (1, 1)), constant_values=True)
+    near = (transparent[:, :-2, 1:-1] | transparent[:, 2:, 1:-1]
+            | transparent[:, 1:-1, :-2] | transparent[:, 1:-1, 2:])
+    edge = opaque & near
+    rgb = stack[..., :3]
+    white = np.minimum(np.minimum(rgb[..., 0], rgb[..., 1]), rgb[..., 2]) >= HALO_WHITE
+    edge_count = edge.sum(axis=(1, 2))
+
+    metrics = {
+        'coverage': filled / (height * width),
+        'bbox_fill': filled / np.maximum(bbox_h * bbox_w, 1),
+        'halo': (edge & white).sum(axis=(1, 2)) / np.maximum(edge_count, 1),
+    }
+    if golden is not None:
+        metrics['ssim'] = ssim_stack(luminance_on_white(stack), luminance_on_white(golden))
+    return metrics
+
+
+def _digest(raw):
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def _decode(raw):
+    # PNG などのバイト列 → RGBA配列
+    with Image.open(io.BytesIO(raw)) as image:
+        return np.array(image.convert('RGBA'))
+
+
+def golden_path_for(path, root, golden_dir):
+    """
+    出力画像に対応する基準画像のパス（root からの相対パスを golden_dir の下に置く）
+    """
+    return os.path.join(golden_dir, os.path.relpath(path, root))
+
+
+def measure_images(paths, root=None, golden_dir=None, cache=DEFAULT_QUALITY_CACHE_PATH):
+    """
+    画像ファイルの品質指標をまとめて求める
+
+    Args:
+        paths: 画像ファイルのパスのリスト
+        root: 基準画像を探すときの基準のディレクトリ（golden_dir を使う場合）
+        golden_dir: 基準画像のディレクトリ（None なら SSIM を求めない）
+        cache: キャッシュファイルのパス（None ならキャッシュを使わない）
+            画像と基準画像の中身が前回と同じなら、前回の指標をそのまま使います。
+
+    Returns:
+        {パス: {'coverage', 'bbox_fill', 'halo', 'ssim'（基準がなければ None）}}
+    """
+    entries = load_cache(cache) if cache else {}
+    results = {}
+    pending = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        golden_raw = None
+        if golden_dir is not None:
+            golden_path = golden_path_for(path, root or os.path.dirname(path), golden_dir)
+            if os.path.exists(golden_path):
+                with open(golden_path, 'rb') as f:
+                    golden_raw = f.read()
+        key = f"v{QUALITY_VERSION}:{_digest(raw)}:{_digest(golden_raw) if golden_raw else '-'}"
+
+        entry = entries.get(path)
+        if entry is not None and entry.get('key') == key:
+            results[path] = entry['metrics']
+        else:
+            pending[path] = (key, raw, golden_raw)
+
+    # 大きさが同じ画像ごとに（基準画像の有無でも分けて）まとめて計算する
+    groups = {}
+    for path, (key, raw, golden_raw) in pending.items():
+        data = _decode(raw)
+        golden = _decode(golden_raw) if golden_raw else None
+        if golden is not None and golden.shape != data.shape:
+            golden = None
+        groups.setdefault((data.shape, golden is not None), []).append((path, data, golden))
+
+    for (_, has_golden), items in groups.items():
+        stack = np.stack([data for _, data, _ in items])
+        golden = np.stack([golden for _, _, golden in items]) if has_golden else None
+        metrics = measure_stack(stack, golden)
+        for i, (path, _, _) in enumerate(items):
+            values = {name: round(float(metrics[name][i]), 4) for name in metrics}
+            values.setdefault('ssim', None)
+            results[path] = values
+            entries[path] = {'key': pending[path][0], 'metrics': values}
+
+    if cache and pending:
+        save_cache(cache, entries)
+    return {path: results[path] for path in paths}
+
+
+def check_quality(metrics, limits=QUALITY_LIMITS):
+    """
+    指標が合格の条件を満たさないものを説明の文字列のリストで返す（空なら合格）
+    """
+    problems = []
+    for name, (low, high) in limits.items():
+        value = metrics.get(name)
+        if value is None:
+            continue
+        if low is not None and value < low:
+            problems.append(f"{name} {value:.3f} < {low}")
+        if high is not None and value > high:
+            problems.append(f"{name} {value:.3f} > {high}")
+    return problems
+
+
+def print_quality(measured, root=None, limits=QUALITY_LIMITS):
+    """
+    measure_images() の結果を表示し、不合格の画像のパスのリストを返す
+    """
+    failed = []
+    for path, metrics in measured.items():
+        name = os.path.relpath(path, root) if root else os.path.basename(path)
+        ssim = '-' if metrics['ssim'] is None else f"{metrics['ssim']:.3f}"
+        summary = (f"coverage {metrics['coverage']:.3f}, bbox_fill {metrics['bbox_fill']:.3f}, "
+                   f"halo {metrics['halo']:.3f}, ssim {ssim}")
+        problems = check_quality(metrics, limits)
+        if problems:
+            failed.append(path)
+            print(f"❌ {name}: {', '.join(problems)}（{summary}）")
+        else:
+            print(f"✅ {name}: {summary}")
+    return failed
@@ -0,0 +1,289 @@
+"""
+連結成分によるスタンプの切り分け（グリッドに並んでいないシート用）
+
+シート全体の前景マスクを縮小・膨張させてから、行ごとのランレングスを
+ラベリングします（重なるランの組も、その併合もベクトル演算で行います）。
+膨張によって文字のキャプションなど近くの断片は同じ成分にまとまり、
+小さなキラキラなどは近くのスタンプに吸収されます。
+候補位置ごとに切り出して再走査する必要はありません。
+"""
+
+import numpy as np
+
+from .grid import foreground_mask, reading_order
+
+# 切り分けパラメータのデフォルト値
+DEFAULT_SEGMENT_PARAMS = {
+    'threshold': 200,        # RGBの最小値がこれ未満のピクセルを前景とみなす
+    'scale': 4,              # ラベリング前にこの倍率でマスクを縮小する（矩形の精度もこの単位）
+    'merge_distance': 16,    # この距離（px）以内の断片は同じスタンプとしてまとめる
+    'min_area': 2000,        # 前景ピクセル数がこれ未満の成分は単独のスタンプとみなさない
+    'attach_distance': 48,   # 小さな成分をこの距離（px）以内のスタンプに吸収する
+    'pad': 6,                # 検出した矩形の周囲に付ける余白
+}
+
+
+def downscale_mask(mask, scale):
+    """
+    scale x scale のブロック単位で「1つでも前景があれば前景」として縮小
+    """
+    if scale <= 1:
+        return mask
+    height, width = mask.shape
+    pad_h = -height % scale
+    pad_w = -width % scale
+    if pad_h or pad_w:
+        mask = np.pad(mask, ((0, pad_h), (0, pad_w)))
+    h, w = mask.shape
+    return mask.reshape(h // scale, scale, w // scale, scale).any(axis=(1, 3))
+
+
+def dilate_mask(mask, radius):
+    """
+    (2*radius+1) 四方の正方形で膨張（累積和を使うので半径に関係なく線形時間）
+    """
+    if radius <= 0:
+        return mask
+    result = mask
+    for axis in (0, 1):
+        counts = np.cumsum(result, axis=axis, dtype=np.int32)
+        counts = np.concatenate([np.zeros_like(counts.take([0], axis=axis)), counts], axis=axis)
+        n = result.shape[axis]
+        upper = np.minimum(np.arange(n) + radius + 1, n)
+        lower = np.maximum(np.arange(n) - radius, 0)
+        result = (counts.take(upper, axis=axis) - counts.take(lower, axis=axis)) > 0
+    return result
+
+
+def find_row_runs(mask):
+    """
+    各行の前景ランを抽出
+
+    Returns:
+        (rows, starts, ends)（ends は含まない）。行優先・左から右の順
+    """
+    padded = np.pad(mask, ((0, 0), (1, 1))).astype(np.int8)
+    diff = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(diff == 1)
+    _, ends = np.nonzero(diff == -1)
+    return rows, starts, ends
+
+
+def label_runs(rows, starts, ends, width):
+    """
+    隣接する行のランが重なっていれば同じ成分とする（4近傍）
+
+    重なる組は overlapping_pairs() でまとめて求め、merge_pairs() で併合します。
+    Python のループはラン単位ではなくラウンド単位で、成分の形（蛇行など）に
+    よらず数ラウンドで収まります。
+
+    Returns:
+        各ランの成分ラベル（0 から始まる連番）
+    """
+    count = len(rows)
+    if count == 0:
+        return np.zeros(0, dtype=np.intp)
+
+    below, upper = overlapping_pairs(rows, starts, ends, width)
+    roots, _ = merge_pairs(count, below, upper)
+
+    # 根は成分の中で最も若いランなので、根の昇順がそのまま最初のランの順になる
+    _, labels = np.unique(roots, return_inverse=True)
+    return labels
+
+
+def overlapping_pairs(rows, starts, ends, width):
+    """
+    1行上のランと区間が重なるランの組を求める
+
+    Returns:
+        (下のランの番号, 上のランの番号)
+    """
+    # 行番号でオフセットを付けると全ランが1本の数直線上で昇順に並ぶ
+    stride = width + 2
+    keys_start = rows * stride + starts
+    keys_end = rows * stride + ends
+
+    # 各ランについて、1行上で区間が重なるランの範囲 [lo, hi) を二分探索で求める
+    above = (rows - 1) * stride
+    lo = np.searchsorted(keys_end, above + starts, side='right')
+    hi = np.searchsorted(keys_start, above + ends, side='left')
+    lo = np.minimum(lo, hi)
+
+    lengths = hi - lo
+    below = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    upper = np.repeat(lo, lengths) + offsets
+    return below, upper
+
+
+def merge_pairs(count, first, second):
+    """
+    つながっている組 (first[i], second[i]) から各要素の根を求める
+
+    各ラウンドで、組の両端が別の木に属していれば大きい方の根を小さい方の根に
+    付け替え（np.minimum.at）、ポインタジャンプで全員を根に直結させます。
+    どちらもベクトル演算で、同じ木に収まった組は次のラウンドから除きます。
+    根は常に成分の中で最も小さい番号です。
+
+    Returns:
+        (各要素の根, ラウンド数)
+    """
+    parent = np.arange(count)
+    first = np.asarray(first, dtype=np.intp)
+    second = np.asarray(second, dtype=np.intp)
+    rounds = 0
+    while True:
+        root_a = parent[first]
+        root_b = parent[second]
+        apart = root_a != root_b
+        if not apart.any():
+            return parent, rounds
+        first, second = first[apart], second[apart]
+        root_a, root_b = root_a[apart], root_b[apart]
+        np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+        # 付け替え先も別の根に付け替えられていることがあるので、根に届くまでたどる
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+        rounds += 1
+
+
+def _run_pixels(shape, rows, starts, ends):
+    # ランに含まれるピクセルの通し番号（行優先）
+    lengths = ends - starts
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(rows * shape[1] + starts, lengths) + offsets
+
+
+def _paint_labels(shape, rows, starts, ends, labels):
+    image = np.full(shape, -1, dtype=np.int32)
+    image.ravel()[_run_pixels(shape, rows, starts, ends)] = np.repeat(labels, ends - starts)
+    return image
+
+
+def border_connected(mask):
+    """
+    マスクのうち、画像の四辺につながっている部分だけを返す（4近傍）
+
+    行ごとのランをラベリングして、上下端の行か左右端に触れているランと
+    同じ成分のランだけを残します。ピクセル単位の塗りつぶしは行いません。
+    """
+    height, width = mask.shape
+    result = np.zeros(mask.shape, dtype=bool)
+    rows, starts, ends = find_row_runs(mask)
+    labels = label_runs(rows, starts, ends, width)
+    if len(labels) == 0:
+        return result
+
+    touches = (rows == 0) | (rows == height - 1) | (starts == 0) | (ends == width)
+    keep = np.zeros(labels.max() + 1, dtype=bool)
+    keep[labels[touches]] = True
+    kept = keep[labels]
+    result.ravel()[_run_pixels(mask.shape, rows[kept], starts[kept], ends[kept])] = True
+    return result
+
+
+def _box_gaps(boxes_a, boxes_b):
+    # 矩形同士のすき間（重なっていれば 0）を総当たりで求める
+    a = boxes_a[:, None, :]
+    b = boxes_b[None, :, :]
+    gap_x = np.maximum(0, np.maximum(a[..., 0] - b[..., 2], b[..., 0] - a[..., 2]))
+    gap_y = np.maximum(0, np.maximum(a[..., 1] - b[..., 3], b[..., 1] - a[..., 3]))
+    return np.maximum(gap_x, gap_y)
+
+
+def segment_components(mask, **overrides):
+    """
+    前景マスクをスタンプ単位の矩形に切り分ける
+
+    Returns:
+        [(left, top, right, bottom), ...]（right/bottom は含まない、元の解像度）
+    """
+    params = _resolve_params(overrides)
+    scale = max(1, int(params['scale']))
+    height, width = mask.shape
+
+    small = downscale_mask(mask, scale)
+    radius = int(np.ceil(params['merge_distance'] / (2 * scale)))
+    merged = dilate_mask(small, radius)
+
+    rows, starts, ends = find_row_runs(merged)
+    labels = label_runs(rows, starts, ends, merged.shape[1])
+    if len(labels) == 0:
+        return []
+    count = labels.max() + 1
+
+    # 膨張前の前景ピクセルだけで矩形と面積を求める
+    label_image = _paint_labels(merged.shape, rows, starts, ends, labels)
+    ys, xs = np.nonzero(small)
+    owners = label_image[ys, xs]
+
+    boxes = np.empty((count, 4), dtype=np.int64)
+    boxes[:, :2] = np.iinfo(np.int64).max
+    boxes[:, 2:] = -1
+    np.minimum.at(boxes[:, 0], owners, xs)
+    np.minimum.at(boxes[:, 1], owners, ys)
+    np.maximum.at(boxes[:, 2], owners, xs + 1)
+    np.maximum.at(boxes[:, 3], owners, ys + 1)
+    boxes *= scale
+    boxes[:, 2] = np.minimum(boxes[:, 2], width)
+    boxes[:, 3] = np.minimum(boxes[:, 3], height)
+    areas = np.bincount(owners, minlength=count) * scale * scale
+
+    large = areas >= params['min_area']
+    stamps = boxes[large]
+    if len(stamps) == 0:
+        return []
+
+    # 小さな成分は最も近いスタンプに吸収する（遠すぎるものは捨てる）
+    fragments = boxes[~large]
+    if len(fragments):
+        gaps = _box_gaps(fragments, stamps)
+        nearest = gaps.argmin(axis=1)
+        close = gaps[np.arange(len(fragments)), nearest] <= params['attach_distance']
+        np.minimum.at(stamps[:, 0], nearest[close], fragments[close, 0])
+        np.minimum.at(stamps[:, 1], nearest[close], fragments[close, 1])
+        np.maximum.at(stamps[:, 2], nearest[close], fragments[close, 2])
+        np.maximum.at(stamps[:, 3], nearest[close], fragments[close, 3])
+
+    return [tuple(int(v) for v in box) for box in stamps]
+
+
+def segment_stamps(sheet, **overrides):
+    """
+    シート配列から連結成分ごとのスタンプ矩形を検出
+
+    Args:
+        sheet: シートのRGB/RGBA配列
+        **overrides: DEFAULT_SEGMENT_PARAMS の上書き
+
+    Returns:
+        行優先に並んだセル辞書のリスト（'row', 'col', 'x', 'y', 'w', 'h'）
+        detect_grid() と同じ形式です。
+    """
+    params = _resolve_params(overrides)
+    height, width = sheet.shape[:2]
+    mask = foreground_mask(sheet, params['threshold'])
+    boxes = segment_components(mask, **params)
+
+    pad = params['pad']
+    cells = []
+    for row, col, (left, top, right, bottom) in reading_order(boxes):
+        left = max(0, left - pad)
+        top = max(0, top - pad)
+        right = min(width, right + pad)
+        bottom = min(height, bottom + pad)
+        cells.append({'row': row, 'col': col, 'x': left, 'y': top, 'w': right - left, 'h': bottom - top})
+    return cells
+
+
+def _resolve_params(overrides):
+    unknown = set(overrides) - set(DEFAULT_SEGMENT_PARAMS)
+    if unknown:
+        raise ValueError(f"不明なパラメータ: {', '.join(sorted(unknown))}")
+    params = dict(DEFAULT_SEGMENT_PARAMS)
+    params.update(overrides)
+    return params
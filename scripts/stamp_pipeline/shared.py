@@ -0,0 +1,78 @@
+"""
+ワーカープロセスと共有するシートのバッファ
+
+デコードしたシートを multiprocessing.shared_memory に1回だけ置き、ワーカーには名前・形・型だけの
+小さな辞書（ハンドル）を渡します。ワーカーは同じメモリを NumPy 配列として開き、セルの矩形の
+ビューから自分のセルだけをコピーします（背景透過は配列をその場で書き換えるので、コピーはここで1回だけ）。
+シート全体や切り出しをタスクごとに pickle して送らずに済むので、大きなシートでも並列化の効果が
+シリアライズに食われません。
+"""
+
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# ワーカーで開いている共有メモリ（同じシートのタスクが続く間は開き直さない）
+_attached = {}
+
+
+def start_tracker():
+    """
+    共有メモリを管理する resource_tracker を起動しておく（ワーカーを起動する前に呼ぶ）
+
+    fork したワーカーは起動済みの tracker を引き継ぐので、ワーカーが開いた共有メモリの登録も
+    作成側の削除で外れます。起動前に fork すると、ワーカーごとに別の tracker ができ、
+    終了時に削除済みの共有メモリをリークとして警告します。
+    """
+    resource_tracker.ensure_running()
+
+
+def share_sheet(sheet):
+    """
+    シートの配列を共有メモリにコピーする
+
+    Returns:
+        (SharedMemory, 共有メモリ上の配列, ワーカーに渡すハンドル)。
+        使い終わったら release_sheet() で解放すること。
+    """
+    memory = shared_memory.SharedMemory(create=True, size=max(1, sheet.nbytes))
+    array = np.ndarray(sheet.shape, dtype=sheet.dtype, buffer=memory.buf)
+    array[...] = sheet
+    handle = {'name': memory.name, 'shape': sheet.shape, 'dtype': sheet.dtype.str}
+    return memory, array, handle
+
+
+def release_sheet(memory):
+    """
+    share_sheet() の共有メモリを閉じて削除する
+
+    共有メモリ上の配列（ビュー）が残っていて閉じられない場合も名前は削除し、
+    マッピングは配列が参照されなくなったときに解放されます。
+    """
+    try:
+        memory.close()
+    except BufferError:
+        pass
+    memory.unlink()
+
+
+def attach_sheet(handle):
+    """
+    ハンドルの共有メモリをシートの配列として開く（ワーカープロセスで実行される）
+
+    直前と同じシートなら開いたものを使い回し、別のシートに変わったら前のものを閉じます
+    （監視モードでプールを使い回しても、古いシートのメモリが残り続けないように）。
+    """
+    if _attached.get('name') == handle['name']:
+        return _attached['array']
+
+    if _attached:
+        _attached.pop('array')
+        _attached.pop('memory').close()
+        _attached.clear()
+
+    # ワーカーはプールを作ったプロセスの resource_tracker を共有しているので、登録は作成側の削除で外れる
+    memory = shared_memory.SharedMemory(name=handle['name'])
+    array = np.ndarray(handle['shape'], dtype=np.dtype(handle['dtype']), buffer=memory.buf)
+    _attached.update({'name': handle['name'], 'memory': memory, 'array': array})
+    return array
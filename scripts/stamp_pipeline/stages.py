@@ -0,0 +1,68 @@
+"""
+セルごとの処理ステージ
+
+mask → trim → resize → encode の各ステージは (前のステージの結果, params) を受け取り、
+次のステージへ渡す値を返す関数です。ワーカープロセスで順に適用され、前の結果は次の結果に
+置き換わるので、1セルにつき途中の結果は1つしか残りません。
+ステージの並びを差し替えれば（途中に独自の処理を挟む、トリミングを省くなど）、
+抽出のループを書き直さずに処理を変えられます（ワーカーに渡すのでモジュールの関数にすること）。
+"""
+
+from .core import auto_crop_content, finish_cell, remove_background
+from .encode import encode_image
+
+
+def mask(data, params):
+    """
+    白背景を透過する（RGBA配列 → RGBA配列）
+    """
+    return remove_background(data, params)
+
+
+def trim(data, params):
+    """
+    非透明部分の周りを余白付きで切り詰める（RGBA配列 → RGBA配列）
+    """
+    return auto_crop_content(data, params)
+
+
+def resize(content, params):
+    """
+    キャンバスに収める（RGBA配列 → {密度: PIL Image}）
+    """
+    return finish_cell(content, params)
+
+
+def encode(images, params):
+    """
+    密度ごとにエンコードする（{密度: PIL Image} → {密度: encode_image() の結果}）
+    """
+    return {density: encode_image(image, params) for density, image in images.items()}
+
+# 切り出したセルから保存するバイト列までの既定のステージ
+CELL_STAGES = (mask, trim, resize, encode)
+
+# 背景透過・クロップ済みの配列から始めるときのステージ（まとめて背景透過した場合）
+CONTENT_STAGES = (resize, encode)
+
+# スレッドに回せるステージ（Pillow の zlib / libwebp は GIL を離すので、次のセルの計算と重なる）
+IO_STAGES = (encode,)
+
+
+def split_io_stages(stages):
+    """
+    ステージの並びを (計算のステージ, 末尾の IO_STAGES に含まれるステージ) に分ける
+    """
+    count = len(stages)
+    while count > 0 and stages[count - 1] in IO_STAGES:
+        count -= 1
+    return tuple(stages[:count]), tuple(stages[count:])
+
+
+def run_stages(data, params, stages=CELL_STAGES):
+    """
+    ステージを順に適用した最後の結果を返す（ワーカープロセスで実行される）
+    """
+    for stage in stages:
+        data = stage(data, params)
+    return data
@@ -0,0 +1,122 @@
+"""
+コンテンツアドレスの出力ストア
+
+出力済みのスタンプ（@2x・アトラスを含む）を中身のハッシュ入りのファイル名で hashed/ に公開し、
+元のURL → ハッシュ付きURL と、stamps.ts の id → ハッシュ付きURL のマニフェストを書き出します。
+ファイル名が中身で決まるので、ブラウザは無期限にキャッシュでき、絵が変わらなければデプロイしても
+URL は変わりません。同じ名前のファイルは同じ中身なので、公開済みのものは書き込みません。
+
+    {
+      "version": 1,
+      "files": {"/images/stamps/ao/ao_hello.png": "/images/stamps/hashed/ao/ao_hello.1a2b3c4d5e.png"},
+      "stamps": {"ao_hello": {"src": "/images/stamps/hashed/ao/ao_hello.1a2b3c4d5e.png",
+                              "srcRetina": "/images/stamps/hashed/retina/ao/ao_hello@2x.5e4d3c2b1a.png"}}
+    }
+"""
+
+import hashlib
+import json
+import os
+
+from .atlas import PUBLIC_ROOT, public_url
+from .cache import write_if_changed
+from .phash import IMAGE_EXTENSIONS, list_images
+
+# マニフェストの形式を変えたときに上げる
+STORE_VERSION = 1
+
+# ハッシュ付きファイルを置くディレクトリ（スタンプのルートからの相対パス）とマニフェストのファイル名
+HASHED_DIR = 'hashed'
+ASSET_MANIFEST_NAME = 'assets.json'
+
+# ファイル名に入れるハッシュの長さ（16進数の桁数）
+HASH_LENGTH = 10
+
+# マニフェストに入れる stamps.ts の項目
+STAMP_URL_FIELDS = ('src', 'srcRetina')
+
+
+def content_hash(data):
+    """
+    バイト列のハッシュ（HASH_LENGTH 桁の16進数）
+    """
+    return hashlib.blake2b(data, digest_size=HASH_LENGTH // 2).hexdigest()
+
+
+def hashed_filename(filename, data):
+    """
+    ハッシュ入りのファイル名（ao_hello.png → ao_hello.1a2b3c4d5e.png）
+    """
+    stem, extension = os.path.splitext(filename)
+    return f"{stem}.{content_hash(data)}{extension}"
+
+
+def _url(path, root, public_root):
+    # 公開ディレクトリ以下ならアプリから参照するURL、そうでなければ root からの相対パス
+    if os.path.relpath(os.path.abspath(path), os.path.abspath(public_root)).startswith('..'):
+        return os.path.relpath(path, root).replace(os.sep, '/')
+    return public_url(path, public_root)
+
+
+def _prune(directory, keep):
+    # keep にない画像を消し、空になったディレクトリも消す。消した数を返す
+    removed = 0
+    with os.scandir(directory) as entries:
+        for entry in list(entries):
+            if entry.is_dir():
+                removed += _prune(entry.path, keep)
+                if not os.listdir(entry.path):
+                    os.rmdir(entry.path)
+            elif entry.name.lower().endswith(IMAGE_EXTENSIONS) and os.path.abspath(entry.path) not in keep:
+                os.remove(entry.path)
+                removed += 1
+    return removed
+
+
+def publish_hashed(root, stamp_defs=None, public_root=PUBLIC_ROOT, prune=True):
+    """
+    root 以下の画像をハッシュ付きのファイル名で root/hashed/ に公開し、マニフェストを書き出す
+
+    Args:
+        root: スタンプのルート（public/images/stamps）
+        stamp_defs: read_stamp_defs() の結果（None ならマニフェストの 'stamps' は空）
+        public_root: URL の基準になる公開ディレクトリ
+        prune: 今回公開しなかった（中身が変わって古くなった）ハッシュ付きファイルを消す
+
+    Returns:
+        'manifest'（マニフェストのパス）, 'files'（公開したファイル数）, 'written'（新しく書いた数）,
+        'removed'（消した数）, 'missing'（画像がない stamps.ts の id）の辞書
+    """
+    hashed_root = os.path.join(root, HASHED_DIR)
+    files = {}
+    published = set()
+    written = 0
+    for path in list_images(root, skip_dirs=(HASHED_DIR,)):
+        with open(path, 'rb') as f:
+            data = f.read()
+        relative = os.path.relpath(path, root)
+        hashed_path = os.path.join(hashed_root, os.path.dirname(relative), hashed_filename(os.path.basename(path), data))
+        # 同じ名前なら同じ中身なので、読み比べずに省く
+        if not os.path.exists(hashed_path):
+            os.makedirs(os.path.dirname(hashed_path), exist_ok=True)
+            write_if_changed(hashed_path, data)
+            written += 1
+        files[_url(path, root, public_root)] = _url(hashed_path, root, public_root)
+        published.add(os.path.abspath(hashed_path))
+
+    stamps = {}
+    missing = []
+    for stamp in stamp_defs or []:
+        urls = {field: files[stamp[field]] for field in STAMP_URL_FIELDS if stamp.get(field) in files}
+        if 'src' in urls:
+            stamps[stamp['id']] = urls
+        else:
+            missing.append(stamp['id'])
+
+    removed = _prune(hashed_root, published) if prune and os.path.isdir(hashed_root) else 0
+
+    manifest_path = os.path.join(root, ASSET_MANIFEST_NAME)
+    manifest = {'version': STORE_VERSION, 'files': files, 'stamps': stamps}
+    text = json.dumps(manifest, indent=2, sort_keys=True, ensure_ascii=False) + '\n'
+    write_if_changed(manifest_path, text.encode('utf-8'))
+    return {'manifest': manifest_path, 'files': len(files), 'written': written, 'removed': removed, 'missing': missing}
@@ -0,0 +1,166 @@
+"""
+ヒストグラムによる白背景の閾値の自動決定
+
+セルごとに「背景判定に使う値」（'min' ならRGBの最小値、'mean' / 'mean_std' なら
+RGB合計を3で割った切り捨て）の256段階のヒストグラムを1回だけ作ります。
+値 >= T が背景なので、「閾値 T で何ピクセル残るか」は累積ヒストグラムを引くだけで答えられ、
+閾値を変えて配列全体を何度もマスクし直す必要はありません。
+"""
+
+import numpy as np
+
+# threshold に指定すると自動決定になる
+AUTO_THRESHOLD = 'auto'
+
+# 谷を探す前にヒストグラムをならす幅
+SMOOTH_WIDTH = 5
+
+# いちばん高い山に対してこの割合以上の高さがある明るい山を背景とみなす
+MODE_SHARE = 0.05
+
+
+def feature_histogram(data, params):
+    """
+    背景判定に使う値のヒストグラムを作る
+
+    Args:
+        data: RGBA配列
+        params: 処理パラメータ（'background', 'std_limit', 'alpha_cutoff'）
+
+    Returns:
+        (256段階のヒストグラム, どの閾値でも背景にならないピクセル数)。
+        アルファが alpha_cutoff 以下のピクセルは数えません。
+        'mean_std' で標準偏差が大きいピクセルは後者に入ります。
+    """
+    pixels = data.reshape(-1, 4)
+    pixels = pixels[pixels[:, 3] > params['alpha_cutoff']]
+    rgb = pixels[:, :3]
+
+    mode = params['background']
+    if mode == 'min':
+        return np.bincount(rgb.min(axis=1), minlength=256), 0
+
+    channels = rgb.astype(np.int32)
+    # 平均 >= T は 合計 // 3 >= T と同値（T は整数）
+    feature = channels.sum(axis=1) // 3
+    if mode == 'mean':
+        return np.bincount(feature, minlength=256), 0
+
+    if mode == 'mean_std':
+        r, g, b = channels[:, 0], channels[:, 1], channels[:, 2]
+        spread = (r - g) ** 2 + (g - b) ** 2 + (b - r) ** 2
+        low_spread = spread < 9 * params['std_limit'] ** 2
+        fixed = int(np.count_nonzero(~low_spread))
+        return np.bincount(feature[low_spread], minlength=256), fixed
+
+    raise ValueError(f"不明な背景判定方式: {mode}")
+
+
+def surviving_pixels(histogram, fixed, threshold):
+    """
+    閾値 threshold で背景透過したあとに残る（非透明の）ピクセル数
+    """
+    threshold = min(256, max(0, int(threshold)))
+    return fixed + int(histogram[:threshold].sum())
+
+
+def otsu_threshold(histogram):
+    """
+    クラス間分散が最大になる閾値（大津の方法）。値 >= 閾値 が明るい側
+    """
+    histogram = histogram.astype(np.float64)
+    total = histogram.sum()
+    if total == 0:
+        return 256
+
+    levels = np.arange(256)
+    weight_dark = np.cumsum(histogram)[:-1]
+    weight_bright = total - weight_dark
+    sum_dark = np.cumsum(histogram * levels)[:-1]
+    mean_dark = sum_dark / np.maximum(weight_dark, 1)
+    mean_bright = (sum_dark[-1] + histogram[-1] * 255 - sum_dark) / np.maximum(weight_bright, 1)
+    variance = weight_dark * weight_bright * (mean_dark - mean_bright) ** 2
+    return int(np.argmax(variance)) + 1
+
+
+def bright_modes(smooth, low=0):
+    """
+    low 以上にある明るい山の位置（昇順）
+
+    いちばん高い山に対して MODE_SHARE 以上の高さがある極大だけを数えます。
+    """
+    region = smooth[low:]
+    if region.max() == 0:
+        return []
+    left = np.concatenate([[-1.0], region[:-1]])
+    right = np.concatenate([region[1:], [-1.0]])
+    # 平らな頂上は左端だけを数える
+    peaks = (region > left) & (region >= right) & (region >= MODE_SHARE * region.max())
+    return (low + np.nonzero(peaks)[0]).tolist()
+
+
+def _valley_below(smooth, peak):
+    # 山から暗い方へたどり、最初の谷の閾値を返す
+    valley = peak
+    # 山の裾が途切れた（ピクセルのない値に達した）ところも谷とみなす
+    while valley > 0 and 0 < smooth[valley - 1] <= smooth[valley]:
+        valley -= 1
+    if valley > 0 and smooth[valley - 1] == 0:
+        return valley
+    return valley + 1 if valley < peak else peak
+
+
+def valley_threshold(histogram, low=0, high=256):
+    """
+    背景の山から暗い方へたどり、最初の谷の閾値を返す
+
+    いちばん明るい山から始め、谷が high 以上（内容のとりうる範囲より明るい）なら
+    その下の山も背景とみなしてたどり直します。白い紙の上のクリーム色のパネルのように
+    背景の山が複数ある場合に、パネルの色を内容として残さないためです。
+    low 未満の値は山として扱いません。
+    """
+    kernel = np.ones(SMOOTH_WIDTH) / SMOOTH_WIDTH
+    smooth = np.convolve(histogram.astype(np.float64), kernel, mode='same')
+    modes = bright_modes(smooth, low)
+    if not modes:
+        return 256
+
+    peak = modes[-1]
+    while True:
+        valley = _valley_below(smooth, peak)
+        lower = [mode for mode in modes if mode < valley]
+        if valley < high or not lower:
+            return valley
+        peak = lower[-1]
+
+
+def choose_threshold(histogram, params):
+    """
+    params['threshold_method'] で閾値を決め、params['threshold_range'] に収める
+
+    'valley' で谷が範囲の端に張り付いた（背景と内容の境目が見つからない）ときは
+    大津の方法に切り替えます。
+    """
+    low, high = params['threshold_range']
+    method = params['threshold_method']
+    if method == 'otsu':
+        threshold = otsu_threshold(histogram)
+    elif method == 'valley':
+        threshold = valley_threshold(histogram, low, high)
+        if not low < threshold < high:
+            threshold = otsu_threshold(histogram)
+    else:
+        raise ValueError(f"不明な閾値の決め方: {method}")
+    return min(high, max(low, threshold))
+
+
+def resolve_threshold(data, params):
+    """
+    params['threshold'] が 'auto' なら、セルのヒストグラムから閾値を決めたパラメータを返す
+
+    数値ならそのまま返します。
+    """
+    if params['threshold'] != AUTO_THRESHOLD:
+        return params
+    histogram, _ = feature_histogram(data, params)
+    return dict(params, threshold=choose_threshold(histogram, params))
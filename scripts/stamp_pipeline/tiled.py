@@ -0,0 +1,340 @@
+"""
+巨大なシート向けの逐次（バンド単位）デコード
+
+PNG の IDAT を zlib で少しずつ展開し、数行ずつのバンドに分けて
+Pillow の zip デコーダでフィルタを戻します。各バンドの先頭には
+前のバンドの最終行（フィルタなし）を付けるので、Up/Average/Paeth
+フィルタも正しく復元できます。
+
+セルは自分の範囲の行が揃った時点で切り出して渡すので、シート全体を
+メモリに載せる必要はありません。使用メモリは「処理中のバンド + 途中まで
+埋まっているセル」に比例し、上限（max_memory）からバンドの高さを決めます。
+"""
+
+import struct
+import zlib
+
+from PIL import Image
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# 逐次デコードに対応している8bitのカラータイプ: (Pillowのモード, 1ピクセルのバイト数)
+STREAMABLE_COLOR_TYPES = {
+    0: ('L', 1),
+    2: ('RGB', 3),
+    4: ('LA', 2),
+    6: ('RGBA', 4),
+}
+
+# デコード中に同時に残るバンドの大きさのバッファの数（iter_bands() の各段階で
+# 「zlib ストリームと Pillow の画像」「Pillow の画像と RGBA 配列」のどちらも2つまで）
+BAND_COPIES = 2
+
+_READ_SIZE = 1 << 16
+
+# zlib の無圧縮ブロックの最大の長さ
+_STORED_BLOCK = 0xffff
+
+# Pillow の画像から RGBA 配列に一度に写す大きさ
+_STRIP_BYTES = 1 << 18
+
+# バンドの高さによらない作業メモリ（読み込んだ IDAT・展開した断片と、写している途中の
+# 数行の切り出し・そのバイト列・変換結果）
+_FIXED_BYTES = 4 * _READ_SIZE + 4 * _STRIP_BYTES
+
+
+def read_png_header(path):
+    """
+    PNG の IHDR と、IDAT より前にあるチャンクの種類を読む
+
+    Returns:
+        'width', 'height', 'bit_depth', 'color_type', 'interlace', 'chunks' の辞書。
+        PNG でなければ None
+    """
+    with open(path, 'rb') as f:
+        if f.read(8) != PNG_SIGNATURE:
+            return None
+
+        header = None
+        chunks = set()
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                break
+            length, chunk_type = struct.unpack('>I4s', chunk)
+            if chunk_type == b'IHDR':
+                width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', f.read(13))
+                header = {
+                    'width': width,
+                    'height': height,
+                    'bit_depth': bit_depth,
+                    'color_type': color_type,
+                    'interlace': interlace,
+                }
+                f.seek(4, 1)
+                continue
+            if chunk_type == b'IDAT':
+                break
+            chunks.add(chunk_type.decode('latin-1'))
+            f.seek(length + 4, 1)
+
+    if header is not None:
+        header['chunks'] = chunks
+    return header
+
+
+def can_stream(path):
+    """
+    逐次デコードできる PNG なら True（8bit・インターレースなし・tRNSなし）
+    """
+    header = read_png_header(path)
+    return (
+        header is not None
+        and header['bit_depth'] == 8
+        and header['color_type'] in STREAMABLE_COLOR_TYPES
+        and header['interlace'] == 0
+        and 'tRNS' not in header['chunks']
+    )
+
+
+def _iter_idat(f):
+    # IDAT チャンクの中身を少しずつ返す
+    f.seek(8)
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return
+        length, chunk_type = struct.unpack('>I4s', chunk)
+        if chunk_type == b'IDAT':
+            remaining = length
+            while remaining:
+                data = f.read(min(remaining, _READ_SIZE))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+            f.seek(4, 1)
+        elif chunk_type == b'IEND':
+            return
+        else:
+            f.seek(length + 4, 1)
+
+
+def _stored_stream(size):
+    # size バイトを無圧縮ブロックで包む zlib ストリームの入れ物（ブロックの見出しまで書いたもの）
+    blocks = max(1, -(-size // _STORED_BLOCK))
+    stream = bytearray(2 + size + 5 * blocks + 4)
+    stream[:2] = b'\x78\x01'
+    for block in range(blocks):
+        length = min(_STORED_BLOCK, size - block * _STORED_BLOCK)
+        start = 2 + block * (_STORED_BLOCK + 5)
+        stream[start:start + 5] = struct.pack('<BHH', block == blocks - 1, length, length ^ 0xffff)
+    return stream
+
+
+def _write_stored(stream, offset, data):
+    # ブロックの見出しを飛ばしながら、中身の offset バイト目から data を書き込む
+    view = memoryview(data)
+    while view:
+        block, inside = divmod(offset, _STORED_BLOCK)
+        start = 2 + block * (_STORED_BLOCK + 5) + 5 + inside
+        length = min(len(view), _STORED_BLOCK - inside)
+        stream[start:start + length] = view[:length]
+        view = view[length:]
+        offset += length
+
+
+def iter_bands(path, band_height):
+    """
+    PNG をバンド単位でデコードし、(y, RGBA配列) を上から順に返す
+
+    バンドの大きさのバッファが同時に2つより多く残らないように、展開したデータは
+    Pillow に渡すストリームに直接書き込み、次の段階を作ったらすぐに手放します（BAND_COPIES）。
+    返した配列は次のバンドをデコードする前に手放してください。
+    """
+    header = read_png_header(path)
+    if not can_stream(path):
+        raise ValueError(f"逐次デコードに対応していないPNGです: {path}")
+
+    width = header['width']
+    height = header['height']
+    mode, channels = STREAMABLE_COLOR_TYPES[header['color_type']]
+    row_bytes = 1 + width * channels
+    band_height = max(1, int(band_height))
+    strip_rows = max(1, _STRIP_BYTES // (width * 4))
+
+    inflater = zlib.decompressobj()
+    previous_row = bytes(width * channels)  # 先頭行の「前の行」は0（PNG仕様）
+
+    with open(path, 'rb') as f:
+        idat = _iter_idat(f)
+        y = 0
+        while y < height:
+            rows = min(band_height, height - y)
+
+            # 前のバンドの最終行をフィルタなしで先頭に置き、続けて展開したデータを
+            # 無圧縮の zlib ストリームの中に直接書き込む（Pillow の zip デコーダにフィルタを戻させる）
+            seed = b'\x00' + previous_row
+            size = len(seed) + rows * row_bytes
+            stream = _stored_stream(size)
+            checksum = zlib.adler32(seed)
+            _write_stored(stream, 0, seed)
+            offset = len(seed)
+            while offset < size:
+                data = inflater.unconsumed_tail or next(idat, b'')
+                chunk = inflater.decompress(data, min(size - offset, _READ_SIZE))
+                if not data and not chunk:
+                    raise ValueError(f"PNGのデータが不足しています: {path}")
+                checksum = zlib.adler32(chunk, checksum)
+                _write_stored(stream, offset, chunk)
+                offset += len(chunk)
+            stream[-4:] = struct.pack('>I', checksum)
+
+            band_image = Image.frombytes(mode, (width, rows + 1), stream, 'zip', mode)
+            del stream
+            previous_row = band_image.crop((0, rows, width, rows + 1)).tobytes()
+
+            # np.asarray(band_image) は tobytes() の途中でもう1つ同じ大きさのコピーを作るので、
+            # 数行ずつ RGBA 配列に写す
+            band = np.empty((rows, width, 4), dtype=np.uint8)
+            for top in range(0, rows, strip_rows):
+                bottom = min(rows, top + strip_rows)
+                strip = band_image.crop((0, top + 1, width, bottom + 1))
+                if strip.mode != 'RGBA':
+                    strip = strip.convert('RGBA')
+                band[top:bottom] = np.asarray(strip)
+            del band_image
+
+            yield y, band
+            del band
+            y += rows
+
+
+def peak_cell_bytes(cells, slack=0):
+    """
+    同時に切り出し途中になるセルの合計バイト数の最大値（RGBA）
+
+    バンドの高さが slack 行のとき、下端から slack 行以内に上端がある
+    セルは同じバンドで同時に確保されるので、その分も重なりとして数えます。
+    """
+    events = []
+    for cell in cells:
+        size = cell['w'] * cell['h'] * 4
+        events.append((cell['y'], size))
+        events.append((cell['y'] + cell['h'] + slack, -size))
+
+    peak = current = 0
+    for _, size in sorted(events, key=lambda event: (event[0], event[1])):
+        current += size
+        peak = max(peak, current)
+    return peak
+
+
+def plan_band_height(width, height, cells, max_memory):
+    """
+    メモリ上限に収まる一番高いバンドの高さを決める
+
+    バンドを高くするほどバンドのバッファも、同時に切り出し途中になるセルも増える
+    （どちらも高さについて単調）ので、上限に収まる高さを二分探索で求めます。
+
+    Raises:
+        ValueError: 1行のバンドでも上限を超える場合
+    """
+    row_cost = width * 4 * BAND_COPIES
+
+    def cost(band_height):
+        # Pillow の画像はフィルタを戻すための先頭行の分だけ高い
+        return peak_cell_bytes(cells, band_height) + (band_height + 1) * row_cost + _FIXED_BYTES
+
+    if cost(1) > max_memory:
+        raise ValueError(f"メモリ上限が小さすぎます（少なくとも {cost(1) / (1024 * 1024):.1f} MB 必要です）")
+
+    low, high = 1, max(1, height)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if cost(middle) <= max_memory:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def iter_cells(path, cells, max_memory, stats=None):
+    """
+    シートを逐次デコードしながら、行が揃ったセルから順に切り出す
+
+    Args:
+        path: シートのPNGファイル
+        cells: セル定義のリスト（'x', 'y', 'w', 'h'）
+        max_memory: 作業メモリの上限（バイト）
+        stats: 指定すると 'band_height', 'peak_bytes', 'max_memory' を書き込む
+            'peak_bytes' は測った値ではなく、確保したセルのバッファとバンドのバッファ
+            （BAND_COPIES 個）から数えた見積もりです。
+
+    Yields:
+        (セルの番号, セルのRGBA配列)。下端が上にあるセルから順に返します。
+    """
+    header = read_png_header(path)
+    width = header['width']
+    height = header['height']
+
+    # シートからはみ出す部分は切り詰める（crop_cell と同じ）
+    bounds = []
+    for cell in cells:
+        left = max(0, cell['x'])
+        top = max(0, cell['y'])
+        right = min(width, cell['x'] + cell['w'])
+        bottom = min(height, cell['y'] + cell['h'])
+        bounds.append((left, top, max(left, right), max(top, bottom)))
+
+    clipped = [{'x': l, 'y': t, 'w': r - l, 'h': b - t} for l, t, r, b in bounds]
+    band_height = plan_band_height(width, height, clipped, max_memory)
+
+    # 面積のないセルはデコードを待たずに返す
+    order = []
+    for i, (left, top, right, bottom) in enumerate(bounds):
+        if right == left or bottom == top:
+            yield i, np.zeros((bottom - top, right - left, 4), dtype=np.uint8)
+        else:
+            order.append(i)
+    order.sort(key=lambda i: bounds[i][1])
+
+    waiting = 0
+    active = {}
+    used = peak = 0
+
+    for y0, band in iter_bands(path, band_height):
+        y1 = y0 + band.shape[0]
+        band_bytes = (band.shape[0] + 1) * width * 4 * BAND_COPIES + _FIXED_BYTES
+
+        while waiting < len(order) and bounds[order[waiting]][1] < y1:
+            i = order[waiting]
+            left, top, right, bottom = bounds[i]
+            active[i] = np.empty((bottom - top, right - left, 4), dtype=np.uint8)
+            used += active[i].nbytes
+            waiting += 1
+        peak = max(peak, used + band_bytes)
+
+        finished = []
+        for i in active:
+            left, top, right, bottom = bounds[i]
+            start = max(top, y0)
+            end = min(bottom, y1)
+            if start < end:
+                active[i][start - top:end - top] = band[start - y0:end - y0, left:right]
+            if bottom <= y1:
+                finished.append(i)
+
+        # 渡したセルを手元に残さない（次のバンドのデコード中に数えていないバッファが残る）
+        for i in sorted(finished, key=lambda i: bounds[i][3]):
+            used -= active[i].nbytes
+            yield i, active.pop(i)
+
+        # 次のバンドをデコードする前に手放す（BAND_COPIES に入れていない）
+        del band
+        if waiting == len(order) and not active:
+            break
+
+    if stats is not None:
+        stats.update({'band_height': band_height, 'peak_bytes': peak, 'max_memory': max_memory})
@@ -0,0 +1,196 @@
+"""
+スタンプごと・ステージごとのトレース
+
+各ステージの実時間・CPU時間・確保メモリのピーク（tracemalloc で追える Python / NumPy の分）と、
+不透明ピクセル数や閾値などの統計を記録し、Chrome のトレース形式（chrome://tracing、
+Perfetto で開ける JSON）で書き出します。トレースを有効にしたときだけ計測します。
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from .core import auto_crop_content, finish_cell, remove_background
+from .encode import encode_image
+from .threshold import resolve_threshold
+
+
+# 計測中のスコープ（スレッドの識別子 → 開いているスコープのリスト）。入れ子の内側で reset_peak
+# しても外側のピークを失わないように保持する。tracemalloc のピークはプロセス全体で1つなので、
+# ほかのスレッドと重なったスコープには印を付け、ピークを記録しない
+_open_scopes = {}
+_scopes_lock = threading.Lock()
+
+
+def _now_us():
+    # プロセスをまたいで比べられる単調時計（マイクロ秒）
+    return time.perf_counter_ns() / 1000
+
+
+def _update_open_peaks(peak):
+    for scopes in _open_scopes.values():
+        for scope in scopes:
+            scope['peak'] = max(scope['peak'], peak)
+
+
+@contextmanager
+def traced(events, name, stamp=None, tid=0):
+    """
+    with ブロックの所要時間を1つのイベントとして events に追加する
+
+    yield した辞書に入れた値はイベントの 'args' に入ります。
+    events が None なら何も計測しません。
+    ほかのスレッドの計測と重なったイベントには、どちらの確保か区別できないので
+    'peak_bytes' を入れません（--io-threads で保存と計算を重ねた場合）。
+    """
+    stats = {}
+    if events is None:
+        yield stats
+        return
+
+    thread = threading.get_ident()
+    with _scopes_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        current, peak = tracemalloc.get_traced_memory()
+        _update_open_peaks(peak)
+        scopes = _open_scopes.setdefault(thread, [])
+        scope = {'peak': current, 'shared': len(_open_scopes) > 1}
+        if scope['shared']:
+            for other in _open_scopes.values():
+                for open_scope in other:
+                    open_scope['shared'] = True
+        else:
+            tracemalloc.reset_peak()
+        scopes.append(scope)
+
+    start = _now_us()
+    cpu_start = time.thread_time()
+    try:
+        yield stats
+    finally:
+        cpu = time.thread_time() - cpu_start
+        with _scopes_lock:
+            scopes.pop()
+            if not scopes:
+                del _open_scopes[thread]
+            peak = max(scope['peak'], tracemalloc.get_traced_memory()[1])
+            _update_open_peaks(peak)
+
+        args = {'cpu_ms': round(cpu * 1000, 3)}
+        if not scope['shared']:
+            args['peak_bytes'] = peak - current
+        if stamp is not None:
+            args['stamp'] = stamp
+        args.update(stats)
+        events.append({
+            'name': name,
+            'cat': 'stamp',
+            'ph': 'X',
+            'ts': start,
+            'dur': _now_us() - start,
+            'pid': os.getpid(),
+            'tid': tid,
+            'args': args,
+        })
+
+
+def _pixel_stats(data, params):
+    alpha = data[:, :, 3]
+    return {
+        'pixels': int(alpha.size),
+        'non_transparent': int(np.count_nonzero(alpha > params['alpha_cutoff'])),
+    }
+
+
+def _trace_finish(content, params, events, stamp, tid):
+    # リサイズとエンコードを計測し、{密度: エンコード結果} を返す
+    with traced(events, 'resize', stamp, tid) as stats:
+        images = finish_cell(content, params)
+        stats['sizes'] = {density: list(image.size) for density, image in images.items()}
+
+    outputs = {}
+    for density, image in images.items():
+        with traced(events, 'encode', stamp, tid) as stats:
+            outputs[density] = encode_image(image, params)
+            stats.update({
+                'density': density,
+                'encoder': outputs[density]['encoder'],
+                'bytes': len(outputs[density]['data']),
+            })
+    return outputs
+
+
+def trace_render_cell(data, params, stamp, tid):
+    """
+    render_cell() と同じ処理をステージごとに計測する（ワーカープロセスで実行される）
+
+    Returns:
+        ({密度: エンコード結果}, イベントのリスト)
+    """
+    events = []
+    with traced(events, 'cell', stamp, tid) as summary:
+        with traced(events, 'threshold', stamp, tid) as stats:
+            params = resolve_threshold(data, params)
+            stats['threshold'] = params['threshold']
+
+        with traced(events, 'remove_background', stamp, tid) as stats:
+            transparent = remove_background(data, params)
+            stats.update({'background': params['background'], 'threshold': params['threshold']})
+            stats.update(_pixel_stats(transparent, params))
+
+        with traced(events, 'auto_crop', stamp, tid) as stats:
+            content = auto_crop_content(transparent, params)
+            stats['content_size'] = [content.shape[1], content.shape[0]]
+
+        outputs = _trace_finish(content, params, events, stamp, tid)
+        summary.update(_pixel_stats(content, params))
+        summary['bytes'] = len(outputs[1]['data'])
+    return outputs, events
+
+
+def trace_render_content(content, params, stamp, tid):
+    """
+    render_content() と同じ処理をステージごとに計測する（ワーカープロセスで実行される）
+    """
+    events = []
+    with traced(events, 'cell', stamp, tid) as summary:
+        outputs = _trace_finish(content, params, events, stamp, tid)
+        summary.update(_pixel_stats(content, params))
+        summary['bytes'] = len(outputs[1]['data'])
+    return outputs, events
+
+
+def trace_run_stages(data, params, stages, stamp, tid):
+    """
+    stages.run_stages() と同じ処理をステージ（関数名）ごとに計測する（ワーカープロセスで実行される）
+    """
+    events = []
+    with traced(events, 'cell', stamp, tid):
+        for stage in stages:
+            with traced(events, stage.__name__, stamp, tid):
+                data = stage(data, params)
+    return data, events
+
+
+def write_trace(path, events):
+    """
+    Chrome のトレース形式で保存する（スタンプごとに行の名前を付ける）
+    """
+    names = {}
+    for event in events:
+        stamp = event['args'].get('stamp')
+        if stamp is not None:
+            names.setdefault((event['pid'], event['tid']), stamp)
+
+    metadata = [
+        {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': stamp}}
+        for (pid, tid), stamp in names.items()
+    ]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
@@ -0,0 +1,128 @@
+"""
+シートの監視モード
+
+temporary_upload/ などのシート画像を一定間隔で調べ（os.scandir の更新時刻とサイズ）、
+追加・更新されたシートだけを処理し直します。プロセスプールは起動したまま使い回し、
+デコード済みのシートはファイルの中身のハッシュごとに保持します。
+セル単位のキャッシュと組み合わせると、書き出すのは絵が変わったスタンプだけになります。
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import io
+import os
+import time
+
+from PIL import Image
+import numpy as np
+
+from .batch import SHEET_EXTENSIONS
+from .engine import resolve_workers
+from .shared import start_tracker
+
+# 監視の間隔（秒）
+WATCH_INTERVAL = 0.3
+
+# デコード済みのまま保持するシートの数（元に戻した版はデコードし直さない）
+SHEET_MEMORY = 8
+
+
+def start_pool(workers=None):
+    """
+    監視中に使い回すプロセスプールを起動する（1ワーカーなら None）
+
+    最初の変更を待たせないよう、ワーカープロセスをあらかじめ全部立ち上げておきます。
+    """
+    workers = resolve_workers(workers)
+    if workers == 1:
+        return None
+    start_tracker()
+    executor = ProcessPoolExecutor(max_workers=workers)
+    list(executor.map(abs, range(workers)))
+    return executor
+
+
+def scan_sheets(targets):
+    """
+    監視対象のシート画像の {パス: (更新時刻 ns, サイズ)} を返す
+
+    Args:
+        targets: ディレクトリ（中のシート画像すべて）またはシート画像のパスのリスト
+    """
+    stats = {}
+    for target in targets:
+        if os.path.isdir(target):
+            with os.scandir(target) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.lower().endswith(SHEET_EXTENSIONS):
+                        stat = entry.stat()
+                        stats[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        elif os.path.isfile(target):
+            stat = os.stat(target)
+            stats[target] = (stat.st_mtime_ns, stat.st_size)
+    return stats
+
+
+def iter_changes(targets, interval=WATCH_INTERVAL):
+    """
+    追加・更新されたシートのパスのリストを返し続けるジェネレータ
+
+    最初に既存のシートをすべて返します。書き込み途中のファイルを読まないよう、
+    更新時刻とサイズが2回続けて同じになったものだけを返します。
+    """
+    done = {}
+    previous = scan_sheets(targets)
+    if previous:
+        done.update(previous)
+        yield sorted(previous)
+
+    while True:
+        time.sleep(interval)
+        current = scan_sheets(targets)
+        changed = sorted(path for path, stat in current.items()
+                         if done.get(path) != stat and previous.get(path) == stat)
+        for path in set(done) - set(current):
+            del done[path]
+        previous = current
+        if changed:
+            done.update((path, current[path]) for path in changed)
+            yield changed
+
+
+def new_sheet_cache(limit=SHEET_MEMORY):
+    """
+    load_sheet_cached() で使う、デコード済みシートの置き場
+    """
+    return {'limit': limit, 'digests': {}, 'decoded': OrderedDict()}
+
+
+def load_sheet_cached(sheets, path):
+    """
+    シートを読み込む。中身が前回と同じなら None を返す
+
+    ファイルのハッシュが以前デコードした版と同じなら（保存し直しただけ、元に戻した場合など）
+    デコードせずに保持している配列を返します。
+
+    Returns:
+        (RGBA配列または None, デコードしたかどうか)
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.blake2b(raw, digest_size=20).hexdigest()
+
+    if sheets['digests'].get(path) == digest:
+        return None, False
+    sheets['digests'][path] = digest
+
+    decoded = sheets['decoded']
+    if digest in decoded:
+        decoded.move_to_end(digest)
+        return decoded[digest], False
+
+    with Image.open(io.BytesIO(raw)) as image:
+        sheet = np.array(image.convert('RGBA'))
+    decoded[digest] = sheet
+    while len(decoded) > sheets['limit']:
+        decoded.popitem(last=False)
+    return sheet, True
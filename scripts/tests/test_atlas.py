@@ -0,0 +1,41 @@
+import json
+import os
+
+import pytest
+from PIL import Image
+
+from stamp_pipeline.atlas import write_atlases
+from stamp_pipeline.core import make_params
+
+STAMP_DEFS = [
+    {'id': 'ao_hello', 'src': '/images/stamps/ao/ao_hello.png'},
+    {'id': 'ao_ok', 'src': '/images/stamps/ao/ao_ok.png'},
+    {'id': 'ki_hello', 'src': '/images/stamps/ki/ki_hello.png'},
+]
+
+
+def _save(directory, name, size=16):
+    os.makedirs(directory, exist_ok=True)
+    Image.new('RGBA', (size, size), (200, 100, 50, 255)).save(os.path.join(directory, name))
+
+
+def test_atlas_holds_only_stamps_ts_ids(tmp_path):
+    output_dir = str(tmp_path / 'ao')
+    for name in ('ao_hello.png', 'ao_ok.png', 'ao_good.png'):  # ao_good は以前の出力の残り
+        _save(output_dir, name)
+
+    atlases = write_atlases(output_dir, make_params(), STAMP_DEFS)
+    assert [list(info['frames']) for info in atlases] == [['ao_hello', 'ao_ok']]
+    with open(tmp_path / 'atlas' / 'ao.json', encoding='utf-8') as f:
+        assert list(json.load(f)['frames']) == ['ao_hello', 'ao_ok']
+
+
+def test_missing_stamp_fails_without_writing(tmp_path):
+    output_dir = str(tmp_path / 'ao')
+    _save(output_dir, 'ao_hello.png')
+    _save(output_dir, 'ao_ok.png')
+    _save(str(tmp_path / 'retina' / 'ao'), 'ao_hello@2x.png', 32)  # @2x の ao_ok がない
+
+    with pytest.raises(ValueError, match='ao_ok'):
+        write_atlases(output_dir, make_params(retina=True), STAMP_DEFS)
+    assert not (tmp_path / 'atlas').exists()
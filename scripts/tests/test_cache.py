@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+
+from stamp_pipeline.cache import write_if_changed
+from stamp_pipeline.core import make_params
+from stamp_pipeline.engine import extract_stamps
+
+
+def _sheet():
+    # 白い背景に色の付いた四角を2つ並べたシート
+    sheet = np.full((64, 128, 4), 255, dtype=np.uint8)
+    sheet[16:48, 16:48, :3] = (200, 60, 40)
+    sheet[16:48, 80:112, :3] = (40, 60, 200)
+    return sheet
+
+
+CELLS = [
+    {'name': 'left', 'filename': 'left.png', 'x': 0, 'y': 0, 'w': 64, 'h': 64},
+    {'name': 'right', 'filename': 'right.png', 'x': 64, 'y': 0, 'w': 64, 'h': 64},
+]
+
+
+def _mtimes(results):
+    return [os.stat(result['path']).st_mtime_ns for result in results]
+
+
+def test_second_run_skips_unchanged_cells(tmp_path):
+    output_dir = str(tmp_path / 'out')
+    cache = str(tmp_path / 'cache.json')
+    params = make_params(fit_size=48, canvas_size=56)
+    sheet = _sheet()
+
+    first = extract_stamps(sheet, CELLS, output_dir, params, workers=1, cache=cache)
+    assert [result['cached'] for result in first] == [False, False]
+    before = _mtimes(first)
+
+    # 右のセルだけ描き替える
+    sheet[20:30, 90:100, :3] = 0
+    second = extract_stamps(sheet, CELLS, output_dir, params, workers=1, cache=cache)
+    assert [result['cached'] for result in second] == [True, False]
+    assert _mtimes(second)[0] == before[0]
+
+
+def test_write_if_changed_keeps_mtime(tmp_path):
+    path = str(tmp_path / 'stamp.png')
+    assert write_if_changed(path, b'abc')
+    os.utime(path, ns=(1_000_000_000, 1_000_000_000))
+
+    assert not write_if_changed(path, b'abc')
+    assert os.stat(path).st_mtime_ns == 1_000_000_000
+
+    assert write_if_changed(path, b'abd')
+    with open(path, 'rb') as f:
+        assert f.read() == b'abd'
+    assert not os.path.exists(f"{path}.tmp")
@@ -0,0 +1,47 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from stamp_pipeline.core import make_params
+from stamp_pipeline.encode import _premultiplied, encode_image, psnr
+
+
+def _stamp():
+    # 非可逆 WebP が PNG より小さくなるが、細かいノイズで品質が落ちるスタンプ
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[:96, :96]
+    data = np.zeros((96, 96, 4), dtype=np.uint8)
+    data[..., 0] = x * 2
+    data[..., 1] = y * 2
+    data[..., 2] = rng.integers(0, 256, (96, 96))
+    data[..., 3] = np.where(np.hypot(y - 48, x - 48) < 40, 255, 0)
+    return Image.fromarray(data, 'RGBA')
+
+
+def _quality(image, data):
+    with Image.open(io.BytesIO(data)) as decoded:
+        return psnr(_premultiplied(image), _premultiplied(decoded))
+
+
+@pytest.mark.parametrize('min_psnr', [20.0, 30.0, 40.0, 60.0, 99.0])
+def test_lossy_candidate_meets_min_psnr(min_psnr):
+    image = _stamp()
+    result = encode_image(image, make_params(encoders=('png', 'webp', 'png8'), min_psnr=min_psnr))
+    if result['encoder'] == 'png':
+        assert len(result['data']) == result['reference_size']
+    else:
+        assert _quality(image, result['data']) >= min_psnr
+
+
+def test_low_min_psnr_picks_smaller_lossy_candidate():
+    image = _stamp()
+    result = encode_image(image, make_params(encoders=('png', 'webp'), min_psnr=10.0))
+    assert result['encoder'] == 'webp'
+    assert len(result['data']) < result['reference_size']
+
+
+def test_no_candidate_meets_min_psnr():
+    with pytest.raises(ValueError, match='品質の下限'):
+        encode_image(_stamp(), make_params(encoders=('webp',), min_psnr=99.0))
@@ -0,0 +1,65 @@
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from stamp_pipeline.manifest import manifest_layout
+
+STAMPS_TS = '''export const STAMPS = [
+  { id: 'ao_hello', src: '/images/stamps/ao/ao_hello.png' },
+  { id: 'ao_ok', src: '/images/stamps/ao/ao_ok.png' },
+];
+'''
+
+
+def _write_manifest(tmp_path, stamps, layout=None):
+    sheet = tmp_path / 'ao.png'
+    Image.fromarray(np.full((100, 200, 4), 255, dtype=np.uint8), 'RGBA').save(sheet)
+    manifest = {
+        'sheet': str(sheet),
+        'output': str(tmp_path / 'ao'),
+        'layout': layout or {'method': 'grid', 'rows': 1, 'cols': 2, 'margin': 2},
+        'stamps': stamps,
+    }
+    path = tmp_path / 'ao.json'
+    path.write_text(json.dumps(manifest), encoding='utf-8')
+    return str(path)
+
+
+def _layout(tmp_path, manifest_path, index=None):
+    stamps_ts = tmp_path / 'stamps.ts'
+    stamps_ts.write_text(STAMPS_TS, encoding='utf-8')
+    return manifest_layout(manifest_path, index, str(stamps_ts))
+
+
+def test_grid_manifest_round_trip(tmp_path):
+    path = _write_manifest(tmp_path, [
+        {'id': 'ao_ok', 'cell': [0, 1], 'overrides': {'params': {'threshold': 230}}},
+        {'id': 'ao_hello', 'cell': [0, 0], 'overrides': {'margin': 5}},
+    ])
+    index = str(tmp_path / 'layout.json')
+
+    manifest, sheet, cells, warnings, indexed = _layout(tmp_path, path, index)
+    assert (warnings, indexed, sheet) == ([], False, manifest['sheet'])
+    # マニフェストの順に、stamps.ts の src のファイル名とグリッドの余白（上書き）を当てたセル
+    assert cells == [
+        {'name': 'ao_ok', 'id': 'ao_ok', 'filename': 'ao_ok.png', 'x': 102, 'y': 2, 'w': 96, 'h': 96,
+         'params': {'threshold': 230}},
+        {'name': 'ao_hello', 'id': 'ao_hello', 'filename': 'ao_hello.png', 'x': 5, 'y': 5, 'w': 90, 'h': 90},
+    ]
+
+    # 2回目はインデックスから同じセル定義を返す
+    assert _layout(tmp_path, path, index)[2:] == (cells, [], True)
+
+
+def test_manifest_errors_are_reported_together(tmp_path):
+    path = _write_manifest(tmp_path, [
+        {'id': 'ao_hello', 'cell': [0, 0]},
+        {'id': 'ao_bye', 'cell': [0, 0]},
+    ])
+    with pytest.raises(ValueError) as error:
+        _layout(tmp_path, path)
+    message = str(error.value)
+    assert 'ao_bye: stamps.ts にない id です' in message
+    assert 'ao_bye: cell が ao_hello と重複しています' in message
@@ -0,0 +1,27 @@
+import numpy as np
+
+from stamp_pipeline.phash import find_duplicates, hamming, popcount
+
+
+def test_popcount_matches_int_bit_count():
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 1 << 63, size=1000, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    values[:3] = [0, 1, np.iinfo(np.uint64).max]
+    assert popcount(values).tolist() == [int(value).bit_count() for value in values]
+    assert popcount(np.zeros(0, dtype=np.uint64)).tolist() == []
+
+
+def _entry(value, digest):
+    return {'phash': f"{value:016x}", 'dhash': f"{value:016x}", 'digest': digest, 'blank': False}
+
+
+def test_near_hashes_are_grouped():
+    base = 0x0123456789ABCDEF
+    hashes = {
+        'a.png': _entry(base, 'a'),
+        'b.png': _entry(base ^ 0b1011, 'b'),             # 3ビット違い
+        'c.png': _entry(base ^ ((1 << 40) - 1), 'c'),    # 40ビット違い
+    }
+    assert hamming(base, base ^ 0b1011) == 3
+    groups = find_duplicates(hashes)
+    assert [(group['paths'], group['distance']) for group in groups] == [(['a.png', 'b.png'], 3)]
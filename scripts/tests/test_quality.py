@@ -0,0 +1,60 @@
+import numpy as np
+
+from stamp_pipeline.core import make_params, process_cell
+from stamp_pipeline.quality import check_quality, measure_stack
+
+
+def disc_stamp(size=128, radius=40, fringe=0, fringe_rows=None):
+    # 透明な背景に色の付いた円のスタンプ（fringe を指定すると、その幅の白いフチを
+    # fringe_rows 行目より上（None なら全周）に付ける）
+    y, x = np.ogrid[:size, :size]
+    distance = np.hypot(y - size / 2, x - size / 2)
+    ring = distance < radius + fringe
+    if fringe_rows is not None:
+        ring &= y < fringe_rows
+    stamp = np.zeros((size, size, 4), dtype=np.uint8)
+    stamp[ring] = (255, 255, 255, 255)
+    stamp[distance < radius] = (230, 120, 60, 255)
+    return stamp
+
+
+def _metrics(stamp):
+    metrics = measure_stack(stamp[None])
+    return {name: float(values[0]) for name, values in metrics.items()}
+
+
+def test_clean_stamp_passes():
+    assert check_quality(_metrics(disc_stamp())) == []
+
+
+def test_white_fringe_fails_on_halo():
+    for fringe in (1, 2, 4):
+        problems = check_quality(_metrics(disc_stamp(fringe=fringe)))
+        assert any(problem.startswith('halo') for problem in problems), fringe
+
+
+def test_partial_white_fringe_fails_where_clean_edge_passes():
+    # 輪郭の大部分（下の方を除く）に残った白いフチ（閾値が高すぎてアンチエイリアスの白が残ったとき）
+    halo = lambda problems: any(problem.startswith('halo') for problem in problems)
+    assert not halo(check_quality(_metrics(disc_stamp())))
+    assert halo(check_quality(_metrics(disc_stamp(fringe=2, fringe_rows=96))))
+
+
+def test_retina_removes_white_from_edges():
+    # 白い背景に描いた円。輪郭の4px のアンチエイリアスのうち閾値のすぐ下の明るい色は、
+    # hard のままだと縮小後に白いフチになる。retina では白と混ざる前の色に戻す
+    y, x = np.ogrid[:400, :400]
+    coverage = np.clip((160 - np.hypot(y - 200, x - 200)) / 4, 0, 1)[..., None]
+    cell = np.full((400, 400, 4), 255, dtype=np.uint8)
+    cell[..., :3] = np.round(coverage * (150, 90, 40) + (1 - coverage) * 255)
+
+    plain = process_cell(cell.copy(), make_params(fit_size=240, canvas_size=256))[1]
+    retina = process_cell(cell.copy(), make_params(retina=True))[2]
+    assert _metrics(np.array(retina))['halo'] < _metrics(np.array(plain))['halo'] / 2
+
+
+def test_leftover_background_fails():
+    stamp = disc_stamp()
+    stamp[8:120, 8:120, 3] = 255  # 透過されずに残った背景の矩形
+    stamp[8:120, 8:120, :3] = np.where(stamp[8:120, 8:120, :3] == 0, 255, stamp[8:120, 8:120, :3])
+    assert check_quality(_metrics(stamp))
@@ -0,0 +1,65 @@
+import numpy as np
+
+from stamp_pipeline.segment import (
+    border_connected, find_row_runs, label_runs, merge_pairs, overlapping_pairs,
+)
+
+
+def serpentine(n):
+    # 1列おきの縦線を上下交互の端でつないだ1本の蛇行（右下の端だけが下端に触れる）
+    # 上から順に番号を振ったランに対して、成分をたどる道が上下に何度も往復する
+    mask = np.zeros((n, n), dtype=bool)
+    mask[1:-1, 1:-1:2] = True
+    for x in range(2, n - 2, 2):
+        mask[1 if (x // 2) % 2 == 0 else n - 2, x] = True
+    mask[n - 1, (n - 3) // 2 * 2 + 1] = True
+    return mask
+
+
+def _labels(mask):
+    rows, starts, ends = find_row_runs(mask)
+    return label_runs(rows, starts, ends, mask.shape[1])
+
+
+def _merge_rounds(mask):
+    rows, starts, ends = find_row_runs(mask)
+    below, upper = overlapping_pairs(rows, starts, ends, mask.shape[1])
+    _, rounds = merge_pairs(len(rows), below, upper)
+    return rounds
+
+
+def test_serpentine_is_one_component():
+    mask = serpentine(128)
+    assert set(_labels(mask).tolist()) == {0}
+    assert np.array_equal(border_connected(mask), mask)
+
+
+def test_cut_serpentine_keeps_only_border_side():
+    mask = serpentine(128)
+    mask[-2, 2] = False  # 最初のつなぎを切る（左端の縦線は四辺に触れない）
+    assert set(_labels(mask).tolist()) == {0, 1}
+    kept = border_connected(mask)
+    assert not kept[:, 1].any()
+    assert np.array_equal(kept[:, 3:], mask[:, 3:])
+
+
+def test_labels_follow_first_run():
+    mask = np.array([
+        [1, 0, 1, 0],
+        [0, 0, 1, 0],
+        [1, 1, 1, 0],
+        [0, 0, 0, 1],
+    ], dtype=bool)
+    assert _labels(mask).tolist() == [0, 1, 1, 1, 2]
+
+
+def test_serpentine_merges_in_constant_rounds():
+    # 最小ラベルの伝播では蛇行の長さだけ反復が必要だった。併合のラウンド数は大きさによらない
+    rounds = [_merge_rounds(serpentine(n)) for n in (64, 256, 1024)]
+    assert rounds[0] <= 3
+    assert rounds == [rounds[0]] * len(rounds)
+
+
+def test_merge_pairs_roots_are_smallest_member():
+    roots, _ = merge_pairs(6, [5, 4, 3, 1], [4, 3, 0, 2])
+    assert roots.tolist() == [0, 1, 1, 0, 0, 0]
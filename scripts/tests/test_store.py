@@ -0,0 +1,55 @@
+import json
+import os
+
+from PIL import Image
+
+from stamp_pipeline.store import ASSET_MANIFEST_NAME, HASHED_DIR, publish_hashed
+
+STAMP_DEFS = [
+    {'id': 'ao_hello', 'src': '/images/stamps/ao/ao_hello.png',
+     'srcRetina': '/images/stamps/retina/ao/ao_hello@2x.png'},
+    {'id': 'ao_ok', 'src': '/images/stamps/ao/ao_ok.png'},
+]
+
+
+def _save(path, color, size=16):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new('RGBA', (size, size), color).save(path)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _public(public_root, url):
+    return os.path.join(public_root, *url.lstrip('/').split('/'))
+
+
+def test_publish_round_trip(tmp_path):
+    public_root = str(tmp_path / 'public')
+    root = os.path.join(public_root, 'images', 'stamps')
+    _save(os.path.join(root, 'ao', 'ao_hello.png'), (200, 100, 50, 255))
+    _save(os.path.join(root, 'retina', 'ao', 'ao_hello@2x.png'), (200, 100, 50, 255), 32)
+
+    result = publish_hashed(root, STAMP_DEFS, public_root)
+    assert (result['files'], result['written'], result['missing']) == (2, 2, ['ao_ok'])
+    with open(os.path.join(root, ASSET_MANIFEST_NAME), encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    # id → ハッシュ付きURL の先に、元の画像と同じ中身がある
+    urls = manifest['stamps']['ao_hello']
+    assert manifest['files'][STAMP_DEFS[0]['src']] == urls['src']
+    assert urls['src'].startswith(f"/images/stamps/{HASHED_DIR}/ao/ao_hello.")
+    for field in ('src', 'srcRetina'):
+        assert _read(_public(public_root, urls[field])) == _read(_public(public_root, STAMP_DEFS[0][field]))
+
+    # 変わっていなければ何も書かず、絵が変わったら新しいURLにして古いファイルを消す
+    assert publish_hashed(root, STAMP_DEFS, public_root)['written'] == 0
+    _save(os.path.join(root, 'ao', 'ao_hello.png'), (10, 100, 50, 255))
+    result = publish_hashed(root, STAMP_DEFS, public_root)
+    assert (result['written'], result['removed']) == (1, 1)
+    with open(os.path.join(root, ASSET_MANIFEST_NAME), encoding='utf-8') as f:
+        updated = json.load(f)['stamps']['ao_hello']
+    assert updated['src'] != urls['src'] and updated['srcRetina'] == urls['srcRetina']
+    assert not os.path.exists(_public(public_root, urls['src']))
@@ -0,0 +1,44 @@
+import numpy as np
+
+from stamp_pipeline.core import make_params
+from stamp_pipeline.threshold import choose_threshold
+
+
+def histogram(*peaks):
+    # (中心, 幅, 山の高さ) ごとに三角形の山を足した256段階のヒストグラム
+    levels = np.arange(256)
+    counts = np.zeros(256, dtype=np.int64)
+    for center, width, height in peaks:
+        counts += np.maximum(0, height - np.abs(levels - center) * height // width)
+    return counts
+
+
+# 暗い線画と、アンチエイリアスで暗い方ほど多くなる裾（250 付近まで続く）
+LINE_ART = [(70, 30, 120), (170, 80, 12)]
+
+
+def _valley(counts):
+    return choose_threshold(counts, make_params(threshold_method='valley'))
+
+
+def test_cream_panel_on_white_paper_is_background():
+    # 白い紙（255）の上のクリーム色のパネル（244〜249）。パネルも背景として抜く
+    counts = histogram(*LINE_ART, (255, 2, 20000), (246, 3, 3000))
+    threshold = _valley(counts)
+    assert 200 < threshold <= 243
+
+
+def test_pale_content_below_background_is_kept():
+    # 背景（222）より暗い淡い色の内容（毛布の 203）は背景とみなさない
+    counts = histogram(*LINE_ART, (222, 4, 15000), (203, 4, 2500))
+    threshold = _valley(counts)
+    assert 203 < threshold < 222
+
+
+def test_clamped_valley_falls_back_to_otsu():
+    # 白い紙と内容の間にピクセルがなく、谷が範囲の上端に張り付くときは大津の方法で決める
+    counts = histogram((195, 20, 300), (255, 2, 20000))
+    params = make_params(threshold_method='valley')
+    otsu = choose_threshold(counts, dict(params, threshold_method='otsu'))
+    assert 200 < otsu < 250
+    assert choose_threshold(counts, params) == otsu
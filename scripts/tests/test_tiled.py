@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from stamp_pipeline.tiled import can_stream, iter_bands
+
+
+def _sheet(mode, width=37, height=50):
+    # グラデーションとノイズを混ぜ、PNG のフィルタがいろいろ選ばれるようにする
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[:height, :width]
+    rgba = np.stack([x * 6, y * 5, (x + y) * 3, 255 - y * 4], axis=-1) % 256
+    rgba[::3] = rng.integers(0, 256, rgba[::3].shape)
+    return Image.fromarray(rgba.astype(np.uint8), 'RGBA').convert(mode)
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA', 'L', 'LA'])
+def test_bands_match_full_decode(tmp_path, mode):
+    path = str(tmp_path / f"{mode}.png")
+    image = _sheet(mode)
+    image.save(path)
+    assert can_stream(path)
+
+    # 7 は高さ 50 を割り切らない（最後のバンドは1行）
+    bands = [(y, band.copy()) for y, band in iter_bands(path, 7)]
+    assert [y for y, _ in bands] == list(range(0, 50, 7))
+    with Image.open(path) as full:
+        expected = np.asarray(full.convert('RGBA'))
+    assert np.array_equal(np.concatenate([band for _, band in bands]), expected)
@@ -0,0 +1,44 @@
+import threading
+
+import numpy as np
+
+from stamp_pipeline.trace import traced
+
+
+def test_serial_scopes_record_peak():
+    events = []
+    with traced(events, 'outer'):
+        with traced(events, 'inner'):
+            data = np.ones(1 << 20, dtype=np.uint8)
+        del data
+    inner, outer = events
+    assert inner['args']['peak_bytes'] >= 1 << 20
+    assert outer['args']['peak_bytes'] >= inner['args']['peak_bytes']
+
+
+def test_overlapping_threads_omit_peak():
+    events = []
+    inside = threading.Barrier(2)
+    leave = threading.Barrier(2)
+
+    def work(name):
+        with traced(events, name):
+            inside.wait()
+            data = np.ones(1 << 20, dtype=np.uint8)
+            leave.wait()
+        del data
+
+    threads = [threading.Thread(target=work, args=(name,)) for name in ('a', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(event['name'] for event in events) == ['a', 'b']
+    assert all('peak_bytes' not in event['args'] for event in events)
+
+    # 重なりが終われば、また記録する
+    after = []
+    with traced(after, 'after'):
+        pass
+    assert 'peak_bytes' in after[0]['args']